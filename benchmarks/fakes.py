@@ -0,0 +1,287 @@
+import itertools
+import json
+import logging
+import os
+import re
+import threading
+import time
+import urllib.parse
+from collections import Counter
+from email.parser import BytesParser
+from email.policy import HTTP
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+# Локальные заменители внешних сервисов для нагрузочного теста: Bot API и источники медиа.
+# Оба сервера работают в своих потоках и не делят event loop с ботом.
+
+CHUNK_SIZE = 64 * 1024
+
+
+class _QuietHandler(BaseHTTPRequestHandler):
+    # keep-alive, как у настоящих серверов: клиенты держат пулы соединений
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_body(self, status: int, body: bytes, content_type: str, headers: Optional[Dict] = None):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        if self.command != 'HEAD':
+            self.wfile.write(body)
+
+
+class _Server:
+    handler_class = _QuietHandler
+
+    def __init__(self, host: str = '127.0.0.1', port: int = 0):
+        handler = type('Handler', (self.handler_class,), {'service': self})
+        self.httpd = ThreadingHTTPServer((host, port), handler)
+        self.httpd.daemon_threads = True
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def base_url(self) -> str:
+        host, port = self.httpd.server_address[:2]
+        return f'http://{host}:{port}'
+
+    def start(self):
+        self._thread = threading.Thread(target=self.httpd.serve_forever, name=type(self).__name__, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+# ---------- Источники медиа ----------
+
+class _MediaHandler(_QuietHandler):
+    def do_HEAD(self):
+        self.do_GET()
+
+    def do_GET(self):
+        media = self.service
+        if media.latency:
+            time.sleep(media.latency)
+
+        path = urllib.parse.urlsplit(self.path).path
+        if path.startswith('/video/'):
+            self.send_ranged(media.video, 'video/mp4')
+        elif path.startswith('/image/'):
+            self.send_ranged(media.image, 'image/jpeg')
+        elif match := re.match(r'/tiktok/photo/(\d+)$', path):
+            self.send_body(200, media.tiktok_page(match.group(1)).encode(), 'text/html; charset=utf-8')
+        else:
+            self.send_body(404, b'not found', 'text/plain')
+
+    def send_ranged(self, payload: bytes, content_type: str):
+        start, end = 0, len(payload) - 1
+        status = 200
+        headers = {'Accept-Ranges': 'bytes'}
+
+        match = re.match(r'bytes=(\d*)-(\d*)$', self.headers.get('Range', ''))
+        if match and (match.group(1) or match.group(2)):
+            if match.group(1):
+                start = int(match.group(1))
+                end = min(int(match.group(2)), end) if match.group(2) else end
+            else:
+                start = max(0, len(payload) - int(match.group(2)))
+            if start > end:
+                self.send_body(416, b'', content_type, {'Content-Range': f'bytes */{len(payload)}'})
+                return
+            status = 206
+            headers['Content-Range'] = f'bytes {start}-{end}/{len(payload)}'
+
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(end - start + 1))
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.end_headers()
+        if self.command == 'HEAD':
+            return
+
+        self.service.write_throttled(self.wfile, memoryview(payload)[start:end + 1])
+
+
+class FakeMediaServer(_Server):
+    # Отдает видео (с поддержкой Range), HTML фото-постов TikTok и изображения.
+    # bandwidth - байт в секунду на одно соединение (0 - без ограничения),
+    # latency - задержка перед ответом, секунды.
+    handler_class = _MediaHandler
+
+    def __init__(self, video_size: int, image_size: int, images_per_post: int = 1,
+                 bandwidth: int = 0, latency: float = 0.0, video_file: Optional[str] = None, **kwargs):
+        super().__init__(**kwargs)
+        if video_file:
+            with open(video_file, 'rb') as f:
+                self.video = f.read()
+        else:
+            self.video = self._payload(video_size)
+        self.image = b'\xff\xd8\xff\xe0' + self._payload(max(0, image_size - 4))
+        self.images_per_post = images_per_post
+        self.bandwidth = bandwidth
+        self.latency = latency
+        self.bytes_sent = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _payload(size: int) -> bytes:
+        # Случайный блок, повторенный до нужного размера: не сжимается и строится быстро
+        block = os.urandom(min(size, 1024 * 1024) or 1)
+        return (block * (size // len(block) + 1))[:size]
+
+    def video_url(self, media_id: str) -> str:
+        return f'{self.base_url}/video/{media_id}.mp4'
+
+    def tiktok_page_url(self, post_id: str) -> str:
+        return f'{self.base_url}/tiktok/photo/{post_id}'
+
+    def tiktok_page(self, post_id: str) -> str:
+        # Разметка, которую разбирает tiktok_parser: JSON в __UNIVERSAL_DATA_FOR_REHYDRATION__
+        images = [
+            {'imageURL': {'urlList': [f'{self.base_url}/image/{post_id}_{index}.jpg']}}
+            for index in range(self.images_per_post)
+        ]
+        data = {
+            '__DEFAULT_SCOPE__': {
+                'webapp.video-detail': {
+                    'itemInfo': {'itemStruct': {'id': post_id, 'imagePost': {'images': images}}}
+                }
+            }
+        }
+        return (
+            '<!DOCTYPE html><html><head><title>TikTok</title></head><body>'
+            f'<script id="__UNIVERSAL_DATA_FOR_REHYDRATION__" type="application/json">{json.dumps(data)}</script>'
+            '</body></html>'
+        )
+
+    def write_throttled(self, wfile, data: memoryview):
+        started = time.perf_counter()
+        sent = 0
+        try:
+            for offset in range(0, len(data), CHUNK_SIZE):
+                chunk = data[offset:offset + CHUNK_SIZE]
+                wfile.write(chunk)
+                sent += len(chunk)
+                if self.bandwidth:
+                    delay = sent / self.bandwidth - (time.perf_counter() - started)
+                    if delay > 0:
+                        time.sleep(delay)
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+        finally:
+            with self._lock:
+                self.bytes_sent += sent
+
+
+# ---------- Bot API ----------
+
+class _BotApiHandler(_QuietHandler):
+    def do_POST(self):
+        api = self.service
+        body = self.rfile.read(int(self.headers.get('Content-Length') or 0))
+        if api.latency:
+            time.sleep(api.latency)
+
+        match = re.match(r'/bot[^/]+/(\w+)$', urllib.parse.urlsplit(self.path).path)
+        if not match:
+            self.send_body(404, b'{"ok": false, "error_code": 404, "description": "Not Found"}', 'application/json')
+            return
+
+        method = match.group(1)
+        params = self.parse_params(body)
+        result = api.handle(method, params, len(body))
+        response = json.dumps({'ok': True, 'result': result}).encode()
+        self.send_body(200, response, 'application/json')
+
+    do_GET = do_POST
+
+    def parse_params(self, body: bytes) -> Dict[str, str]:
+        content_type = self.headers.get('Content-Type', '')
+        if content_type.startswith('multipart/form-data'):
+            message = BytesParser(policy=HTTP).parsebytes(
+                f'Content-Type: {content_type}\r\n\r\n'.encode() + body
+            )
+            params = {}
+            for part in message.iter_parts():
+                name = part.get_param('name', header='content-disposition')
+                if name and not part.get_filename():
+                    params[name] = part.get_payload(decode=True).decode()
+            return params
+        return {key: values[0] for key, values in urllib.parse.parse_qs(body.decode()).items()}
+
+
+class FakeBotApi(_Server):
+    # Минимальный Bot API: принимает загрузки и отвечает сообщениями с новыми file_id.
+    # latency - время ответа на любой метод, секунды.
+    handler_class = _BotApiHandler
+
+    def __init__(self, latency: float = 0.0, **kwargs):
+        super().__init__(**kwargs)
+        self.latency = latency
+        self.calls = Counter()
+        self.uploaded_bytes = 0
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+
+    def handle(self, method: str, params: Dict[str, str], body_size: int):
+        with self._lock:
+            self.calls[method] += 1
+            if method.startswith('send'):
+                self.uploaded_bytes += body_size
+
+        chat_id = self._parse_json(params.get('chat_id'), 0)
+        if method == 'getMe':
+            return {'id': 1, 'is_bot': True, 'first_name': 'Bench', 'username': 'bench_bot'}
+        if method == 'sendMessage' or method == 'editMessageText':
+            return self._message(chat_id, text=params.get('text', ''))
+        if method == 'sendVideo':
+            return self._message(chat_id, video=self._video())
+        if method == 'sendPhoto':
+            return self._message(chat_id, photo=[self._photo()])
+        if method == 'sendMediaGroup':
+            items = self._parse_json(params.get('media'), [])
+            return [
+                self._message(chat_id, photo=[self._photo()]) if item.get('type') == 'photo'
+                else self._message(chat_id, video=self._video())
+                for item in items
+            ]
+        return True
+
+    @staticmethod
+    def _parse_json(value: Optional[str], default):
+        if value is None:
+            return default
+        try:
+            return json.loads(value)
+        except ValueError:
+            return value
+
+    def _file_id(self) -> str:
+        return f'bench-file-{next(self._ids)}'
+
+    def _video(self) -> Dict:
+        file_id = self._file_id()
+        return {'file_id': file_id, 'file_unique_id': file_id, 'width': 640, 'height': 360, 'duration': 1}
+
+    def _photo(self) -> Dict:
+        file_id = self._file_id()
+        return {'file_id': file_id, 'file_unique_id': file_id, 'width': 1080, 'height': 1080}
+
+    def _message(self, chat_id, **content) -> Dict:
+        return {
+            'message_id': next(self._ids),
+            'date': int(time.time()),
+            'chat': {'id': chat_id, 'type': 'private'},
+            **content,
+        }
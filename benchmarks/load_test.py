@@ -0,0 +1,341 @@
+import argparse
+import asyncio
+import json
+import os
+import random
+import re
+import resource
+import sys
+import tempfile
+import time
+from collections import defaultdict
+from typing import Dict, List, Optional
+
+from benchmarks.fakes import FakeBotApi, FakeMediaServer
+
+# Нагрузочный тест: тысячи синтетических сообщений проходят через Application
+# с обработчиками бота против локального Bot API и источника медиа.
+# Параллельность ограничивает update_processor с CONCURRENT_UPDATES, как в боте.
+# Настоящие yt-dlp-загрузка, пулы, планировщик, кэши и отправка в Telegram;
+# подменяется только сетевое извлечение info (extract_info) - он отдает форматы
+# на локальном сервере - и адрес страницы TikTok.
+#
+# Запуск из корня репозитория:
+#   python -m benchmarks.load_test --messages 2000 --unique 300 --concurrency 64
+#   python -m benchmarks.load_test --max-concurrent-downloads 10 --bandwidth-kbps 2000 --json bench_output.txt
+
+
+def parse_args(argv=None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description='Нагрузочный тест обработки сообщений бота')
+    parser.add_argument('--messages', type=int, default=2000, help='число сообщений')
+    parser.add_argument('--unique', type=int, default=300,
+                        help='число разных медиа; повторы проходят через кэш file_id и общие загрузки')
+    parser.add_argument('--users', type=int, default=500, help='число пользователей (чатов)')
+    parser.add_argument('--concurrency', type=int,
+                        help='CONCURRENT_UPDATES для прогона (по умолчанию - из конфигурации)')
+    parser.add_argument('--photo-ratio', type=float, default=0.2, help='доля фото-постов TikTok')
+    parser.add_argument('--images-per-post', type=int, default=1, help='фото в посте TikTok (>1 - альбом)')
+    parser.add_argument('--video-size-kb', type=int, default=4096, help='размер видео')
+    parser.add_argument('--video-file', help='отдавать этот файл вместо синтетического видео')
+    parser.add_argument('--image-size-kb', type=int, default=200, help='размер изображения')
+    parser.add_argument('--bandwidth-kbps', type=int, default=0,
+                        help='скорость источника на соединение, КБ/с (0 - без ограничения)')
+    parser.add_argument('--media-latency-ms', type=float, default=20, help='задержка ответа источника медиа')
+    parser.add_argument('--info-latency-ms', type=float, default=200,
+                        help='время извлечения info (вместо запросов yt-dlp к платформе)')
+    parser.add_argument('--api-latency-ms', type=float, default=30, help='задержка ответа Bot API')
+    parser.add_argument('--max-concurrent-downloads', type=int, help='MAX_CONCURRENT_DOWNLOADS и DOWNLOAD_WORKERS для прогона')
+    parser.add_argument('--log-level', default='WARNING', help='уровень логов бота во время прогона')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--json', dest='json_path', help='сохранить результаты в JSON')
+    return parser.parse_args(argv)
+
+
+def configure_environment(args: argparse.Namespace, workdir: str):
+    # Config читает окружение при импорте: все настройки задаются до импорта модулей бота
+    os.environ.update({
+        'BOT_TOKEN': '123456:bench',
+        'QUEUE_BACKEND': '',
+        'METRICS_PORT': '0',
+        'BOT_API_SERVER_URL': '',
+        'BOT_API_LOCAL_MODE': 'false',
+        # Подмена extract_info работает только в потоках этого процесса
+        'EXTRACTION_MODE': 'thread',
+        'MEDIA_CACHE_ENABLED': 'false',
+        'DEBUG_DUMPS_ENABLED': 'false',
+        'LOG_LEVEL': args.log_level,
+        'FILE_ID_CACHE_PATH': os.path.join(workdir, 'file_id_cache.db'),
+        'METADATA_CACHE_PATH': os.path.join(workdir, 'metadata_cache.db'),
+        'DOWNLOAD_JOURNAL_PATH': os.path.join(workdir, 'download_journal.db'),
+        'YTDLP_CACHE_DIR': os.path.join(workdir, 'yt_dlp_cache'),
+    })
+    if args.concurrency:
+        os.environ['CONCURRENT_UPDATES'] = str(args.concurrency)
+    if args.max_concurrent_downloads:
+        os.environ['MAX_CONCURRENT_DOWNLOADS'] = str(args.max_concurrent_downloads)
+        os.environ['DOWNLOAD_WORKERS'] = str(args.max_concurrent_downloads)
+
+
+def build_workload(args: argparse.Namespace) -> List[str]:
+    rng = random.Random(args.seed)
+    photo_count = int(args.unique * args.photo_ratio)
+    urls = []
+    for _ in range(args.messages):
+        index = rng.randrange(args.unique)
+        if index < photo_count:
+            urls.append(f'https://www.tiktok.com/@bench/photo/{7000000000000000000 + index}')
+        else:
+            urls.append(f'https://www.youtube.com/watch?v=bench{index:06d}')
+    return urls
+
+
+def make_extract_info(media: FakeMediaServer, latency: float, target_kbps: int):
+    def extract_info(url: str, opts: Dict, key: Optional[str] = None):
+        time.sleep(latency)
+        match = re.search(r'v=([\w-]{11})', url)
+        if not match:
+            return None, f'Unsupported URL: {url}'
+
+        media_id = match.group(1)
+        size = len(media.video)
+        # Длительность под целевой битрейт, чтобы planner выбрал этот формат
+        duration = max(10, size * 8 // (target_kbps * 1000) + 1)
+        return {
+            'id': media_id,
+            'extractor': 'youtube',
+            'extractor_key': 'Youtube',
+            'title': f'Bench video {media_id}',
+            'uploader': 'Bench',
+            'duration': duration,
+            'webpage_url': url,
+            'formats': [{
+                'format_id': '18',
+                'url': media.video_url(media_id),
+                'ext': 'mp4',
+                'protocol': 'http',
+                'vcodec': 'avc1.42001E',
+                'acodec': 'mp4a.40.2',
+                'height': 360,
+                'width': 640,
+                'filesize': size,
+            }],
+        }, None
+
+    return extract_info
+
+
+def percentile(values: List[float], q: float) -> Optional[float]:
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = max(0, min(len(ordered) - 1, int(round(q / 100 * len(ordered) + 0.5)) - 1))
+    return ordered[index]
+
+
+def summarize(values: List[float]) -> Dict:
+    return {
+        'count': len(values),
+        'p50': percentile(values, 50),
+        'p95': percentile(values, 95),
+        'p99': percentile(values, 99),
+        'max': max(values) if values else None,
+    }
+
+
+def count_open_fds() -> Optional[int]:
+    for fd_dir in ('/proc/self/fd', '/dev/fd'):
+        try:
+            return len(os.listdir(fd_dir))
+        except OSError:
+            continue
+    return None
+
+
+def peak_rss_mb() -> float:
+    # ru_maxrss: килобайты в Linux, байты в macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024 if sys.platform == 'darwin' else 1024)
+
+
+async def sample_fds(state: Dict, stop: asyncio.Event):
+    while not stop.is_set():
+        fds = count_open_fds()
+        if fds is not None:
+            state['peak_fds'] = max(state.get('peak_fds', 0), fds)
+        try:
+            await asyncio.wait_for(stop.wait(), timeout=0.05)
+        except asyncio.TimeoutError:
+            pass
+
+
+async def run(args: argparse.Namespace, workdir: str) -> Dict:
+    configure_environment(args, workdir)
+
+    from telegram import Bot, Update
+    from telegram.ext import Application
+    from telegram.request import HTTPXRequest
+
+    import metrics
+    import youtube_downloader
+    from bot import MediaTelegramBot, register_handlers
+    from config import Config
+    from log_setup import setup_logging
+
+    setup_logging()
+    Config.DOWNLOADS_DIR = os.path.join(workdir, 'downloads')
+    os.makedirs(Config.DOWNLOADS_DIR, exist_ok=True)
+
+    media = FakeMediaServer(
+        video_size=args.video_size_kb * 1024,
+        image_size=args.image_size_kb * 1024,
+        images_per_post=args.images_per_post,
+        bandwidth=args.bandwidth_kbps * 1024,
+        latency=args.media_latency_ms / 1000,
+        video_file=args.video_file,
+    ).start()
+    api = FakeBotApi(latency=args.api_latency_ms / 1000).start()
+
+    youtube_downloader.extract_info = make_extract_info(media, args.info_latency_ms / 1000, Config.FORMAT_TARGET_KBPS)
+
+    # Сырые длительности этапов для перцентилей; гистограмма метрик заполняется как обычно
+    stage_samples: Dict[str, List[float]] = defaultdict(list)
+    observe = metrics.STAGE_SECONDS.observe
+
+    def record_stage(value: float, **labels):
+        stage_samples[labels.get('stage', '')].append(value)
+        observe(value, **labels)
+
+    metrics.STAGE_SECONDS.observe = record_stage
+
+    media_bot = MediaTelegramBot()
+    fetch_page = media_bot.downloader._fetch_tiktok_page
+    media_bot.downloader._fetch_tiktok_page = lambda url: fetch_page(
+        media.tiktok_page_url(re.search(r'/photo/(\d+)', url).group(1))
+    )
+
+    # Пул соединений как у Application.builder() по умолчанию
+    request = HTTPXRequest(connection_pool_size=256, read_timeout=Config.UPLOAD_TIMEOUT)
+    bot = Bot(Config.BOT_TOKEN, base_url=f'{api.base_url}/bot', base_file_url=f'{api.base_url}/file/bot',
+              request=request)
+    application = Application.builder().bot(bot).concurrent_updates(Config.CONCURRENT_UPDATES).build()
+    register_handlers(application, media_bot)
+
+    failures = 0
+
+    async def count_failure(update, context):
+        nonlocal failures
+        failures += 1
+        print(f'Обновление {getattr(update, "update_id", "-")} завершилось исключением: {context.error!r}',
+              file=sys.stderr)
+
+    application.add_error_handler(count_failure)
+
+    urls = build_workload(args)
+    latencies: List[float] = []
+    resources = {}
+    stop_sampling = asyncio.Event()
+
+    async def send(index: int, url: str):
+        user_id = 1000 + index % args.users
+        update = Update.de_json({
+            'update_id': index,
+            'message': {
+                'message_id': index + 1,
+                'date': int(time.time()),
+                'chat': {'id': user_id, 'type': 'private'},
+                'from': {'id': user_id, 'is_bot': False, 'first_name': 'Bench'},
+                'text': url,
+            },
+        }, bot)
+
+        # Тот же путь, что у Application при получении обновления: update_processor
+        # пропускает не больше CONCURRENT_UPDATES обновлений одновременно
+        started = time.perf_counter()
+        await application.update_processor.process_update(update, application.process_update(update))
+        latencies.append(time.perf_counter() - started)
+
+    async with application:
+        fds_before = count_open_fds()
+        rss_before = peak_rss_mb()
+        sampler = asyncio.create_task(sample_fds(resources, stop_sampling))
+
+        started = time.perf_counter()
+        await asyncio.gather(*(send(index, url) for index, url in enumerate(urls)))
+        elapsed = time.perf_counter() - started
+
+        # Дожидаемся фоновых правок и удаления статусов, чтобы они не оборвались при закрытии
+        pending = [task for task in asyncio.all_tasks()
+                   if task is not asyncio.current_task() and task is not sampler]
+        if pending:
+            await asyncio.wait(pending, timeout=10)
+
+        stop_sampling.set()
+        await sampler
+        fds_after = count_open_fds()
+
+    await media_bot.downloader.close()
+    media.stop()
+    api.stop()
+
+    deliveries = defaultdict(float)
+    for (platform, source), value in metrics.DELIVERIES.snapshot().items():
+        deliveries[source] += value
+    errors = defaultdict(float)
+    for (reason, platform), value in metrics.ERRORS.snapshot().items():
+        errors[reason] += value
+
+    return {
+        'messages': len(urls),
+        'unique_media': args.unique,
+        'concurrency': Config.CONCURRENT_UPDATES,
+        'max_concurrent_downloads': Config.MAX_CONCURRENT_DOWNLOADS,
+        'elapsed_seconds': elapsed,
+        'requests_per_second': len(urls) / elapsed if elapsed else None,
+        'failures': failures,
+        'deliveries': dict(deliveries),
+        'errors': dict(errors),
+        'latency': summarize(latencies),
+        'stages': {stage: summarize(values) for stage, values in sorted(stage_samples.items())},
+        'bot_api_calls': dict(api.calls),
+        'uploaded_mb': api.uploaded_bytes / 1024 / 1024,
+        'source_mb': media.bytes_sent / 1024 / 1024,
+        'peak_rss_mb': peak_rss_mb(),
+        'rss_before_mb': rss_before,
+        'open_fds': {'before': fds_before, 'peak': resources.get('peak_fds'), 'after': fds_after},
+    }
+
+
+def format_seconds(value: Optional[float]) -> str:
+    return '-' if value is None else f'{value * 1000:.0f} мс'
+
+
+def print_report(result: Dict):
+    print(f"Сообщений: {result['messages']} (разных медиа: {result['unique_media']}), "
+          f"CONCURRENT_UPDATES: {result['concurrency']}, MAX_CONCURRENT_DOWNLOADS: {result['max_concurrent_downloads']}")
+    print(f"Время: {result['elapsed_seconds']:.1f} с, {result['requests_per_second']:.1f} запросов/с")
+    print(f"Доставлено: {result['deliveries']}, ошибки: {result['errors']}, исключения: {result['failures']}")
+    print(f"Bot API: {result['bot_api_calls']}, отправлено {result['uploaded_mb']:.1f} МБ, "
+          f"скачано из источника {result['source_mb']:.1f} МБ")
+    print(f"Пиковый RSS: {result['peak_rss_mb']:.0f} МБ (до прогона {result['rss_before_mb']:.0f} МБ), "
+          f"открытые fd: {result['open_fds']}")
+    print()
+    print(f"{'этап':<14}{'count':>8}{'p50':>12}{'p95':>12}{'p99':>12}{'max':>12}")
+    rows = [('end_to_end', result['latency'])] + list(result['stages'].items())
+    for stage, stats in rows:
+        print(f"{stage:<14}{stats['count']:>8}{format_seconds(stats['p50']):>12}{format_seconds(stats['p95']):>12}"
+              f"{format_seconds(stats['p99']):>12}{format_seconds(stats['max']):>12}")
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    with tempfile.TemporaryDirectory(prefix='bot-bench-') as workdir:
+        result = asyncio.run(run(args, workdir))
+
+    print_report(result)
+    if args.json_path:
+        with open(args.json_path, 'w', encoding='utf-8') as f:
+            json.dump(result, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,20 +1,44 @@
 import asyncio
+import json
 import logging
-import os
 import re
 import time
 from pathlib import Path
-from telegram import Update
+from contextlib import ExitStack
+from typing import List, Optional, Tuple
+from telegram import Bot, InputMediaPhoto, InputMediaVideo, Update
+from telegram.error import TelegramError
 from telegram.ext import Application, CommandHandler, MessageHandler, filters, ContextTypes
+from cache import FileIdCache
+import metrics
 from config import Config
-from youtube_downloader import MediaDownloader
+from job_queue import create_job_queue
+from log_setup import set_request_id, setup_logging
+from scheduler import PRIORITY_HIGH, PRIORITY_NORMAL, FairScheduler
+from singleflight import Flight, SingleFlight
+from status import EditRateLimiter, StatusMessage
+from youtube_downloader import MediaDownloader, MediaFile, MediaGroup, MediaJob
 
-logging.basicConfig(
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    level=logging.INFO
-)
 logger = logging.getLogger(__name__)
 
+# Обработчики работают только с обычными сообщениями, остальные типы обновлений не запрашиваем
+ALLOWED_UPDATES = [Update.MESSAGE]
+
+# Telegram принимает в sendMediaGroup от 2 до 10 элементов
+MEDIA_GROUP_LIMIT = 10
+
+
+def get_bot_api_settings() -> dict:
+    # Параметры собственного сервера Bot API для Bot и Application.builder();
+    # пустой словарь - публичный api.telegram.org
+    if not Config.BOT_API_SERVER_URL:
+        return {}
+    return {
+        'base_url': f"{Config.BOT_API_SERVER_URL}/bot",
+        'base_file_url': f"{Config.BOT_API_SERVER_URL}/file/bot",
+        'local_mode': Config.BOT_API_LOCAL_MODE,
+    }
+
 
 def escape_markdown_v2(text: str) -> str:
     if not text:
@@ -31,10 +55,37 @@ def escape_markdown_v2(text: str) -> str:
 class MediaTelegramBot:
     def __init__(self):
         self.downloader = MediaDownloader()
-        self.download_semaphore = asyncio.Semaphore(Config.MAX_CONCURRENT_DOWNLOADS)
-        self.active_downloads = 0
+        self.file_id_cache = FileIdCache(
+            Config.FILE_ID_CACHE_PATH,
+            Config.FILE_ID_CACHE_TTL_HOURS,
+            Config.FILE_ID_CACHE_MAX_ENTRIES
+        )
+        self.scheduler = FairScheduler(Config.MAX_CONCURRENT_DOWNLOADS, Config.PER_USER_CONCURRENT_DOWNLOADS)
+        self.inflight = SingleFlight()
+        self.status_limiter = EditRateLimiter(
+            Config.STATUS_EDITS_PER_SECOND,
+            Config.STATUS_CHAT_EDIT_INTERVAL
+        )
+        self.job_queue = create_job_queue()
         self.total_processed = 0
 
+        metrics.POOL_TASKS.set_function(self.get_pool_samples)
+        metrics.SCHEDULER_DOWNLOADS.set_function(lambda: [
+            (('active',), self.scheduler.active),
+            (('waiting',), self.scheduler.waiting),
+        ])
+
+    def get_pool_samples(self):
+        for name, stats in self.downloader.get_pool_stats().items():
+            yield (name, 'active'), stats['active']
+            yield (name, 'queued'), stats['queued']
+
+    @staticmethod
+    def get_media_bytes(media) -> int:
+        if isinstance(media, MediaGroup):
+            return sum(item.size for item in media.items)
+        return media.size
+
     async def start_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         welcome_message = (
             f"📋 *Инструкция по использованию:*\n\n"
@@ -86,11 +137,26 @@ class MediaTelegramBot:
                     return True
         return False
 
+    def get_priority(self, media_info: dict, is_photo: bool) -> int:
+        duration = media_info.get('duration') or 0
+        filesize = media_info.get('filesize') or 0
+
+        if is_photo or (duration and duration <= Config.PRIORITY_MAX_DURATION):
+            return PRIORITY_HIGH
+        if filesize and filesize <= Config.PRIORITY_MAX_FILESIZE:
+            return PRIORITY_HIGH
+        return PRIORITY_NORMAL
+
     async def handle_message(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        # Новый id на каждое сообщение: задачи, созданные дальше, наследуют его в логах
+        set_request_id()
         message_text = update.message.text.strip()
 
         if self.is_supported_url(message_text):
-            await self.download_media(update, context, message_text)
+            if self.job_queue is not None:
+                await self.enqueue_media(update, context, message_text)
+            else:
+                await self.download_media(update, context, message_text)
         else:
             await update.message.reply_text(
                 f"{Config.STATUS_EMOJIS['error']} *Неподдерживаемая ссылка*\n\n"
@@ -100,9 +166,246 @@ class MediaTelegramBot:
                 parse_mode='MarkdownV2'
             )
 
+    def build_caption(self, platform_info: dict, title: str, uploader: str) -> str:
+        safe_title_caption = escape_markdown_v2(title[:50])
+        safe_uploader_caption = escape_markdown_v2(uploader)
+
+        return (
+            f"{platform_info['emoji']} {safe_title_caption}\n"
+            f"👤 {safe_uploader_caption}"
+        )
+
+    async def send_media(self, bot: Bot, chat_id: int, media, is_photo: bool,
+                         caption: str, filename: Optional[str] = None):
+        if is_photo:
+            return await bot.send_photo(
+                chat_id=chat_id,
+                photo=media,
+                caption=caption,
+                parse_mode='MarkdownV2',
+                filename=filename,
+                read_timeout=Config.UPLOAD_TIMEOUT,
+                write_timeout=Config.UPLOAD_TIMEOUT
+            )
+
+        return await bot.send_video(
+            chat_id=chat_id,
+            video=media,
+            caption=caption,
+            parse_mode='MarkdownV2',
+            supports_streaming=True,
+            filename=filename,
+            read_timeout=Config.UPLOAD_TIMEOUT,
+            write_timeout=Config.UPLOAD_TIMEOUT
+        )
+
+    async def send_album(self, bot: Bot, chat_id: int, items: List[Tuple[str, object, Optional[str]]],
+                         caption: str) -> List[Tuple[str, str]]:
+        # items: (тип, файл или file_id, имя файла). Альбом уходит частями по 10,
+        # подпись - у первого элемента. Возвращает (тип, file_id) отправленных элементов.
+        sent = []
+        for start in range(0, len(items), MEDIA_GROUP_LIMIT):
+            chunk = items[start:start + MEDIA_GROUP_LIMIT]
+            chunk_caption = caption if start == 0 else None
+
+            if len(chunk) == 1:
+                media_type, media, filename = chunk[0]
+                message = await self.send_media(bot, chat_id, media, media_type == 'photo',
+                                                chunk_caption, filename=filename)
+                sent.append((media_type, self.get_sent_file_id(message, media_type == 'photo')))
+                continue
+
+            input_media = []
+            for index, (media_type, media, filename) in enumerate(chunk):
+                item_caption = chunk_caption if index == 0 else None
+                if media_type == 'photo':
+                    input_media.append(InputMediaPhoto(
+                        media, caption=item_caption, parse_mode='MarkdownV2', filename=filename
+                    ))
+                else:
+                    input_media.append(InputMediaVideo(
+                        media, caption=item_caption, parse_mode='MarkdownV2',
+                        supports_streaming=True, filename=filename
+                    ))
+
+            messages = await bot.send_media_group(
+                chat_id=chat_id,
+                media=input_media,
+                read_timeout=Config.UPLOAD_TIMEOUT,
+                write_timeout=Config.UPLOAD_TIMEOUT
+            )
+            for (media_type, _, _), message in zip(chunk, messages):
+                sent.append((media_type, self.get_sent_file_id(message, media_type == 'photo')))
+
+        return sent
+
+    async def send_file_id(self, bot: Bot, chat_id: int, file_id: str, media_type: str, caption: str):
+        if media_type == 'album':
+            items = [(item_type, item_id, None) for item_type, item_id in json.loads(file_id)]
+            await self.send_album(bot, chat_id, items, caption)
+        else:
+            await self.send_media(bot, chat_id, file_id, media_type == 'photo', caption)
+
+    async def send_downloaded_media(self, bot: Bot, chat_id: int, media, is_photo: bool,
+                                    caption: str) -> Tuple[Optional[str], str]:
+        # Отправляет скачанный файл или альбом, возвращает (file_id, тип) для кэша
+        if isinstance(media, MediaGroup):
+            with ExitStack() as stack:
+                items = [
+                    (item.media_type or 'photo', self.get_upload_input(bot, item, stack), item.filename)
+                    for item in media.items
+                ]
+                sent = await self.send_album(bot, chat_id, items, caption)
+
+            if not sent or not all(file_id for _, file_id in sent):
+                return None, 'album'
+            return json.dumps(sent), 'album'
+
+        with ExitStack() as stack:
+            sent_message = await self.send_media(bot, chat_id, self.get_upload_input(bot, media, stack),
+                                                 is_photo, caption, filename=media.filename)
+        return self.get_sent_file_id(sent_message, is_photo), 'photo' if is_photo else 'video'
+
+    @staticmethod
+    def get_upload_input(bot: Bot, media: MediaFile, stack: ExitStack):
+        # Сервер Bot API в режиме --local читает файл с диска сам: передаем путь вместо байтов
+        if bot.local_mode and not media.in_memory:
+            return Path(media.path).absolute()
+        return stack.enter_context(media.open())
+
+    async def send_cached_media(self, bot: Bot, chat_id: int, media_key: str, platform_info: dict) -> bool:
+        cached = self.file_id_cache.get(media_key)
+        metrics.CACHE_REQUESTS.inc(cache='file_id', result='hit' if cached else 'miss')
+        if not cached:
+            return False
+
+        caption = self.build_caption(platform_info, cached['title'], cached['uploader'])
+        try:
+            await self.send_file_id(bot, chat_id, cached['file_id'], cached['media_type'], caption)
+        except TelegramError as e:
+            logger.warning(f"Не удалось отправить {media_key} из кэша file_id: {e}")
+            self.file_id_cache.invalidate(media_key)
+            return False
+
+        return True
+
+    def get_sent_file_id(self, sent_message, is_photo: bool) -> Optional[str]:
+        if is_photo:
+            return sent_message.photo[-1].file_id if sent_message.photo else None
+
+        media = sent_message.video or sent_message.animation or sent_message.document
+        return media.file_id if media else None
+
+    def remember_file_id(self, media_keys: list, file_id: Optional[str], media_type: str, title: str, uploader: str):
+        if not file_id:
+            return
+
+        for media_key in set(filter(None, media_keys)):
+            try:
+                self.file_id_cache.put(media_key, file_id, media_type, title, uploader)
+            except Exception as e:
+                logger.error(f"Ошибка записи в кэш file_id для {media_key}: {e}")
+
+    def remove_media(self, media: Optional[MediaFile]):
+        if media is not None and media.exists():
+            try:
+                media.remove()
+                if media.path:
+                    logger.info(f"Файл {media.path} удален после обработки")
+            except Exception as cleanup_error:
+                logger.error(f"Ошибка при удалении файла {media.path}: {cleanup_error}")
+
+    async def open_status(self, bot: Bot, chat_id: int, text: str, status_message_id: Optional[int] = None,
+                          reply_to_message_id: Optional[int] = None, platform: str = '') -> StatusMessage:
+        # Воркер получает id статусного сообщения, созданного фронтендом, и продолжает его обновлять
+        if status_message_id is not None:
+            status = StatusMessage(bot, chat_id, status_message_id, self.status_limiter, platform=platform)
+            status.update(text)
+            return status
+
+        status_message = await bot.send_message(
+            chat_id=chat_id,
+            text=text,
+            parse_mode='MarkdownV2',
+            reply_to_message_id=reply_to_message_id
+        )
+        return StatusMessage(bot, chat_id, status_message.message_id, self.status_limiter, text=text,
+                             platform=platform)
+
+    async def send_shared_media(self, bot: Bot, chat_id: int, user_id: int, flight: Flight,
+                                platform_info: dict, is_photo: bool, status: StatusMessage,
+                                platform: str = '') -> bool:
+        status.update(
+            f"{Config.STATUS_EMOJIS['processing']} *Ссылка уже обрабатывается*\n\n"
+            f"{platform_info['emoji']} Ожидаю завершения загрузки\\.\\.\\."
+        )
+
+        try:
+            result = await self.inflight.wait(flight)
+            if not result:
+                return False
+
+            if result.get('error'):
+                metrics.ERRORS.inc(reason=result['reason'], platform=platform)
+                status.finish(result['error'], parse_mode=result['parse_mode'])
+                logger.info(f"Ошибка общей загрузки {flight.key} передана пользователю {user_id}: {result['reason']}")
+                return True
+
+            caption = self.build_caption(platform_info, result['title'], result['uploader'])
+            if result.get('file_id'):
+                await self.send_file_id(bot, chat_id, result['file_id'], result['media_type'], caption)
+            elif result.get('media') and result['media'].exists():
+                with metrics.STAGE_SECONDS.time(stage='upload', platform=platform):
+                    await self.send_downloaded_media(bot, chat_id, result['media'], is_photo, caption)
+                metrics.UPLOADED_BYTES.inc(self.get_media_bytes(result['media']), platform=platform)
+            else:
+                return False
+
+            metrics.DELIVERIES.inc(platform=platform, source='shared')
+            status.delete()
+            self.total_processed += 1
+            logger.info(f"Медиа {flight.key} отправлено пользователю {user_id} из общей загрузки")
+            return True
+
+        except TelegramError as e:
+            logger.warning(f"Не удалось отправить общую загрузку {flight.key}: {e}")
+            return False
+
+    async def enqueue_media(self, update: Update, context: ContextTypes.DEFAULT_TYPE, url: str):
+        status_message = await update.message.reply_text(
+            f"{Config.STATUS_EMOJIS['processing']} *Ссылка принята*\n\n"
+            f"🕐 Ожидает свободного воркера\\.\\.\\.",
+            parse_mode='MarkdownV2'
+        )
+
+        job_id = await asyncio.to_thread(
+            self.job_queue.enqueue,
+            url,
+            update.effective_chat.id,
+            update.effective_user.id,
+            status_message.message_id
+        )
+        logger.info(f"Задание {job_id} поставлено в очередь для пользователя {update.effective_user.id}")
+
     async def download_media(self, update: Update, context: ContextTypes.DEFAULT_TYPE, url: str):
-        chat_id = update.effective_chat.id
-        user_id = update.effective_user.id
+        reply_to_message_id = None
+        if update.effective_chat.type != 'private':
+            reply_to_message_id = update.message.message_id
+
+        await self.deliver_media(
+            context.bot,
+            update.effective_chat.id,
+            update.effective_user.id,
+            url,
+            reply_to_message_id=reply_to_message_id
+        )
+
+    async def deliver_media(self, bot: Bot, chat_id: int, user_id: int, url: str,
+                            status_message_id: Optional[int] = None, reply_to_message_id: Optional[int] = None):
+        # Короткие ссылки разворачиваются один раз, дальше все этапы работают с полной
+        platform = self.downloader.detect_platform(url)
+        with metrics.STAGE_SECONDS.time(stage='resolve', platform=platform):
+            url = await self.downloader.resolve_url(url)
         
         platform_info = self.downloader.get_platform_info(url)
         
@@ -110,57 +413,113 @@ class MediaTelegramBot:
         is_photo = '/photo/' in url.lower()
         content_type = "фото" if is_photo else "видео"
         content_emoji = "📸" if is_photo else "📹"
-        
-        async with self.download_semaphore:
-            self.active_downloads += 1
-            logger.info(f"Начинаю загрузку {content_type} для пользователя {user_id}. Активных загрузок: {self.active_downloads}")
-            
-            status_message = await update.message.reply_text(
+
+        url_media_key = self.downloader.get_media_key(url)
+        if url_media_key and await self.send_cached_media(bot, chat_id, url_media_key, platform_info):
+            if status_message_id is not None:
+                StatusMessage(bot, chat_id, status_message_id, self.status_limiter).delete()
+            self.total_processed += 1
+            metrics.DELIVERIES.inc(platform=platform, source='file_id')
+            logger.info(f"Медиа отправлено пользователю {user_id} из кэша file_id ({url_media_key})")
+            return
+
+        # Одновременные запросы одного и того же медиа ждут одну загрузку. Присоединение
+        # идет сразу после промаха кэша, без await между ними: лидер пишет file_id в кэш
+        # до публикации результата, поэтому опоздавший запрос найдет либо file_id, либо
+        # текущую загрузку, и не начнет скачивание заново
+        flight, is_leader = self.inflight.join(url_media_key or url)
+        try:
+            status = await self.open_status(
+                bot,
+                chat_id,
                 f"{Config.STATUS_EMOJIS['processing']} *Обработка запроса*\n\n"
                 f"{platform_info['emoji']} Платформа: {platform_info['name']}\n"
                 f"{content_emoji} Тип: {content_type}\n"
-                f"👥 В очереди: {self.active_downloads}\n"
+                f"👥 В очереди: {self.scheduler.waiting}\n"
                 f"🔄 Получение информации\\.\\.\\.",
+                status_message_id,
+                reply_to_message_id,
+                platform
+            )
+
+            if is_leader:
+                await self.process_media(bot, chat_id, user_id, url, url_media_key, platform_info, is_photo,
+                                         status, flight)
+            elif not await self.send_shared_media(bot, chat_id, user_id, flight, platform_info, is_photo, status,
+                                                  platform):
+                await self.process_media(bot, chat_id, user_id, url, url_media_key, platform_info, is_photo,
+                                         status)
+        finally:
+            if is_leader:
+                # Лидер мог не дойти до process_media (ошибка открытия статуса): ожидающие не должны зависнуть
+                self.inflight.publish(flight, None)
+            if self.inflight.release(flight):
+                self.remove_media(flight.media)
+
+    async def process_media(self, bot: Bot, chat_id: int, user_id: int, url: str,
+                            url_media_key: Optional[str], platform_info: dict, is_photo: bool,
+                            status: StatusMessage, flight: Optional[Flight] = None):
+        job = MediaJob(url)
+        platform = self.downloader.detect_platform(url)
+        content_type = "фото" if is_photo else "видео"
+        content_emoji = "📸" if is_photo else "📹"
+        
+        job.on_progress = status.set_progress
+
+        media = None
+        title = uploader = ''
+        try:
+            status.update(
+                f"{Config.STATUS_EMOJIS['processing']} *Получение информации*\n\n"
+                f"{platform_info['emoji']} {platform_info['name']}\n"
+                f"{content_emoji} Анализ {content_type}\\.\\.\\.",
                 parse_mode='MarkdownV2'
             )
             
-            file_path = None
-            try:
-                await status_message.edit_text(
-                    f"{Config.STATUS_EMOJIS['processing']} *Получение информации*\n\n"
-                    f"{platform_info['emoji']} {platform_info['name']}\n"
-                    f"{content_emoji} Анализ {content_type}\\.\\.\\.",
-                    parse_mode='MarkdownV2'
+            with metrics.STAGE_SECONDS.time(stage='info', platform=platform):
+                media_info = await self.downloader.get_media_info(url, job)
+
+            if not media_info:
+                self.fail_media(
+                    status, flight, 'info_unavailable', platform,
+                    f"{Config.STATUS_EMOJIS['error']} *Ошибка получения информации*\n\n"
+                    f"Не удалось получить данные о {content_type}\\.\n"
+                    f"Возможные причины:\n"
+                    f"• Приватный аккаунт\n"
+                    f"• Удаленный контент\n"
+                    f"• Проблемы с сетью"
                 )
-                
-                media_info = await self.downloader.get_media_info(url)
-
-                if not media_info:
-                    await status_message.edit_text(
-                        f"{Config.STATUS_EMOJIS['error']} *Ошибка получения информации*\n\n"
-                        f"Не удалось получить данные о {content_type}\\.\n"
-                        f"Возможные причины:\n"
-                        f"• Приватный аккаунт\n"
-                        f"• Удаленный контент\n"
-                        f"• Проблемы с сетью",
-                        parse_mode='MarkdownV2'
-                    )
-                    return
-
-                title = media_info.get('title', 'Unknown')
-                duration = media_info.get('duration', 0) or 0
-                uploader = media_info.get('uploader', 'Unknown')
-                platform = media_info.get('platform', 'unknown')
-
-                if duration > 3600:
-                    await status_message.edit_text(
-                        f"{Config.STATUS_EMOJIS['warning']} *{content_type.capitalize()} слишком длинное*\n\n"
-                        f"🕐 Длительность: {int(duration)//60} мин\\.\n"
-                        f"⚠️ Максимум: 60 мин\\.\n\n"
-                        f"Попробуйте {content_type} покороче\\.",
-                        parse_mode='MarkdownV2'
-                    )
-                    return
+                return
+
+            title = media_info.get('title', 'Unknown')
+            duration = media_info.get('duration', 0) or 0
+            uploader = media_info.get('uploader', 'Unknown')
+
+            if duration > 3600:
+                self.fail_media(
+                    status, flight, 'too_long', platform,
+                    f"{Config.STATUS_EMOJIS['warning']} *{content_type.capitalize()} слишком длинное*\n\n"
+                    f"🕐 Длительность: {int(duration)//60} мин\\.\n"
+                    f"⚠️ Максимум: 60 мин\\.\n\n"
+                    f"Попробуйте {content_type} покороче\\."
+                )
+                return
+
+            # Информация получена вне слота: по длительности и размеру выбираем приоритет
+            priority = self.get_priority(media_info, is_photo)
+            on_position = lambda position: status.update(
+                f"{Config.STATUS_EMOJIS['processing']} *Ожидание загрузки*\n\n"
+                f"{platform_info['emoji']} {platform_info['name']}\n"
+                f"👥 Позиция в очереди: {position}",
+                parse_mode='MarkdownV2'
+            )
+
+            # Слот держится только на время скачивания: отправка в Telegram не занимает
+            # пул загрузок и ограничена пулом соединений Bot API
+            wait_started = time.perf_counter()
+            async with self.scheduler.slot(user_id, priority, on_position):
+                metrics.STAGE_SECONDS.observe(time.perf_counter() - wait_started, stage='queue_wait', platform=platform)
+                logger.info(f"Начинаю загрузку {content_type} для пользователя {user_id}. Активных загрузок: {self.scheduler.active}")
 
                 duration_str = f"{int(duration)//60}:{int(duration)%60:02d}" if duration else "неизвестно"
                 
@@ -168,7 +527,7 @@ class MediaTelegramBot:
                 safe_title = escape_markdown_v2(title[:40])
                 safe_uploader = escape_markdown_v2(uploader[:30])
                 
-                await status_message.edit_text(
+                status.update(
                     f"{Config.STATUS_EMOJIS['downloading']} *Начинаю загрузку*\n\n"
                     f"{platform_info['emoji']} *{safe_title}\\.\\.\\.*\n"
                     f"👤 Автор: {safe_uploader}\n"
@@ -177,134 +536,145 @@ class MediaTelegramBot:
                     parse_mode='MarkdownV2'
                 )
 
-                file_path = await self.downloader.download_media(url)
-
-                # Специальная обработка TikTok фото
-                if file_path == "TIKTOK_PHOTO_NOT_SUPPORTED":
-                    await status_message.edit_text(
-                        f"{Config.STATUS_EMOJIS['error']} *TikTok фото не поддерживается*\n\n"
-                        f"К сожалению, TikTok фото пока не поддерживается\\.\n"
-                        f"Работает только с TikTok видео\\.\n\n"
-                        f"Попробуйте:\n"
-                        f"• TikTok видео вместо фото\n"
-                        f"• Другие платформы \\(YouTube, Instagram\\)",
-                        parse_mode='MarkdownV2'
-                    )
-                    return
-
-                if not file_path or not os.path.exists(file_path):
-                    await status_message.edit_text(
-                        f"{Config.STATUS_EMOJIS['error']} *Ошибка загрузки*\n\n"
-                        f"Не удалось скачать {content_type}\\.\n"
-                        f"Попробуйте:\n"
-                        f"• Другую ссылку\n"
-                        f"• Повторить позже\n"
-                        f"• Проверить доступность контента",
-                        parse_mode='MarkdownV2'
-                    )
-                    return
-
-                file_size = os.path.getsize(file_path)
-                if file_size > Config.TELEGRAM_MAX_FILE_SIZE:
-                    await status_message.edit_text(
-                        f"{Config.STATUS_EMOJIS['warning']} *Файл слишком большой*\n\n"
-                        f"📦 Размер: {file_size//1024//1024} МБ\n"
-                        f"⚠️ Лимит: {Config.MAX_FILE_SIZE_MB} МБ\n\n"
-                        f"Попробуйте {content_type} поменьше\\.",
-                        parse_mode='MarkdownV2'
-                    )
-                    return
-
-                await status_message.edit_text(
-                    f"{Config.STATUS_EMOJIS['uploading']} *Отправка {content_type}*\n\n"
-                    f"📤 Загружаю в Telegram\\.\\.\\.",
-                    parse_mode='MarkdownV2'
+                with metrics.STAGE_SECONDS.time(stage='download', platform=platform):
+                    media = await self.downloader.download_media(url, job)
+
+            # Специальная обработка TikTok фото
+            if media == "TIKTOK_PHOTO_NOT_SUPPORTED":
+                self.fail_media(
+                    status, flight, 'tiktok_photo_unsupported', platform,
+                    f"{Config.STATUS_EMOJIS['error']} *TikTok фото не поддерживается*\n\n"
+                    f"К сожалению, TikTok фото пока не поддерживается\\.\n"
+                    f"Работает только с TikTok видео\\.\n\n"
+                    f"Попробуйте:\n"
+                    f"• TikTok видео вместо фото\n"
+                    f"• Другие платформы \\(YouTube, Instagram\\)"
+                )
+                return
+
+            if not media or not media.exists():
+                self.fail_media(
+                    status, flight, 'download_failed', platform,
+                    f"{Config.STATUS_EMOJIS['error']} *Ошибка загрузки*\n\n"
+                    f"Не удалось скачать {content_type}\\.\n"
+                    f"Попробуйте:\n"
+                    f"• Другую ссылку\n"
+                    f"• Повторить позже\n"
+                    f"• Проверить доступность контента"
+                )
+                return
+
+            file_size = media.size
+            if file_size > Config.TELEGRAM_MAX_FILE_SIZE:
+                self.fail_media(
+                    status, flight, 'too_large', platform,
+                    f"{Config.STATUS_EMOJIS['warning']} *Файл слишком большой*\n\n"
+                    f"📦 Размер: {file_size//1024//1024} МБ\n"
+                    f"⚠️ Лимит: {Config.MAX_FILE_SIZE_MB} МБ\n\n"
+                    f"Попробуйте {content_type} поменьше\\."
                 )
+                return
 
-                with open(file_path, 'rb') as media_file:
-                    # Безопасные строки для caption  
-                    safe_title_caption = escape_markdown_v2(title[:50])
-                    safe_uploader_caption = escape_markdown_v2(uploader)
-                    
-                    if is_photo:
-                        await context.bot.send_photo(
-                            chat_id=chat_id,
-                            photo=media_file,
-                            caption=(
-                                f"{platform_info['emoji']} {safe_title_caption}\n"
-                                f"👤 {safe_uploader_caption}"
-                            ),
-                            parse_mode='MarkdownV2'
-                        )
-                    else:
-                        await context.bot.send_video(
-                            chat_id=chat_id,
-                            video=media_file,
-                            caption=(
-                                f"{platform_info['emoji']} {safe_title_caption}\n"
-                                f"👤 {safe_uploader_caption}"
-                            ),
-                            parse_mode='MarkdownV2',
-                            supports_streaming=True
-                        )
-
-                await status_message.delete()
-                self.total_processed += 1
-                logger.info(f"Медиа успешно отправлено пользователю {user_id}. Всего обработано: {self.total_processed}")
+            status.update(
+                f"{Config.STATUS_EMOJIS['uploading']} *Отправка {content_type}*\n\n"
+                f"📤 Загружаю в Telegram\\.\\.\\.",
+                parse_mode='MarkdownV2'
+            )
 
-            except Exception as e:
-                logger.error(f"Ошибка при загрузке медиа для пользователя {user_id}: {e}")
+            caption = self.build_caption(platform_info, title, uploader)
+            with metrics.STAGE_SECONDS.time(stage='upload', platform=platform):
+                file_id, media_type = await self.send_downloaded_media(bot, chat_id, media, is_photo, caption)
+            metrics.UPLOADED_BYTES.inc(self.get_media_bytes(media), platform=platform)
+            metrics.DELIVERIES.inc(platform=platform, source='download')
 
-                await status_message.edit_text(
-                    f"{Config.STATUS_EMOJIS['error']} *Произошла ошибка*\n\n"
-                    f"⚠️ Не удалось обработать запрос\\.\n"
-                    f"Попробуйте еще раз или обратитесь к администратору\\.",
-                    parse_mode='MarkdownV2'
-                )
+            self.remember_file_id(
+                [url_media_key, self.downloader.get_media_key(url, job.info)],
+                file_id, media_type, title, uploader
+            )
 
-                if "403" in str(e) or "Forbidden" in str(e):
-                    error_message = (
-                        "❌ Видео заблокировано для скачивания.\n"
-                        "Это может быть связано с:\n"
-                        "• Ограничениями правообладателя\n"
-                        "• Географическими блокировками\n"
-                        "• Временными ограничениями YouTube\n\n"
-                        "Попробуйте другое видео или повторите позже."
-                    )
-                elif "404" in str(e) or "not found" in str(e).lower():
-                    error_message = (
-                        "❌ Видео не найдено.\n"
-                        "Возможно, оно было удалено или ссылка неверна."
-                    )
-                elif "timeout" in str(e).lower():
-                    error_message = (
-                        "❌ Превышено время ожидания.\n"
-                        "Попробуйте позже или выберите видео поменьше."
-                    )
-                elif "Video not available, status code 0" in str(e):
-                    error_message = (
-                        "❌ Видео недоступно для скачивания.\n"
-                        "TikTok блокирует автоматические запросы.\n"
-                        "Попробуйте:\n"
-                        "• Другое видео\n"
-                        "• Повторить через несколько минут\n"
-                        "• Проверить, что видео публичное"
-                    )
-                else:
-                    error_message = "❌ Произошла ошибка при обработке видео.\nПопробуйте позже или с другой ссылкой."
+            if flight is not None:
+                self.inflight.publish(flight, {
+                    'file_id': file_id,
+                    'media_type': media_type,
+                    'media': media,
+                    'title': title,
+                    'uploader': uploader,
+                })
+
+            status.delete()
+            self.total_processed += 1
+            logger.info(f"Медиа успешно отправлено пользователю {user_id}. Всего обработано: {self.total_processed}")
+
+        except Exception as e:
+            logger.error(f"Ошибка при загрузке медиа для пользователя {user_id}: {e}")
+
+            status.update(
+                f"{Config.STATUS_EMOJIS['error']} *Произошла ошибка*\n\n"
+                f"⚠️ Не удалось обработать запрос\\.\n"
+                f"Попробуйте еще раз или обратитесь к администратору\\.",
+                parse_mode='MarkdownV2'
+            )
 
-                await status_message.edit_text(error_message)
-            
-            finally:
-                if file_path and os.path.exists(file_path):
-                    try:
-                        os.remove(file_path)
-                        logger.info(f"Файл {file_path} удален после обработки")
-                    except Exception as cleanup_error:
-                        logger.error(f"Ошибка при удалении файла {file_path}: {cleanup_error}")
-                
-                self.active_downloads -= 1
-                logger.info(f"Загрузка завершена для пользователя {user_id}. Активных загрузок: {self.active_downloads}")
+            if "403" in str(e) or "Forbidden" in str(e):
+                reason = 'forbidden'
+                error_message = (
+                    "❌ Видео заблокировано для скачивания.\n"
+                    "Это может быть связано с:\n"
+                    "• Ограничениями правообладателя\n"
+                    "• Географическими блокировками\n"
+                    "• Временными ограничениями YouTube\n\n"
+                    "Попробуйте другое видео или повторите позже."
+                )
+            elif "404" in str(e) or "not found" in str(e).lower():
+                reason = 'not_found'
+                error_message = (
+                    "❌ Видео не найдено.\n"
+                    "Возможно, оно было удалено или ссылка неверна."
+                )
+            elif "timeout" in str(e).lower():
+                reason = 'timeout'
+                error_message = (
+                    "❌ Превышено время ожидания.\n"
+                    "Попробуйте позже или выберите видео поменьше."
+                )
+            elif "Video not available, status code 0" in str(e):
+                reason = 'tiktok_status_0'
+                error_message = (
+                    "❌ Видео недоступно для скачивания.\n"
+                    "TikTok блокирует автоматические запросы.\n"
+                    "Попробуйте:\n"
+                    "• Другое видео\n"
+                    "• Повторить через несколько минут\n"
+                    "• Проверить, что видео публичное"
+                )
+            else:
+                reason = 'other'
+                error_message = "❌ Произошла ошибка при обработке видео.\nПопробуйте позже или с другой ссылкой."
+
+            if flight is not None and isinstance(media, (MediaFile, MediaGroup)) and media.exists():
+                # Файл скачан, не удалась отправка в этот чат: ожидающие отправят его сами
+                self.inflight.publish(flight, {'media': media, 'title': title, 'uploader': uploader})
+            self.fail_media(status, flight, reason, platform, error_message, parse_mode=None)
+        
+        finally:
+            status.finish()
+
+            if flight is not None:
+                # Файл удаляется после отправки последним из ожидающих
+                if isinstance(media, (MediaFile, MediaGroup)):
+                    flight.media = media
+                self.inflight.publish(flight, None)
+            elif isinstance(media, (MediaFile, MediaGroup)):
+                self.remove_media(media)
+            logger.info(f"Загрузка завершена для пользователя {user_id}. Активных загрузок: {self.scheduler.active}")
+
+    def fail_media(self, status: StatusMessage, flight: Optional[Flight], reason: str, platform: str,
+                   text: str, parse_mode: Optional[str] = 'MarkdownV2'):
+        metrics.ERRORS.inc(reason=reason, platform=platform)
+        status.finish(text, parse_mode=parse_mode)
+        # Ошибка общая для всех ожидающих: повторная загрузка дала бы тот же результат
+        if flight is not None:
+            self.inflight.publish(flight, {'error': text, 'parse_mode': parse_mode, 'reason': reason})
 
     async def error_handler(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         logger.error(f"Произошла ошибка: {context.error}")
@@ -318,6 +688,16 @@ class MediaTelegramBot:
             )
 
     async def stats_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        queue_pending = 0
+        if self.job_queue is not None:
+            queue_pending = await asyncio.to_thread(self.job_queue.pending_count)
+        journal_stats = await asyncio.to_thread(self.downloader.journal.stats)
+
+        pools_stats = "\n".join([
+            f"• {name}: {stats['active']}/{stats['workers']} в работе, {stats['queued']} в очереди"
+            for name, stats in self.downloader.get_pool_stats().items()
+        ])
+
         platforms_stats = "\n".join([
             f"{info['emoji']} {info['name']}" 
             for info in Config.SUPPORTED_PLATFORMS.values()
@@ -326,9 +706,14 @@ class MediaTelegramBot:
         stats_message = (
             f"{Config.STATUS_EMOJIS['processing']} *Статистика бота*\n\n"
             f"� *Текущее состояние:*\n"
-            f"�🔄 Активных загрузок: {self.active_downloads}\n"
+            f"�🔄 Активных загрузок: {self.scheduler.active}\n"
+            f"⏳ Ожидают слота: {self.scheduler.waiting}\n"
             f"✅ Всего обработано: {self.total_processed}\n"
-            f"⚡ Лимит одновременных: {Config.MAX_CONCURRENT_DOWNLOADS}\n\n"
+            f"⚡ Лимит одновременных: {Config.MAX_CONCURRENT_DOWNLOADS}\n"
+            f"📬 Заданий в очереди: {queue_pending}\n"
+            f"⏸ Незавершенных загрузок: {journal_stats['unfinished']}\n\n"
+            f"🧵 *Пулы воркеров:*\n"
+            f"{pools_stats}\n\n"
             f"🎯 *Поддерживаемые платформы:*\n"
             f"{platforms_stats}\n\n"
             f"🚀 *Бот работает стабильно\\!*"
@@ -336,6 +721,9 @@ class MediaTelegramBot:
         
         await update.message.reply_text(stats_message, parse_mode='MarkdownV2')
 
+    async def shutdown(self, application: Application):
+        await self.downloader.close()
+
     async def cleanup_task(self):
         while True:
             try:
@@ -346,27 +734,62 @@ class MediaTelegramBot:
                 logger.error(f"Ошибка при периодической очистке: {e}")
 
 
+def register_handlers(application: Application, bot: MediaTelegramBot):
+    application.add_handler(CommandHandler("start", bot.start_command))
+    application.add_handler(CommandHandler("help", bot.help_command))
+    application.add_handler(CommandHandler("stats", bot.stats_command))
+    application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, bot.handle_message))
+
+    application.add_error_handler(bot.error_handler)
+
+
 def main():
+    setup_logging()
     try:
         Config.validate()
 
-        application = Application.builder().token(Config.BOT_TOKEN).build()
-
         bot = MediaTelegramBot()
 
-        application.add_handler(CommandHandler("start", bot.start_command))
-        application.add_handler(CommandHandler("help", bot.help_command))
-        application.add_handler(CommandHandler("stats", bot.stats_command))
-        application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, bot.handle_message))
+        builder = (
+            Application.builder()
+            .token(Config.BOT_TOKEN)
+            .concurrent_updates(Config.CONCURRENT_UPDATES)
+            .post_shutdown(bot.shutdown)
+        )
+        for name, value in get_bot_api_settings().items():
+            builder = getattr(builder, name)(value)
+        application = builder.build()
+
+        if Config.BOT_API_SERVER_URL:
+            logger.info(
+                f"Bot API: {Config.BOT_API_SERVER_URL}, local mode: {Config.BOT_API_LOCAL_MODE}, "
+                f"лимит файла {Config.MAX_FILE_SIZE_MB} МБ"
+            )
 
-        application.add_error_handler(bot.error_handler)
+        register_handlers(application, bot)
 
         logger.info(f"🚀 Бот запущен с поддержкой {Config.MAX_CONCURRENT_DOWNLOADS} одновременных загрузок!")
 
         loop = asyncio.get_event_loop()
         loop.create_task(bot.cleanup_task())
-
-        application.run_polling(allowed_updates=Update.ALL_TYPES)
+        if Config.METRICS_PORT:
+            loop.create_task(metrics.start_server(Config.METRICS_HOST, Config.METRICS_PORT))
+
+        if Config.WEBHOOK_URL:
+            webhook_url = f"{Config.WEBHOOK_URL.rstrip('/')}/{Config.WEBHOOK_PATH}"
+            logger.info(f"Запуск в режиме webhook на {Config.WEBHOOK_LISTEN}:{Config.WEBHOOK_PORT}")
+
+            application.run_webhook(
+                listen=Config.WEBHOOK_LISTEN,
+                port=Config.WEBHOOK_PORT,
+                url_path=Config.WEBHOOK_PATH,
+                webhook_url=webhook_url,
+                secret_token=Config.WEBHOOK_SECRET,
+                max_connections=Config.WEBHOOK_MAX_CONNECTIONS,
+                allowed_updates=ALLOWED_UPDATES
+            )
+        else:
+            application.run_polling(allowed_updates=ALLOWED_UPDATES)
 
     except Exception as e:
         logger.error(f"Критическая ошибка: {e}")
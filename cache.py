@@ -0,0 +1,361 @@
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional, Dict
+
+logger = logging.getLogger(__name__)
+
+
+class FileIdCache:
+    # Количество записей между проходами вытеснения
+    EVICT_EVERY = 100
+
+    def __init__(self, path: str, ttl_hours: float, max_entries: int):
+        self.ttl_seconds = ttl_hours * 3600
+        self.max_entries = max_entries
+        self._puts = 0
+        self._lock = threading.Lock()
+
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+        self._conn.execute(
+            'CREATE TABLE IF NOT EXISTS file_ids ('
+            'media_key TEXT PRIMARY KEY, '
+            'file_id TEXT NOT NULL, '
+            'media_type TEXT NOT NULL, '
+            'title TEXT, '
+            'uploader TEXT, '
+            'created_at REAL NOT NULL, '
+            'last_used_at REAL NOT NULL)'
+        )
+        self._conn.execute('CREATE INDEX IF NOT EXISTS idx_file_ids_last_used ON file_ids (last_used_at)')
+        self._conn.commit()
+
+    def get(self, media_key: str) -> Optional[Dict]:
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                'SELECT file_id, media_type, title, uploader, created_at FROM file_ids WHERE media_key = ?',
+                (media_key,)
+            ).fetchone()
+            if row is None:
+                return None
+
+            if now - row[4] > self.ttl_seconds:
+                self._conn.execute('DELETE FROM file_ids WHERE media_key = ?', (media_key,))
+                self._conn.commit()
+                return None
+
+            self._conn.execute('UPDATE file_ids SET last_used_at = ? WHERE media_key = ?', (now, media_key))
+            self._conn.commit()
+
+        return {
+            'file_id': row[0],
+            'media_type': row[1],
+            'title': row[2] or '',
+            'uploader': row[3] or '',
+        }
+
+    def put(self, media_key: str, file_id: str, media_type: str, title: str = '', uploader: str = ''):
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                'INSERT OR REPLACE INTO file_ids '
+                '(media_key, file_id, media_type, title, uploader, created_at, last_used_at) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?)',
+                (media_key, file_id, media_type, title, uploader, now, now)
+            )
+            self._conn.commit()
+
+            self._puts += 1
+            if self._puts % self.EVICT_EVERY == 0:
+                self._evict(now)
+
+    def invalidate(self, media_key: str):
+        with self._lock:
+            self._conn.execute('DELETE FROM file_ids WHERE media_key = ?', (media_key,))
+            self._conn.commit()
+
+    def _evict(self, now: float):
+        try:
+            self._conn.execute('DELETE FROM file_ids WHERE created_at < ?', (now - self.ttl_seconds,))
+
+            count = self._conn.execute('SELECT COUNT(*) FROM file_ids').fetchone()[0]
+            if count > self.max_entries:
+                self._conn.execute(
+                    'DELETE FROM file_ids WHERE media_key IN '
+                    '(SELECT media_key FROM file_ids ORDER BY last_used_at LIMIT ?)',
+                    (count - self.max_entries,)
+                )
+            self._conn.commit()
+        except sqlite3.Error as e:
+            logger.error(f"Ошибка вытеснения из кэша file_id: {e}")
+
+
+# Кэш результатов get_media_info: LRU в памяти поверх таблицы SQLite.
+# Отрицательные результаты (приватное, удаленное видео) хранятся с коротким TTL,
+# чтобы не запрашивать источник, который уже ответил, что контента нет.
+# В памяти записи лежат в виде JSON: объем LRU считается в байтах, а каждое
+# чтение возвращает новый dict, который вызывающий код может менять.
+# Методы блокирующие (SQLite, разбор JSON) - из event loop их вызывают через поток.
+class MetadataCache:
+    EVICT_EVERY = 100
+
+    def __init__(self, path: str, ttl_seconds: float, negative_ttl_seconds: float,
+                 memory_entries: int, max_entries: int, memory_bytes: int = 0):
+        self.ttl_seconds = ttl_seconds
+        self.negative_ttl_seconds = negative_ttl_seconds
+        self.memory_entries = memory_entries
+        self.memory_bytes = memory_bytes
+        self.max_entries = max_entries
+        self._memory: OrderedDict = OrderedDict()
+        self._memory_size = 0
+        self._puts = 0
+        self._lock = threading.Lock()
+
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+        self._conn.execute(
+            'CREATE TABLE IF NOT EXISTS media_info ('
+            'media_key TEXT PRIMARY KEY, '
+            'info TEXT, '
+            'error TEXT, '
+            'expires_at REAL NOT NULL, '
+            'last_used_at REAL NOT NULL)'
+        )
+        self._conn.execute('CREATE INDEX IF NOT EXISTS idx_media_info_last_used ON media_info (last_used_at)')
+        self._conn.commit()
+
+    def get(self, media_key: str) -> Optional[Dict]:
+        # Возвращает {'info': dict} или {'error': str} для отрицательного результата
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(media_key)
+            if entry is not None:
+                if entry['expires_at'] > now:
+                    self._memory.move_to_end(media_key)
+                    return self._load(entry)
+                self._forget(media_key)
+
+            row = self._conn.execute(
+                'SELECT info, error, expires_at FROM media_info WHERE media_key = ?',
+                (media_key,)
+            ).fetchone()
+            if row is None:
+                return None
+
+            if row[2] <= now:
+                self._conn.execute('DELETE FROM media_info WHERE media_key = ?', (media_key,))
+                self._conn.commit()
+                return None
+
+            self._conn.execute('UPDATE media_info SET last_used_at = ? WHERE media_key = ?', (now, media_key))
+            self._conn.commit()
+
+            entry = {'info': row[0], 'error': row[1], 'expires_at': row[2]}
+            self._remember(media_key, entry)
+            return self._load(entry)
+
+    def put(self, media_key: str, info: Dict):
+        self._put(media_key, info, None, self.ttl_seconds)
+
+    def put_negative(self, media_key: str, error: str):
+        self._put(media_key, None, error, self.negative_ttl_seconds)
+
+    def _put(self, media_key: str, info: Optional[Dict], error: Optional[str], ttl: float):
+        now = time.time()
+        info_json = json.dumps(info, ensure_ascii=False) if info is not None else None
+        entry = {'info': info_json, 'error': error, 'expires_at': now + ttl}
+
+        with self._lock:
+            self._remember(media_key, entry)
+            self._conn.execute(
+                'INSERT OR REPLACE INTO media_info (media_key, info, error, expires_at, last_used_at) '
+                'VALUES (?, ?, ?, ?, ?)',
+                (media_key, info_json, error, entry['expires_at'], now)
+            )
+            self._conn.commit()
+
+            self._puts += 1
+            if self._puts % self.EVICT_EVERY == 0:
+                self._evict(now)
+
+    @staticmethod
+    def _load(entry: Dict) -> Dict:
+        return {**entry, 'info': json.loads(entry['info']) if entry['info'] else None}
+
+    @staticmethod
+    def _entry_size(entry: Dict) -> int:
+        return len(entry['info'] or '') + len(entry['error'] or '')
+
+    def _forget(self, media_key: str):
+        entry = self._memory.pop(media_key, None)
+        if entry is not None:
+            self._memory_size -= self._entry_size(entry)
+
+    def _remember(self, media_key: str, entry: Dict):
+        self._forget(media_key)
+        self._memory[media_key] = entry
+        self._memory_size += self._entry_size(entry)
+        while self._memory and (
+            len(self._memory) > self.memory_entries
+            or (self.memory_bytes and self._memory_size > self.memory_bytes)
+        ):
+            self._forget(next(iter(self._memory)))
+
+    def _evict(self, now: float):
+        try:
+            self._conn.execute('DELETE FROM media_info WHERE expires_at <= ?', (now,))
+
+            count = self._conn.execute('SELECT COUNT(*) FROM media_info').fetchone()[0]
+            if count > self.max_entries:
+                self._conn.execute(
+                    'DELETE FROM media_info WHERE media_key IN '
+                    '(SELECT media_key FROM media_info ORDER BY last_used_at LIMIT ?)',
+                    (count - self.max_entries,)
+                )
+            self._conn.commit()
+        except sqlite3.Error as e:
+            logger.error(f"Ошибка вытеснения из кэша метаданных: {e}")
+
+
+# Дисковый кэш скачанных файлов с адресацией по ключу медиа и формату.
+# Индекс хранится в SQLite рядом с файлами, объем ограничен max_bytes,
+# вытесняются давно не использованные файлы. Файлы, на которые есть ссылки
+# (идет отправка), не вытесняются.
+class MediaDiskCache:
+    def __init__(self, directory: str, max_bytes: int):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._refs: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+        os.makedirs(directory, exist_ok=True)
+        self._conn = sqlite3.connect(os.path.join(directory, 'index.db'), check_same_thread=False)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+        self._conn.execute(
+            'CREATE TABLE IF NOT EXISTS entries ('
+            'cache_key TEXT PRIMARY KEY, '
+            'filename TEXT NOT NULL, '
+            'size INTEGER NOT NULL, '
+            'hits INTEGER NOT NULL DEFAULT 0, '
+            'last_used_at REAL NOT NULL)'
+        )
+        self._conn.execute('CREATE INDEX IF NOT EXISTS idx_entries_last_used ON entries (last_used_at)')
+
+        # Записи без файлов (удалены вручную) убираем один раз при запуске
+        for cache_key, filename in self._conn.execute('SELECT cache_key, filename FROM entries').fetchall():
+            if not os.path.exists(os.path.join(directory, filename)):
+                self._conn.execute('DELETE FROM entries WHERE cache_key = ?', (cache_key,))
+        self._conn.commit()
+
+        self.total_bytes = self._conn.execute('SELECT COALESCE(SUM(size), 0) FROM entries').fetchone()[0]
+
+    def _filename(self, cache_key: str, ext: str) -> str:
+        return hashlib.sha1(cache_key.encode('utf-8')).hexdigest() + ext
+
+    def acquire(self, cache_key: str) -> Optional[str]:
+        with self._lock:
+            row = self._conn.execute('SELECT filename FROM entries WHERE cache_key = ?', (cache_key,)).fetchone()
+            if row is None:
+                return None
+
+            path = os.path.join(self.directory, row[0])
+            if not os.path.exists(path):
+                self._drop(cache_key)
+                return None
+
+            self._conn.execute(
+                'UPDATE entries SET hits = hits + 1, last_used_at = ? WHERE cache_key = ?',
+                (time.time(), cache_key)
+            )
+            self._conn.commit()
+            self._refs[cache_key] = self._refs.get(cache_key, 0) + 1
+            return path
+
+    def store(self, cache_key: str, source_path: Optional[str] = None, data: Optional[bytes] = None,
+              ext: str = '') -> str:
+        # Файл переносится в кэш (или байты записываются) и сразу захватывается вызывающим
+        filename = self._filename(cache_key, ext)
+        path = os.path.join(self.directory, filename)
+
+        if source_path is not None:
+            os.replace(source_path, path)
+        else:
+            with open(path, 'wb') as f:
+                f.write(data)
+        size = os.path.getsize(path)
+
+        with self._lock:
+            old = self._conn.execute('SELECT size FROM entries WHERE cache_key = ?', (cache_key,)).fetchone()
+            if old is not None:
+                self.total_bytes -= old[0]
+
+            self._conn.execute(
+                'INSERT OR REPLACE INTO entries (cache_key, filename, size, hits, last_used_at) '
+                'VALUES (?, ?, ?, 0, ?)',
+                (cache_key, filename, size, time.time())
+            )
+            self._conn.commit()
+            self.total_bytes += size
+            self._refs[cache_key] = self._refs.get(cache_key, 0) + 1
+
+            self._evict()
+        return path
+
+    def release(self, cache_key: str):
+        with self._lock:
+            refs = self._refs.get(cache_key, 0) - 1
+            if refs > 0:
+                self._refs[cache_key] = refs
+            else:
+                self._refs.pop(cache_key, None)
+                if self.total_bytes > self.max_bytes:
+                    self._evict()
+
+    def _drop(self, cache_key: str):
+        row = self._conn.execute('SELECT filename, size FROM entries WHERE cache_key = ?', (cache_key,)).fetchone()
+        if row is None:
+            return
+
+        try:
+            os.remove(os.path.join(self.directory, row[0]))
+        except FileNotFoundError:
+            pass
+        self._conn.execute('DELETE FROM entries WHERE cache_key = ?', (cache_key,))
+        self._conn.commit()
+        self.total_bytes -= row[1]
+
+    def _evict(self):
+        if self.total_bytes <= self.max_bytes:
+            return
+
+        try:
+            rows = self._conn.execute('SELECT cache_key, size FROM entries ORDER BY last_used_at').fetchall()
+            for cache_key, size in rows:
+                if self.total_bytes <= self.max_bytes:
+                    break
+                if self._refs.get(cache_key):
+                    continue
+                self._drop(cache_key)
+                logger.info(f"Файл {cache_key} вытеснен из дискового кэша")
+        except (sqlite3.Error, OSError) as e:
+            logger.error(f"Ошибка вытеснения из дискового кэша: {e}")
+
+    def stats(self) -> Dict:
+        with self._lock:
+            entries = self._conn.execute('SELECT COUNT(*) FROM entries').fetchone()[0]
+        return {
+            'entries': entries,
+            'bytes': self.total_bytes,
+            'max_bytes': self.max_bytes,
+            'in_use': len(self._refs),
+        }
@@ -1,3 +1,4 @@
+import logging
 import os
 from dotenv import load_dotenv
 
@@ -6,12 +7,55 @@ load_dotenv()
 
 class Config:
     BOT_TOKEN = os.getenv('BOT_TOKEN')
-    MAX_FILE_SIZE_MB = int(os.getenv('MAX_FILE_SIZE_MB', 500))
+
+    # Режим webhook включается, если задан публичный WEBHOOK_URL; иначе long polling
+    WEBHOOK_URL = os.getenv('WEBHOOK_URL')
+    WEBHOOK_LISTEN = os.getenv('WEBHOOK_LISTEN', '0.0.0.0')
+    WEBHOOK_PORT = int(os.getenv('WEBHOOK_PORT', 8443))
+    WEBHOOK_PATH = os.getenv('WEBHOOK_PATH', 'telegram')
+    WEBHOOK_SECRET = os.getenv('WEBHOOK_SECRET')
+    WEBHOOK_MAX_CONNECTIONS = int(os.getenv('WEBHOOK_MAX_CONNECTIONS', 40))
+    # Сколько обновлений Application обрабатывает одновременно (concurrent_updates);
+    # при 1 долгая загрузка одного пользователя задерживала бы сообщения всех остальных
+    CONCURRENT_UPDATES = int(os.getenv('CONCURRENT_UPDATES', 64))
+
+    # Собственный сервер telegram-bot-api, например http://localhost:8081. Публичный
+    # Bot API принимает от ботов файлы до 50 МБ; сервер, запущенный с --local, - до 2000 МБ
+    # и берет файл по пути на диске (каталог загрузок должен быть ему доступен)
+    BOT_API_SERVER_URL = os.getenv('BOT_API_SERVER_URL', '').rstrip('/')
+    BOT_API_LOCAL_MODE = os.getenv('BOT_API_LOCAL_MODE', 'false').lower() == 'true'
+    BOT_API_UPLOAD_LIMIT_MB = 2000 if BOT_API_LOCAL_MODE else 50
+    # Ответ на отправку приходит после загрузки файла в Telegram - для больших файлов это минуты
+    UPLOAD_TIMEOUT = float(os.getenv('UPLOAD_TIMEOUT', 600))
+
+    MAX_FILE_SIZE_MB = min(int(os.getenv('MAX_FILE_SIZE_MB', BOT_API_UPLOAD_LIMIT_MB)), BOT_API_UPLOAD_LIMIT_MB)
     DOWNLOAD_TIMEOUT = int(os.getenv('DOWNLOAD_TIMEOUT', 10000))
 
-    TELEGRAM_MAX_FILE_SIZE = 500 * 1024 * 1024
+    TELEGRAM_MAX_FILE_SIZE = MAX_FILE_SIZE_MB * 1024 * 1024
+
+    # Выбор формата: максимальная высота и целевой битрейт, из которого вместе
+    # с длительностью считается бюджет байтов (не больше лимита Telegram)
+    FORMAT_MAX_HEIGHT = int(os.getenv('FORMAT_MAX_HEIGHT', 720))
+    FORMAT_TARGET_KBPS = int(os.getenv('FORMAT_TARGET_KBPS', 2500))
     
-    MAX_CONCURRENT_DOWNLOADS = int(os.getenv('MAX_CONCURRENT_DOWNLOADS', 10000))
+    # Размеры пулов потоков по этапам: извлечение метаданных дешевое,
+    # скачивание упирается в канал, поэтому воркеров для него меньше
+    INFO_WORKERS = int(os.getenv('INFO_WORKERS', 32))
+    DOWNLOAD_WORKERS = int(os.getenv('DOWNLOAD_WORKERS', 8))
+    SCRAPE_WORKERS = int(os.getenv('SCRAPE_WORKERS', 8))
+
+    # Слоты планировщика не больше пула загрузок: лишние задания ждали бы
+    # в FIFO-очереди пула в обход справедливого распределения
+    MAX_CONCURRENT_DOWNLOADS = int(os.getenv('MAX_CONCURRENT_DOWNLOADS', DOWNLOAD_WORKERS))
+    # Справедливое распределение слотов: не больше N загрузок одного пользователя,
+    # короткие ролики и небольшие файлы обслуживаются в первую очередь
+    PER_USER_CONCURRENT_DOWNLOADS = int(os.getenv('PER_USER_CONCURRENT_DOWNLOADS', 2))
+    PRIORITY_MAX_DURATION = int(os.getenv('PRIORITY_MAX_DURATION', 120))
+    PRIORITY_MAX_FILESIZE = int(os.getenv('PRIORITY_MAX_FILESIZE_MB', 20)) * 1024 * 1024
+
+    # thread - извлечение в пуле потоков, process - в пуле процессов (обход GIL)
+    EXTRACTION_MODE = os.getenv('EXTRACTION_MODE', 'thread')
+    PROCESS_WORKERS = int(os.getenv('PROCESS_WORKERS', os.cpu_count() or 2))
     CLEANUP_INTERVAL_HOURS = float(os.getenv('CLEANUP_INTERVAL_HOURS', 1))
     MAX_FILE_AGE_HOURS = float(os.getenv('MAX_FILE_AGE_HOURS', 24))
     
@@ -19,6 +63,78 @@ class Config:
     
     TIKTOK_COOKIES_FILE = os.getenv('TIKTOK_COOKIES_FILE', 'tiktok_cookies.txt')
 
+    # Потоковая загрузка прогрессивных форматов: до STREAM_BUFFER_MB файл держится
+    # в памяти, больше - дописывается на диск. Буфер на каждую загрузку, поэтому
+    # вместе с DOWNLOAD_WORKERS он задает пиковый расход памяти
+    STREAMING_ENABLED = os.getenv('STREAMING_ENABLED', 'true').lower() == 'true'
+    STREAM_BUFFER_BYTES = int(os.getenv('STREAM_BUFFER_MB', 4)) * 1024 * 1024
+    STREAM_CHUNK_SIZE = 1024 * 1024
+
+    # Параллельная загрузка: соединений на файл (фрагменты DASH/HLS или части
+    # прогрессивного файла по Range). DOWNLOAD_MAX_CONNECTIONS_PER_HOST - общий лимит
+    # соединений к хосту для загрузки по частям; фрагменты DASH/HLS качает yt-dlp
+    # своими потоками, для них это только верхняя граница на один файл
+    DOWNLOAD_CONNECTIONS = int(os.getenv('DOWNLOAD_CONNECTIONS', 4))
+    YOUTUBE_DOWNLOAD_CONNECTIONS = int(os.getenv('YOUTUBE_DOWNLOAD_CONNECTIONS', 8))
+    DOWNLOAD_MAX_CONNECTIONS_PER_HOST = int(os.getenv('DOWNLOAD_MAX_CONNECTIONS_PER_HOST', 32))
+    RANGED_MIN_SIZE = int(os.getenv('RANGED_MIN_SIZE_MB', 10)) * 1024 * 1024
+    RANGED_PART_SIZE = int(os.getenv('RANGED_PART_SIZE_MB', 4)) * 1024 * 1024
+
+    # Дисковый кэш yt-dlp (расшифровка подписи, player JS), общий для бота и воркеров.
+    # Экземпляр YoutubeDL в потоке пересоздается после YTDLP_INSTANCE_MAX_USES вызовов (0 - никогда)
+    YTDLP_CACHE_DIR = os.getenv('YTDLP_CACHE_DIR', 'yt_dlp_cache')
+    YTDLP_INSTANCE_MAX_USES = int(os.getenv('YTDLP_INSTANCE_MAX_USES', 1000))
+
+    # Карусели: сколько элементов скачивать и сколько из них параллельно
+    MAX_MEDIA_GROUP_ITEMS = int(os.getenv('MAX_MEDIA_GROUP_ITEMS', 35))
+    MEDIA_GROUP_FETCH_CONCURRENCY = int(os.getenv('MEDIA_GROUP_FETCH_CONCURRENCY', 6))
+
+    RESOLVE_TIMEOUT = float(os.getenv('RESOLVE_TIMEOUT', 10))
+    RESOLVED_URL_TTL_SECONDS = int(os.getenv('RESOLVED_URL_TTL_SECONDS', 3600))
+    RESOLVED_URL_CACHE_SIZE = int(os.getenv('RESOLVED_URL_CACHE_SIZE', 10000))
+
+    # Общий пул HTTP-соединений для скрапинга: keep-alive, лимит на хост, повторы с backoff
+    HTTP_CONNECT_TIMEOUT = float(os.getenv('HTTP_CONNECT_TIMEOUT', 5))
+    HTTP_READ_TIMEOUT = float(os.getenv('HTTP_READ_TIMEOUT', 30))
+    HTTP_RETRIES = int(os.getenv('HTTP_RETRIES', 3))
+    HTTP_BACKOFF_FACTOR = float(os.getenv('HTTP_BACKOFF_FACTOR', 0.5))
+    HTTP_MAX_CONNECTIONS_PER_HOST = int(os.getenv('HTTP_MAX_CONNECTIONS_PER_HOST', 16))
+
+    # Разделение на фронтенд и воркеры: '' - все в одном процессе, sqlite или redis -
+    # бот только ставит задания в очередь, скачивают процессы worker.py
+    QUEUE_BACKEND = os.getenv('QUEUE_BACKEND', '')
+    QUEUE_PATH = os.getenv('QUEUE_PATH', 'jobs.db')
+    REDIS_URL = os.getenv('REDIS_URL', 'redis://localhost:6379/0')
+    QUEUE_LEASE_SECONDS = int(os.getenv('QUEUE_LEASE_SECONDS', 300))
+    QUEUE_MAX_ATTEMPTS = int(os.getenv('QUEUE_MAX_ATTEMPTS', 3))
+    QUEUE_POLL_INTERVAL = float(os.getenv('QUEUE_POLL_INTERVAL', 1))
+    WORKER_CONCURRENCY = int(os.getenv('WORKER_CONCURRENCY', 8))
+
+    FILE_ID_CACHE_PATH = os.getenv('FILE_ID_CACHE_PATH', 'file_id_cache.db')
+    FILE_ID_CACHE_TTL_HOURS = float(os.getenv('FILE_ID_CACHE_TTL_HOURS', 24 * 30))
+    FILE_ID_CACHE_MAX_ENTRIES = int(os.getenv('FILE_ID_CACHE_MAX_ENTRIES', 100000))
+
+    # Кэш метаданных (get_media_info); отрицательные ответы живут меньше
+    METADATA_CACHE_PATH = os.getenv('METADATA_CACHE_PATH', 'metadata_cache.db')
+    METADATA_CACHE_TTL_SECONDS = int(os.getenv('METADATA_CACHE_TTL_SECONDS', 3600))
+    METADATA_NEGATIVE_TTL_SECONDS = int(os.getenv('METADATA_NEGATIVE_TTL_SECONDS', 600))
+    METADATA_CACHE_MEMORY_ENTRIES = int(os.getenv('METADATA_CACHE_MEMORY_ENTRIES', 1000))
+    METADATA_CACHE_MEMORY_BYTES = int(os.getenv('METADATA_CACHE_MEMORY_MB', 16)) * 1024 * 1024
+    METADATA_CACHE_MAX_ENTRIES = int(os.getenv('METADATA_CACHE_MAX_ENTRIES', 50000))
+    # Сколько секунд полный info dict из кэша годится для скачивания без повторного
+    # extract_info: подписанные ссылки форматов живут ограниченное время
+    METADATA_INFO_REUSE_SECONDS = int(os.getenv('METADATA_INFO_REUSE_SECONDS', 1800))
+
+    # Дисковый кэш скачанных файлов (по умолчанию выключен): повторные запросы
+    # одного медиа не скачиваются заново, если file_id недоступен
+    MEDIA_CACHE_ENABLED = os.getenv('MEDIA_CACHE_ENABLED', 'false').lower() == 'true'
+    MEDIA_CACHE_MAX_BYTES = int(os.getenv('MEDIA_CACHE_MAX_MB', 2048)) * 1024 * 1024
+
+    # Журнал незавершенных загрузок: после тайм-аута или перезапуска то же медиа
+    # продолжается с частичного файла. Записи старше срока удаляются вместе с частичными файлами
+    DOWNLOAD_JOURNAL_PATH = os.getenv('DOWNLOAD_JOURNAL_PATH', 'download_journal.db')
+    DOWNLOAD_JOURNAL_MAX_AGE_HOURS = float(os.getenv('DOWNLOAD_JOURNAL_MAX_AGE_HOURS', 1))
+
     SUPPORTED_PLATFORMS = {
         'youtube': {
             'name': '🔴 YouTube',
@@ -40,6 +156,23 @@ class Config:
         }
     }
     
+    # Эндпоинт /metrics в формате Prometheus; 0 - выключен. Каждому процессу
+    # (бот и воркеры) нужен свой порт
+    METRICS_HOST = os.getenv('METRICS_HOST', '127.0.0.1')
+    METRICS_PORT = int(os.getenv('METRICS_PORT', 0))
+
+    # Логи: уровень, формат text или json. Отладочные дампы страниц (TikTok) пишутся
+    # только по явному включению, в отдельный файл на запрос и не больше лимита
+    LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO').upper()
+    LOG_FORMAT = os.getenv('LOG_FORMAT', 'text').lower()
+    DEBUG_DUMPS_ENABLED = os.getenv('DEBUG_DUMPS_ENABLED', 'false').lower() == 'true'
+    DEBUG_DUMP_DIR = os.getenv('DEBUG_DUMP_DIR', 'debug_dumps')
+    DEBUG_DUMP_MAX_BYTES = int(os.getenv('DEBUG_DUMP_MAX_KB', 1024)) * 1024
+
+    # Ограничения на правки статусных сообщений (лимиты Telegram на флуд)
+    STATUS_EDITS_PER_SECOND = float(os.getenv('STATUS_EDITS_PER_SECOND', 20))
+    STATUS_CHAT_EDIT_INTERVAL = float(os.getenv('STATUS_CHAT_EDIT_INTERVAL', 1.5))
+
     STATUS_EMOJIS = {
         'processing': '⏳',
         'downloading': '📥',
@@ -54,5 +187,16 @@ class Config:
         if not Config.BOT_TOKEN:
             raise ValueError("BOT_TOKEN не установлен. Создайте .env файл по образцу .env.example")
 
+        if Config.BOT_API_LOCAL_MODE and not Config.BOT_API_SERVER_URL:
+            raise ValueError("BOT_API_LOCAL_MODE требует собственного сервера: задайте BOT_API_SERVER_URL")
+
+        if Config.MAX_CONCURRENT_DOWNLOADS > Config.DOWNLOAD_WORKERS:
+            logging.getLogger(__name__).warning(
+                f"MAX_CONCURRENT_DOWNLOADS ({Config.MAX_CONCURRENT_DOWNLOADS}) больше DOWNLOAD_WORKERS "
+                f"({Config.DOWNLOAD_WORKERS}): лишние загрузки ждали бы в пуле потоков, "
+                f"используется {Config.DOWNLOAD_WORKERS}"
+            )
+            Config.MAX_CONCURRENT_DOWNLOADS = Config.DOWNLOAD_WORKERS
+
         if not os.path.exists(Config.DOWNLOADS_DIR):
             os.makedirs(Config.DOWNLOADS_DIR)
\ No newline at end of file
@@ -0,0 +1,129 @@
+import asyncio
+import contextvars
+import logging
+import multiprocessing
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import Callable, Dict
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+
+# Отдельный пул для одного этапа обработки (извлечение, скачивание, скрапинг).
+# Считает задачи в очереди и в работе, чтобы их можно было показать в /stats.
+# С use_processes=True задачи выполняются в пуле процессов: функция и аргументы
+# должны быть picklable.
+class StagePool:
+    def __init__(self, name: str, max_workers: int, use_processes: bool = False):
+        self.name = name
+        self.max_workers = max_workers
+        self.use_processes = use_processes
+        if use_processes:
+            self._executor = ProcessPoolExecutor(
+                max_workers=max_workers,
+                mp_context=multiprocessing.get_context('spawn')
+            )
+        else:
+            self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=f'{name}-worker')
+        self._lock = threading.Lock()
+        self._queued = 0
+        self._active = 0
+        self._pending = 0
+
+    @property
+    def queue_depth(self) -> int:
+        if self.use_processes:
+            return max(0, self._pending - self.max_workers)
+        return self._queued
+
+    @property
+    def active(self) -> int:
+        if self.use_processes:
+            return min(self._pending, self.max_workers)
+        return self._active
+
+    async def run(self, func: Callable, *args):
+        if self.use_processes:
+            return await self._run_in_process(func, *args)
+
+        with self._lock:
+            self._queued += 1
+        submitted = time.perf_counter()
+
+        def _call():
+            metrics.EXECUTOR_WAIT_SECONDS.observe(time.perf_counter() - submitted, pool=self.name)
+            with self._lock:
+                self._queued -= 1
+                self._active += 1
+            try:
+                return func(*args)
+            finally:
+                with self._lock:
+                    self._active -= 1
+
+        # ThreadPoolExecutor не переносит contextvars: без копии логи потока теряют request_id
+        context = contextvars.copy_context()
+        future = self._executor.submit(context.run, _call)
+
+        def _on_done(done_future):
+            # Задача отменена до запуска — _call не выполнялся и не уменьшил счетчик
+            if done_future.cancelled():
+                with self._lock:
+                    self._queued -= 1
+
+        future.add_done_callback(_on_done)
+        return await asyncio.wrap_future(future)
+
+    async def _run_in_process(self, func: Callable, *args):
+        # Момент старта задачи в дочернем процессе не виден, поэтому считаем
+        # только незавершенные задачи и делим их на занятые воркеры и очередь
+        with self._lock:
+            self._pending += 1
+
+        def _on_done(done_future):
+            with self._lock:
+                self._pending -= 1
+
+        future = self._executor.submit(func, *args)
+        future.add_done_callback(_on_done)
+        return await asyncio.wrap_future(future)
+
+    def stats(self) -> Dict:
+        return {
+            'workers': self.max_workers,
+            'active': self.active,
+            'queued': self.queue_depth,
+        }
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+
+# Общий на процесс лимит одновременных соединений к одному хосту для загрузок
+# по частям: сколько бы файлов ни качалось параллельно, CDN видит не больше N
+class HostConnectionLimiter:
+    def __init__(self, per_host: int):
+        self.per_host = per_host
+        self._lock = threading.Lock()
+        self._semaphores: Dict[str, threading.BoundedSemaphore] = {}
+
+    def _get(self, host: str) -> threading.BoundedSemaphore:
+        with self._lock:
+            semaphore = self._semaphores.get(host)
+            if semaphore is None:
+                semaphore = threading.BoundedSemaphore(self.per_host)
+                self._semaphores[host] = semaphore
+            return semaphore
+
+    @contextmanager
+    def connection(self, host: str):
+        semaphore = self._get(host)
+        semaphore.acquire()
+        try:
+            yield
+        finally:
+            semaphore.release()
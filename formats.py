@@ -0,0 +1,67 @@
+from typing import Dict, List, Optional
+
+from config import Config
+
+
+# Выбор формата под лимит Telegram по списку formats из extract_info:
+# лучший прогрессивный файл (видео и звук вместе, без склейки ffmpeg),
+# который укладывается в бюджет байтов.
+
+def get_byte_budget(duration: Optional[float]) -> int:
+    # Бюджет - меньшее из лимита Telegram и целевого битрейта на длительность
+    budget = Config.TELEGRAM_MAX_FILE_SIZE
+    if duration:
+        budget = min(budget, int(duration * Config.FORMAT_TARGET_KBPS * 1000 / 8))
+    return budget
+
+
+def estimate_size(fmt: Dict, duration: Optional[float]) -> Optional[int]:
+    size = fmt.get('filesize') or fmt.get('filesize_approx')
+    if size:
+        return int(size)
+    if fmt.get('tbr') and duration:
+        return int(fmt['tbr'] * 1000 / 8 * duration)
+    return None
+
+
+def is_progressive(fmt: Dict) -> bool:
+    # acodec/vcodec None - кодек неизвестен; 'none' - дорожки нет
+    return (
+        bool(fmt.get('url'))
+        and fmt.get('vcodec') != 'none'
+        and fmt.get('acodec') != 'none'
+        and fmt.get('protocol') in ('http', 'https')
+    )
+
+
+def plan_format(info: Dict, budget: Optional[int] = None) -> Optional[Dict]:
+    duration = info.get('duration')
+    if budget is None:
+        budget = get_byte_budget(duration)
+
+    candidates: List[Dict] = [
+        fmt for fmt in info.get('formats') or []
+        if is_progressive(fmt) and (fmt.get('height') or 0) <= Config.FORMAT_MAX_HEIGHT
+    ]
+    if not candidates:
+        return None
+
+    def quality(fmt: Dict):
+        return (fmt.get('ext') == 'mp4', fmt.get('height') or 0, fmt.get('tbr') or 0)
+
+    fitting = []
+    unknown = []
+    for fmt in candidates:
+        size = estimate_size(fmt, duration)
+        if size is None:
+            unknown.append(fmt)
+        elif size <= budget:
+            fitting.append(fmt)
+
+    if fitting:
+        return max(fitting, key=quality)
+
+    # Размер неизвестен: берем самый скромный вариант, max_filesize прервет слишком большой
+    if unknown:
+        return min(unknown, key=lambda fmt: (fmt.get('ext') != 'mp4', fmt.get('height') or 0, fmt.get('tbr') or 0))
+    return None
@@ -0,0 +1,237 @@
+import json
+import logging
+import sqlite3
+import threading
+import time
+from typing import Dict, Optional
+
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+
+class QueuedJob:
+    def __init__(self, job_id: int, url: str, chat_id: int, user_id: int,
+                 message_id: Optional[int] = None, attempts: int = 0):
+        self.id = job_id
+        self.url = url
+        self.chat_id = chat_id
+        self.user_id = user_id
+        self.message_id = message_id
+        self.attempts = attempts
+
+    def to_dict(self) -> Dict:
+        return {
+            'id': self.id,
+            'url': self.url,
+            'chat_id': self.chat_id,
+            'user_id': self.user_id,
+            'message_id': self.message_id,
+            'attempts': self.attempts,
+        }
+
+
+# Очередь заданий на SQLite: не требует внешних сервисов, подходит для
+# фронтенда и воркеров на одной машине. Воркер берет задание в аренду
+# (lease); если он упал и не продлил аренду, задание снова выдается.
+class SQLiteJobQueue:
+    def __init__(self, path: str, lease_seconds: int, max_attempts: int):
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self._lock = threading.Lock()
+
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30, isolation_level=None)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+        self._conn.execute(
+            'CREATE TABLE IF NOT EXISTS jobs ('
+            'id INTEGER PRIMARY KEY AUTOINCREMENT, '
+            'url TEXT NOT NULL, '
+            'chat_id INTEGER NOT NULL, '
+            'user_id INTEGER NOT NULL, '
+            'message_id INTEGER, '
+            "status TEXT NOT NULL DEFAULT 'queued', "
+            'attempts INTEGER NOT NULL DEFAULT 0, '
+            'worker_id TEXT, '
+            'lease_until REAL, '
+            'error TEXT, '
+            'created_at REAL NOT NULL, '
+            'updated_at REAL NOT NULL)'
+        )
+        self._conn.execute('CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs (status, id)')
+
+    def enqueue(self, url: str, chat_id: int, user_id: int, message_id: Optional[int] = None) -> int:
+        now = time.time()
+        with self._lock:
+            cursor = self._conn.execute(
+                'INSERT INTO jobs (url, chat_id, user_id, message_id, created_at, updated_at) '
+                'VALUES (?, ?, ?, ?, ?, ?)',
+                (url, chat_id, user_id, message_id, now, now)
+            )
+            return cursor.lastrowid
+
+    def claim(self, worker_id: str) -> Optional[QueuedJob]:
+        now = time.time()
+        with self._lock:
+            self._conn.execute('BEGIN IMMEDIATE')
+            try:
+                self._conn.execute(
+                    "UPDATE jobs SET status = 'failed', error = 'lease expired', updated_at = ? "
+                    "WHERE status = 'running' AND lease_until < ? AND attempts >= ?",
+                    (now, now, self.max_attempts)
+                )
+                row = self._conn.execute(
+                    'SELECT id, url, chat_id, user_id, message_id, attempts FROM jobs '
+                    "WHERE status = 'queued' OR (status = 'running' AND lease_until < ?) "
+                    'ORDER BY id LIMIT 1',
+                    (now,)
+                ).fetchone()
+
+                if row is None:
+                    self._conn.execute('COMMIT')
+                    return None
+
+                self._conn.execute(
+                    "UPDATE jobs SET status = 'running', worker_id = ?, lease_until = ?, "
+                    'attempts = attempts + 1, updated_at = ? WHERE id = ?',
+                    (worker_id, now + self.lease_seconds, now, row[0])
+                )
+                self._conn.execute('COMMIT')
+            except Exception:
+                self._conn.execute('ROLLBACK')
+                raise
+
+        return QueuedJob(row[0], row[1], row[2], row[3], row[4], row[5] + 1)
+
+    def extend_lease(self, job_id: int, worker_id: str):
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "UPDATE jobs SET lease_until = ?, updated_at = ? "
+                "WHERE id = ? AND worker_id = ? AND status = 'running'",
+                (now + self.lease_seconds, now, job_id, worker_id)
+            )
+
+    def complete(self, job_id: int):
+        self._finish(job_id, 'done', None)
+
+    def fail(self, job_id: int, error: str):
+        self._finish(job_id, 'failed', error)
+
+    def _finish(self, job_id: int, status: str, error: Optional[str]):
+        with self._lock:
+            self._conn.execute(
+                'UPDATE jobs SET status = ?, error = ?, lease_until = NULL, updated_at = ? WHERE id = ?',
+                (status, error, time.time(), job_id)
+            )
+
+    def pending_count(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM jobs WHERE status = 'queued'").fetchone()[0]
+
+
+# Очередь на Redis для воркеров на других машинах. Аренда хранится в sorted set
+# с временем истечения; просроченные задания возвращаются в очередь при claim.
+class RedisJobQueue:
+    PREFIX = 'downloadbot'
+
+    def __init__(self, url: str, lease_seconds: int, max_attempts: int):
+        try:
+            import redis
+        except ImportError:
+            raise RuntimeError("Для QUEUE_BACKEND=redis установите пакет redis: pip install redis")
+
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self._redis = redis.Redis.from_url(url, decode_responses=True)
+
+        self._queue_key = f'{self.PREFIX}:queue'
+        self._leases_key = f'{self.PREFIX}:leases'
+        self._id_key = f'{self.PREFIX}:job_id'
+
+    def _job_key(self, job_id) -> str:
+        return f'{self.PREFIX}:job:{job_id}'
+
+    def enqueue(self, url: str, chat_id: int, user_id: int, message_id: Optional[int] = None) -> int:
+        job_id = self._redis.incr(self._id_key)
+        job = QueuedJob(job_id, url, chat_id, user_id, message_id)
+
+        pipe = self._redis.pipeline()
+        pipe.hset(self._job_key(job_id), mapping={'data': json.dumps(job.to_dict()), 'status': 'queued'})
+        pipe.rpush(self._queue_key, job_id)
+        pipe.execute()
+        return job_id
+
+    def _requeue_expired(self, now: float):
+        for job_id in self._redis.zrangebyscore(self._leases_key, '-inf', now):
+            # zrem вернет 1 только одному воркеру - он и возвращает задание
+            if not self._redis.zrem(self._leases_key, job_id):
+                continue
+
+            data = self._redis.hget(self._job_key(job_id), 'data')
+            if data and json.loads(data)['attempts'] < self.max_attempts:
+                self._redis.hset(self._job_key(job_id), 'status', 'queued')
+                self._redis.lpush(self._queue_key, job_id)
+            else:
+                self._finish(job_id, 'failed', 'lease expired')
+
+    def claim(self, worker_id: str) -> Optional[QueuedJob]:
+        now = time.time()
+        self._requeue_expired(now)
+
+        job_id = self._redis.lpop(self._queue_key)
+        if job_id is None:
+            return None
+
+        data = self._redis.hget(self._job_key(job_id), 'data')
+        if not data:
+            return None
+
+        job_data = json.loads(data)
+        job_data['attempts'] += 1
+
+        pipe = self._redis.pipeline()
+        pipe.hset(self._job_key(job_id), mapping={
+            'data': json.dumps(job_data),
+            'status': 'running',
+            'worker_id': worker_id,
+        })
+        pipe.zadd(self._leases_key, {job_id: now + self.lease_seconds})
+        pipe.execute()
+
+        return QueuedJob(
+            job_data['id'], job_data['url'], job_data['chat_id'], job_data['user_id'],
+            job_data.get('message_id'), job_data['attempts']
+        )
+
+    def extend_lease(self, job_id: int, worker_id: str):
+        if self._redis.hget(self._job_key(job_id), 'worker_id') == worker_id:
+            self._redis.zadd(self._leases_key, {job_id: time.time() + self.lease_seconds}, xx=True)
+
+    def complete(self, job_id: int):
+        self._finish(job_id, 'done', None)
+
+    def fail(self, job_id: int, error: str):
+        self._finish(job_id, 'failed', error)
+
+    def _finish(self, job_id, status: str, error: Optional[str]):
+        pipe = self._redis.pipeline()
+        pipe.zrem(self._leases_key, job_id)
+        pipe.hset(self._job_key(job_id), mapping={'status': status, 'error': error or ''})
+        pipe.expire(self._job_key(job_id), 24 * 3600)
+        pipe.execute()
+
+    def pending_count(self) -> int:
+        return self._redis.llen(self._queue_key)
+
+
+def create_job_queue():
+    backend = Config.QUEUE_BACKEND.lower()
+
+    if backend == 'sqlite':
+        return SQLiteJobQueue(Config.QUEUE_PATH, Config.QUEUE_LEASE_SECONDS, Config.QUEUE_MAX_ATTEMPTS)
+    if backend == 'redis':
+        return RedisJobQueue(Config.REDIS_URL, Config.QUEUE_LEASE_SECONDS, Config.QUEUE_MAX_ATTEMPTS)
+    if backend:
+        raise ValueError(f"Неизвестный QUEUE_BACKEND: {Config.QUEUE_BACKEND}")
+    return None
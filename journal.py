@@ -0,0 +1,162 @@
+import json
+import logging
+import sqlite3
+import threading
+import time
+from typing import Dict, Iterable, List, Optional
+
+logger = logging.getLogger(__name__)
+
+
+# Журнал незавершенных загрузок: по ключу медиа хранится id задания (он задает
+# имена файлов), URL, путь и сколько скачано. Повторная загрузка того же медиа
+# после тайм-аута или перезапуска берет тот же id и продолжает частичный файл.
+# Запись принадлежит одной попытке (owner) на время аренды: пока загрузка идет,
+# другие попытки того же медиа (в этом или другом процессе) получают свой id.
+class DownloadJournal:
+    # Не чаще одной записи прогресса в секунду на загрузку
+    PROGRESS_INTERVAL = 1.0
+    # Аренда продлевается прогрессом; запись упавшего процесса освобождается по истечении
+    LEASE_SECONDS = 120
+
+    def __init__(self, path: str, max_age_seconds: float):
+        self.max_age_seconds = max_age_seconds
+        self._last_progress: Dict[str, float] = {}
+        self._lock = threading.Lock()
+
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+        self._conn.execute(
+            'CREATE TABLE IF NOT EXISTS downloads ('
+            'resume_key TEXT PRIMARY KEY, '
+            'job_id TEXT NOT NULL, '
+            'url TEXT NOT NULL, '
+            'path TEXT, '
+            'bytes_done INTEGER NOT NULL DEFAULT 0, '
+            'total_bytes INTEGER NOT NULL DEFAULT 0, '
+            'parts TEXT, '
+            'owner TEXT, '
+            'lease_until REAL NOT NULL DEFAULT 0, '
+            'updated_at REAL NOT NULL)'
+        )
+        # Журнал, созданный до появления аренды
+        columns = {row[1] for row in self._conn.execute('PRAGMA table_info(downloads)')}
+        if 'owner' not in columns:
+            self._conn.execute('ALTER TABLE downloads ADD COLUMN owner TEXT')
+        if 'lease_until' not in columns:
+            self._conn.execute('ALTER TABLE downloads ADD COLUMN lease_until REAL NOT NULL DEFAULT 0')
+        self._conn.commit()
+        self.prune()
+
+    def start(self, resume_key: str, owner: str, url: str) -> Optional[str]:
+        # owner - свежий id этой попытки. Возвращает id задания для имен файлов: прежний,
+        # если загрузка этого медиа уже начиналась, или owner. None - запись арендована
+        # другой идущей загрузкой: попытка качает под своим id без журнала
+        now = time.time()
+        with self._lock:
+            # BEGIN IMMEDIATE: проверка и захват аренды атомарны и между процессами
+            self._conn.execute('BEGIN IMMEDIATE')
+            try:
+                row = self._conn.execute(
+                    'SELECT job_id, bytes_done, owner, lease_until FROM downloads '
+                    'WHERE resume_key = ? AND updated_at >= ?',
+                    (resume_key, now - self.max_age_seconds)
+                ).fetchone()
+                if row is not None and row[2] != owner and row[3] > now:
+                    self._conn.commit()
+                    logger.info(f"Загрузка {resume_key} уже идет (задание {row[0]}), качаем отдельно")
+                    return None
+
+                if row is not None:
+                    self._conn.execute(
+                        'UPDATE downloads SET owner = ?, lease_until = ?, updated_at = ? WHERE resume_key = ?',
+                        (owner, now + self.LEASE_SECONDS, now, resume_key)
+                    )
+                    self._conn.commit()
+                    logger.info(f"Возобновление загрузки {resume_key}: задание {row[0]}, скачано {row[1]} байт")
+                    return row[0]
+
+                self._conn.execute(
+                    'INSERT OR REPLACE INTO downloads (resume_key, job_id, url, owner, lease_until, updated_at) '
+                    'VALUES (?, ?, ?, ?, ?, ?)',
+                    (resume_key, owner, url, owner, now + self.LEASE_SECONDS, now)
+                )
+                self._conn.commit()
+            except sqlite3.Error:
+                self._conn.rollback()
+                raise
+        return owner
+
+    def progress(self, resume_key: str, owner: str, bytes_done: int, total_bytes: int,
+                 path: Optional[str] = None):
+        now = time.time()
+        with self._lock:
+            if now - self._last_progress.get(resume_key, 0) < self.PROGRESS_INTERVAL:
+                return
+            self._last_progress[resume_key] = now
+            self._conn.execute(
+                'UPDATE downloads SET bytes_done = ?, total_bytes = ?, path = COALESCE(?, path), '
+                'lease_until = ?, updated_at = ? WHERE resume_key = ? AND owner = ?',
+                (bytes_done, total_bytes, path, now + self.LEASE_SECONDS, now, resume_key, owner)
+            )
+            self._conn.commit()
+
+    def get_parts(self, resume_key: str) -> set:
+        # Начала уже скачанных частей при загрузке по Range
+        with self._lock:
+            row = self._conn.execute('SELECT parts FROM downloads WHERE resume_key = ?', (resume_key,)).fetchone()
+        if row is None or not row[0]:
+            return set()
+        return set(json.loads(row[0]))
+
+    def set_parts(self, resume_key: str, owner: str, parts: Iterable[int], path: str):
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                'UPDATE downloads SET parts = ?, path = ?, lease_until = ?, updated_at = ? '
+                'WHERE resume_key = ? AND owner = ?',
+                (json.dumps(sorted(parts)), path, now + self.LEASE_SECONDS, now, resume_key, owner)
+            )
+            self._conn.commit()
+
+    def finish(self, resume_key: str, owner: str):
+        # Загрузка завершена или продолжать ее бессмысленно (файл больше лимита)
+        with self._lock:
+            self._last_progress.pop(resume_key, None)
+            self._conn.execute('DELETE FROM downloads WHERE resume_key = ? AND owner = ?', (resume_key, owner))
+            self._conn.commit()
+
+    def release(self, resume_key: str, owner: str):
+        # Попытка остановлена: следующая может сразу продолжить частичный файл
+        with self._lock:
+            self._last_progress.pop(resume_key, None)
+            self._conn.execute(
+                'UPDATE downloads SET lease_until = 0 WHERE resume_key = ? AND owner = ?', (resume_key, owner)
+            )
+            self._conn.commit()
+
+    def prune(self) -> List[str]:
+        # Удаляет записи старше max_age и возвращает пути их частичных файлов:
+        # продолжать их уже не будут, файлы удаляет очистка
+        now = time.time()
+        try:
+            with self._lock:
+                condition = 'updated_at < ? AND lease_until < ?'
+                params = (now - self.max_age_seconds, now)
+                paths = [
+                    row[0] for row in self._conn.execute(
+                        f'SELECT path FROM downloads WHERE {condition} AND path IS NOT NULL', params
+                    )
+                ]
+                self._conn.execute(f'DELETE FROM downloads WHERE {condition}', params)
+                self._conn.commit()
+            return paths
+        except sqlite3.Error as e:
+            logger.error(f"Ошибка очистки журнала загрузок: {e}")
+            return []
+
+    def stats(self) -> Dict:
+        with self._lock:
+            count = self._conn.execute('SELECT COUNT(*) FROM downloads').fetchone()[0]
+        return {'unfinished': count}
@@ -0,0 +1,94 @@
+import atexit
+import contextvars
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import re
+import uuid
+from typing import Optional
+
+from config import Config
+
+# Идентификатор запроса (сообщения или задания воркера) для сквозной связки логов.
+# contextvars переносится в задачи asyncio; пулы потоков копируют контекст в StagePool.run
+request_id: contextvars.ContextVar[str] = contextvars.ContextVar('request_id', default='-')
+
+_listener: Optional[logging.handlers.QueueListener] = None
+
+
+def set_request_id(value: Optional[str] = None) -> str:
+    value = value or uuid.uuid4().hex[:8]
+    request_id.set(value)
+    return value
+
+
+class RequestIdFilter(logging.Filter):
+    def filter(self, record: logging.LogRecord) -> bool:
+        record.request_id = request_id.get()
+        return True
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            'time': self.formatTime(record),
+            'level': record.levelname,
+            'logger': record.name,
+            'request_id': getattr(record, 'request_id', '-'),
+            'message': record.getMessage(),
+        }
+        if record.exc_info:
+            entry['exc_info'] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False)
+
+
+def setup_logging():
+    # Обработчики логов вызываются в потоке, который пишет запись: в event loop
+    # запись в stdout блокировала бы цикл. Корневой логгер только кладет запись в очередь,
+    # вывод делает отдельный поток QueueListener
+    global _listener
+    if _listener is not None:
+        return
+
+    if Config.LOG_FORMAT == 'json':
+        formatter = JsonFormatter()
+    else:
+        formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - [%(request_id)s] %(message)s')
+
+    stream_handler = logging.StreamHandler()
+    stream_handler.setFormatter(formatter)
+
+    log_queue = queue.SimpleQueue()
+    queue_handler = logging.handlers.QueueHandler(log_queue)
+    # Фильтр на обработчике очереди: request_id читается в потоке, где создана запись
+    queue_handler.addFilter(RequestIdFilter())
+
+    root = logging.getLogger()
+    for handler in root.handlers[:]:
+        root.removeHandler(handler)
+    root.addHandler(queue_handler)
+    root.setLevel(Config.LOG_LEVEL)
+
+    _listener = logging.handlers.QueueListener(log_queue, stream_handler)
+    _listener.start()
+    atexit.register(_listener.stop)
+
+
+def debug_dumps_enabled() -> bool:
+    return Config.DEBUG_DUMPS_ENABLED
+
+
+def write_debug_dump(name: str, content: str):
+    # Отдельный файл на запрос: параллельные запросы не перезаписывают дампы друг друга
+    try:
+        os.makedirs(Config.DEBUG_DUMP_DIR, exist_ok=True)
+        prefix = re.sub(r'[^\w-]', '_', request_id.get())
+        path = os.path.join(Config.DEBUG_DUMP_DIR, f"{prefix}_{name}")
+        data = content.encode('utf-8')[:Config.DEBUG_DUMP_MAX_BYTES]
+        with open(path, 'wb') as f:
+            f.write(data)
+        logging.getLogger(__name__).debug("Отладочный дамп сохранен: %s (%s байт)", path, len(data))
+    except OSError as e:
+        logging.getLogger(__name__).warning("Ошибка сохранения отладочного дампа %s: %s", name, e)
@@ -0,0 +1,206 @@
+import asyncio
+import bisect
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+# Метрики в текстовом формате Prometheus без внешних зависимостей.
+# Счетчики и гистограммы обновляются и из event loop, и из потоков пулов;
+# gauge читают текущее значение из функции-источника в момент запроса /metrics.
+
+# Границы гистограмм длительности, секунды: от быстрых правок статуса до долгих загрузок
+DEFAULT_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+
+REGISTRY: List['Metric'] = []
+
+
+def _escape(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(names: Tuple[str, ...], values: Tuple[str, ...], extra: str = '') -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+class Metric:
+    kind = ''
+
+    def __init__(self, name: str, documentation: str, labels: Tuple[str, ...] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self._lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def _key(self, labels: Dict) -> Tuple[str, ...]:
+        return tuple(str(labels.get(name, '')) for name in self.labels)
+
+    def collect(self) -> List[str]:
+        raise NotImplementedError
+
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def __init__(self, name: str, documentation: str, labels: Tuple[str, ...] = ()):
+        super().__init__(name, documentation, labels)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def snapshot(self) -> Dict[Tuple[str, ...], float]:
+        with self._lock:
+            return dict(self._values)
+
+    def collect(self) -> List[str]:
+        with self._lock:
+            items = list(self._values.items())
+        return [f'{self.name}{_format_labels(self.labels, key)} {value}' for key, value in items]
+
+
+class Histogram(Metric):
+    kind = 'histogram'
+
+    def __init__(self, name: str, documentation: str, labels: Tuple[str, ...] = (),
+                 buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(buckets)
+        # Метки -> [счетчики по корзинам, сумма, количество]
+        self._values: Dict[Tuple[str, ...], list] = {}
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [[0] * len(self.buckets), 0.0, 0]
+            if index < len(self.buckets):
+                state[0][index] += 1
+            state[1] += value
+            state[2] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def collect(self) -> List[str]:
+        with self._lock:
+            items = [(key, list(state[0]), state[1], state[2]) for key, state in self._values.items()]
+
+        lines = []
+        for key, counts, total, count in items:
+            labels = _format_labels(self.labels, key)
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                bucket_labels = _format_labels(self.labels, key, f'le="{bound}"')
+                lines.append(f'{self.name}_bucket{bucket_labels} {cumulative}')
+            bucket_labels = _format_labels(self.labels, key, 'le="+Inf"')
+            lines.append(f'{self.name}_bucket{bucket_labels} {count}')
+            lines.append(f'{self.name}_sum{labels} {total}')
+            lines.append(f'{self.name}_count{labels} {count}')
+        return lines
+
+
+class Gauge(Metric):
+    kind = 'gauge'
+
+    def __init__(self, name: str, documentation: str, labels: Tuple[str, ...] = ()):
+        super().__init__(name, documentation, labels)
+        self._source: Optional[Callable[[], Iterable[Tuple[Tuple[str, ...], float]]]] = None
+
+    def set_function(self, source: Callable[[], Iterable[Tuple[Tuple[str, ...], float]]]):
+        # source возвращает пары (значения меток, значение)
+        self._source = source
+
+    def collect(self) -> List[str]:
+        if self._source is None:
+            return []
+        try:
+            samples = list(self._source())
+        except Exception as e:
+            logger.error(f"Ошибка чтения метрики {self.name}: {e}")
+            return []
+        return [f'{self.name}{_format_labels(self.labels, tuple(map(str, key)))} {value}' for key, value in samples]
+
+
+STAGE_SECONDS = Histogram(
+    'bot_stage_duration_seconds',
+    'Длительность этапов обработки запроса: resolve, info, queue_wait, download, upload, status_edit',
+    ('stage', 'platform')
+)
+EXECUTOR_WAIT_SECONDS = Histogram(
+    'bot_executor_wait_seconds',
+    'Время ожидания задачи в очереди пула потоков до запуска',
+    ('pool',)
+)
+DOWNLOADED_BYTES = Counter('bot_downloaded_bytes_total', 'Байт скачано из источников', ('platform',))
+UPLOADED_BYTES = Counter('bot_uploaded_bytes_total', 'Байт отправлено в Telegram', ('platform',))
+CACHE_REQUESTS = Counter('bot_cache_requests_total', 'Обращения к кэшам: hit или miss', ('cache', 'result'))
+DELIVERIES = Counter(
+    'bot_deliveries_total',
+    'Доставленные медиа по источнику: file_id, shared (общая загрузка), download',
+    ('platform', 'source')
+)
+ERRORS = Counter('bot_errors_total', 'Ошибки обработки по причинам', ('reason', 'platform'))
+POOL_TASKS = Gauge('bot_executor_tasks', 'Задачи в пулах потоков: active или queued', ('pool', 'state'))
+SCHEDULER_DOWNLOADS = Gauge('bot_scheduler_downloads', 'Загрузки в планировщике: active или waiting', ('state',))
+
+
+def render() -> str:
+    lines = []
+    for metric in REGISTRY:
+        lines.append(f'# HELP {metric.name} {metric.documentation}')
+        lines.append(f'# TYPE {metric.name} {metric.kind}')
+        lines.extend(metric.collect())
+    return '\n'.join(lines) + '\n'
+
+
+async def _handle_request(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+    try:
+        request_line = await asyncio.wait_for(reader.readline(), timeout=5)
+        # Заголовки запроса не нужны, но их надо дочитать до пустой строки
+        while True:
+            line = await asyncio.wait_for(reader.readline(), timeout=5)
+            if line in (b'\r\n', b'\n', b''):
+                break
+
+        parts = request_line.decode('latin-1').split()
+        if len(parts) >= 2 and parts[0] == 'GET' and parts[1].split('?')[0] == '/metrics':
+            status, body = '200 OK', render().encode()
+        else:
+            status, body = '404 Not Found', b'not found\n'
+
+        writer.write(
+            f'HTTP/1.1 {status}\r\n'
+            f'Content-Type: text/plain; version=0.0.4; charset=utf-8\r\n'
+            f'Content-Length: {len(body)}\r\n'
+            f'Connection: close\r\n\r\n'.encode() + body
+        )
+        await writer.drain()
+    except (asyncio.TimeoutError, ConnectionError):
+        pass
+    finally:
+        writer.close()
+
+
+async def start_server(host: str, port: int) -> asyncio.AbstractServer:
+    server = await asyncio.start_server(_handle_request, host, port)
+    logger.info(f"Метрики доступны на http://{host}:{port}/metrics")
+    return server
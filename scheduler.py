@@ -0,0 +1,141 @@
+import asyncio
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager
+from typing import Callable, Deque, Dict, List, Optional
+
+PRIORITY_HIGH = 0
+PRIORITY_NORMAL = 1
+
+
+# Заявка на слот загрузки
+class Ticket:
+    def __init__(self, user_id: int, priority: int, on_position: Optional[Callable[[int], None]] = None):
+        self.user_id = user_id
+        self.priority = priority
+        self.on_position = on_position
+        self.position = 0
+        self.future: asyncio.Future = asyncio.get_running_loop().create_future()
+
+
+# Планировщик загрузок: общий лимит слотов, лимит на пользователя,
+# очередь по кругу между пользователями и отдельный класс для коротких медиа.
+# Заявки с высоким приоритетом выдаются раньше обычных.
+class FairScheduler:
+    def __init__(self, max_active: int, per_user_limit: int):
+        self.max_active = max_active
+        self.per_user_limit = per_user_limit
+        self.active = 0
+        self._active_per_user: Dict[int, int] = {}
+        # Для каждого приоритета: пользователь -> его заявки; порядок ключей - порядок обхода
+        self._queues: List[OrderedDict] = [OrderedDict(), OrderedDict()]
+        # Пересчет позиций откладывается до конца итерации цикла: много acquire/release подряд - один пересчет
+        self._positions_scheduled = False
+
+    @property
+    def waiting(self) -> int:
+        return sum(len(tickets) for queue in self._queues for tickets in queue.values())
+
+    @asynccontextmanager
+    async def slot(self, user_id: int, priority: int = PRIORITY_NORMAL,
+                   on_position: Optional[Callable[[int], None]] = None):
+        await self.acquire(user_id, priority, on_position)
+        try:
+            yield
+        finally:
+            self.release(user_id)
+
+    async def acquire(self, user_id: int, priority: int = PRIORITY_NORMAL,
+                      on_position: Optional[Callable[[int], None]] = None):
+        ticket = Ticket(user_id, priority, on_position)
+        self._queues[priority].setdefault(user_id, deque()).append(ticket)
+        self._dispatch()
+
+        try:
+            await ticket.future
+        except asyncio.CancelledError:
+            if ticket.future.done() and not ticket.future.cancelled():
+                # Слот уже выдан, но заявку отменили - возвращаем его
+                self.release(user_id)
+            else:
+                self._remove(ticket)
+                self._dispatch()
+            raise
+
+    def release(self, user_id: int):
+        self.active -= 1
+        self._active_per_user[user_id] -= 1
+        if not self._active_per_user[user_id]:
+            del self._active_per_user[user_id]
+        self._dispatch()
+
+    def _remove(self, ticket: Ticket):
+        queue = self._queues[ticket.priority]
+        tickets = queue.get(ticket.user_id)
+        if tickets and ticket in tickets:
+            tickets.remove(ticket)
+            if not tickets:
+                del queue[ticket.user_id]
+
+    def _pick(self) -> Optional[Ticket]:
+        for queue in self._queues:
+            for user_id in list(queue):
+                if self._active_per_user.get(user_id, 0) >= self.per_user_limit:
+                    continue
+
+                tickets: Deque[Ticket] = queue[user_id]
+                # Заявки, отмененные до того, как их задача успела убрать их из очереди
+                while tickets and tickets[0].future.done():
+                    tickets.popleft()
+                if not tickets:
+                    del queue[user_id]
+                    continue
+
+                ticket = tickets.popleft()
+                if tickets:
+                    # Пользователь уходит в конец круга
+                    queue.move_to_end(user_id)
+                else:
+                    del queue[user_id]
+                return ticket
+        return None
+
+    def _dispatch(self):
+        while self.active < self.max_active:
+            ticket = self._pick()
+            if ticket is None:
+                break
+            self.active += 1
+            self._active_per_user[ticket.user_id] = self._active_per_user.get(ticket.user_id, 0) + 1
+            ticket.future.set_result(None)
+
+        if not self._positions_scheduled and any(self._queues):
+            self._positions_scheduled = True
+            asyncio.get_running_loop().call_soon(self._notify_positions)
+
+    def _notify_positions(self):
+        # Позиция - номер заявки при обходе по кругу: в раунде r выдается r-я заявка
+        # каждого пользователя, у которого их больше r. Один проход по всем заявкам
+        self._positions_scheduled = False
+        position = 0
+        for queue in self._queues:
+            users = [tickets for tickets in queue.values() if tickets]
+            index = 0
+            while users:
+                for tickets in users:
+                    ticket = tickets[index]
+                    if ticket.future.done():
+                        continue
+                    position += 1
+                    if position != ticket.position:
+                        ticket.position = position
+                        if ticket.on_position is not None:
+                            ticket.on_position(position)
+                index += 1
+                users = [tickets for tickets in users if len(tickets) > index]
+
+    def stats(self) -> Dict:
+        return {
+            'active': self.active,
+            'waiting': self.waiting,
+            'users': len(self._active_per_user),
+        }
@@ -0,0 +1,45 @@
+import asyncio
+from typing import Any, Dict, Optional, Tuple
+
+
+# Одна выполняемая загрузка, которую ждут все одновременные запросы того же медиа
+class Flight:
+    def __init__(self, key: str):
+        self.key = key
+        self.future: asyncio.Future = asyncio.get_running_loop().create_future()
+        self.participants = 1
+        self.media: Optional[Any] = None
+
+
+class SingleFlight:
+    def __init__(self):
+        self._flights: Dict[str, Flight] = {}
+
+    def join(self, key: str) -> Tuple[Flight, bool]:
+        flight = self._flights.get(key)
+        if flight is not None and not flight.future.done():
+            flight.participants += 1
+            return flight, False
+
+        flight = Flight(key)
+        self._flights[key] = flight
+        return flight, True
+
+    async def wait(self, flight: Flight) -> Any:
+        # shield: отмена одного ожидающего не должна отменять общий результат
+        return await asyncio.shield(flight.future)
+
+    def publish(self, flight: Flight, result: Any):
+        if not flight.future.done():
+            flight.future.set_result(result)
+
+        # Новые запросы после публикации результата начинают свою загрузку
+        if self._flights.get(flight.key) is flight:
+            del self._flights[flight.key]
+
+    def release(self, flight: Flight) -> bool:
+        flight.participants -= 1
+        return flight.participants == 0
+
+    def __len__(self) -> int:
+        return len(self._flights)
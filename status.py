@@ -0,0 +1,143 @@
+import asyncio
+import logging
+import time
+from typing import Dict, Optional, Set
+
+from telegram import Bot
+from telegram.error import BadRequest, RetryAfter, TelegramError
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# Фоновые задачи обновления статусов; asyncio хранит только слабые ссылки на задачи
+_background_tasks: Set[asyncio.Task] = set()
+
+
+# Планировщик правок сообщений: не чаще одной правки в chat_interval секунд на чат
+# и не больше per_second правок в секунду на весь бот
+class EditRateLimiter:
+    def __init__(self, per_second: float, chat_interval: float):
+        self.interval = 1 / per_second
+        self.chat_interval = chat_interval
+        self._next_global = 0.0
+        self._next_chat: Dict[int, float] = {}
+
+    async def acquire(self, chat_id: int):
+        now = asyncio.get_running_loop().time()
+
+        slot = max(now, self._next_global, self._next_chat.get(chat_id, 0.0))
+        self._next_global = slot + self.interval
+        self._next_chat[chat_id] = slot + self.chat_interval
+
+        if len(self._next_chat) > 10000:
+            self._next_chat = {chat: ts for chat, ts in self._next_chat.items() if ts > now}
+
+        if slot > now:
+            await asyncio.sleep(slot - now)
+
+    def penalize(self, chat_id: int, seconds: float):
+        now = asyncio.get_running_loop().time()
+        self._next_chat[chat_id] = max(self._next_chat.get(chat_id, 0.0), now + seconds)
+
+
+# Статусное сообщение, которое обновляется в фоне. update() не ждет Telegram:
+# сохраняется только последнее состояние, промежуточные схлопываются.
+class StatusMessage:
+    def __init__(self, bot: Bot, chat_id: int, message_id: int, limiter: EditRateLimiter,
+                 text: Optional[str] = None, parse_mode: Optional[str] = 'MarkdownV2', platform: str = ''):
+        self.bot = bot
+        self.chat_id = chat_id
+        self.message_id = message_id
+        self.limiter = limiter
+        # Метка платформы для метрик длительности правок
+        self.platform = platform
+
+        # text - то, что уже показано в сообщении при его отправке
+        self._text = text
+        self._parse_mode = parse_mode
+        self._progress: Optional[int] = None
+        self._shown = text
+        self._closing = False
+        self._delete = False
+        self._dirty = asyncio.Event()
+
+        task = asyncio.create_task(self._run())
+        _background_tasks.add(task)
+        task.add_done_callback(_background_tasks.discard)
+
+    def update(self, text: str, parse_mode: Optional[str] = 'MarkdownV2'):
+        if self._closing:
+            return
+        self._text = text
+        self._parse_mode = parse_mode
+        self._progress = None
+        self._dirty.set()
+
+    def set_progress(self, percent: float):
+        if self._closing or self._text is None:
+            return
+        self._progress = int(percent)
+        self._dirty.set()
+
+    def finish(self, text: Optional[str] = None, parse_mode: Optional[str] = 'MarkdownV2'):
+        if self._closing:
+            return
+        if text is not None:
+            self._text = text
+            self._parse_mode = parse_mode
+            self._progress = None
+        self._closing = True
+        self._dirty.set()
+
+    def delete(self):
+        if self._closing:
+            return
+        self._closing = True
+        self._delete = True
+        self._dirty.set()
+
+    def _render(self) -> Optional[str]:
+        if self._text is None or self._progress is None:
+            return self._text
+        return f"{self._text}\n📊 Прогресс: {self._progress}%"
+
+    async def _run(self):
+        while True:
+            await self._dirty.wait()
+            self._dirty.clear()
+            await self.limiter.acquire(self.chat_id)
+
+            if self._delete:
+                try:
+                    await self.bot.delete_message(chat_id=self.chat_id, message_id=self.message_id)
+                except TelegramError as e:
+                    logger.warning(f"Не удалось удалить статусное сообщение: {e}")
+                return
+
+            text = self._render()
+            if text is not None and text != self._shown:
+                started = time.perf_counter()
+                try:
+                    await self.bot.edit_message_text(
+                        text,
+                        chat_id=self.chat_id,
+                        message_id=self.message_id,
+                        parse_mode=self._parse_mode
+                    )
+                    self._shown = text
+                    metrics.STAGE_SECONDS.observe(
+                        time.perf_counter() - started, stage='status_edit', platform=self.platform
+                    )
+                except RetryAfter as e:
+                    self.limiter.penalize(self.chat_id, e.retry_after)
+                    self._dirty.set()
+                    continue
+                except BadRequest as e:
+                    if 'not modified' not in str(e).lower():
+                        logger.warning(f"Не удалось обновить статус: {e}")
+                except TelegramError as e:
+                    logger.warning(f"Не удалось обновить статус: {e}")
+
+            if self._closing and not self._dirty.is_set():
+                return
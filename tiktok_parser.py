@@ -0,0 +1,259 @@
+import json
+import logging
+import re
+import time
+from typing import Dict, List, Optional
+
+from bs4 import BeautifulSoup
+
+logger = logging.getLogger(__name__)
+
+# id скриптов, в которые TikTok встраивает состояние страницы
+UNIVERSAL_DATA_SCRIPT_ID = '__UNIVERSAL_DATA_FOR_REHYDRATION__'
+SIGI_STATE_SCRIPT_ID = 'SIGI_STATE'
+
+
+def _extract_script_json(html: str, script_id: str) -> Optional[Dict]:
+    # Поиск подстрокой вместо разбора всего HTML: нужен только один известный скрипт
+    marker = html.find(f'id="{script_id}"')
+    if marker == -1:
+        return None
+
+    start = html.find('>', marker)
+    end = html.find('</script>', start)
+    if start == -1 or end == -1:
+        return None
+
+    try:
+        return json.loads(html[start + 1:end])
+    except ValueError:
+        return None
+
+
+def _image_post_urls(item: Optional[Dict]) -> List[str]:
+    if not isinstance(item, dict):
+        return []
+
+    urls = []
+    images = (item.get('imagePost') or {}).get('images') or []
+    for image in images:
+        url_list = (image.get('imageURL') or {}).get('urlList') or []
+        if url_list:
+            urls.append(url_list[0])
+    return urls
+
+
+# Быстрый путь: изображения фото-поста из встроенного JSON страницы
+# (itemStruct.imagePost.images[].imageURL.urlList). Возвращает все фото карусели.
+def extract_tiktok_image_urls(html: str, post_id: str = '') -> List[str]:
+    data = _extract_script_json(html, UNIVERSAL_DATA_SCRIPT_ID)
+    if data:
+        detail = (data.get('__DEFAULT_SCOPE__') or {}).get('webapp.video-detail') or {}
+        urls = _image_post_urls((detail.get('itemInfo') or {}).get('itemStruct'))
+        if urls:
+            return urls
+
+    data = _extract_script_json(html, SIGI_STATE_SCRIPT_ID)
+    if data:
+        items = data.get('ItemModule') or {}
+        candidates = [items[post_id]] if post_id in items else list(items.values())
+        for item in candidates:
+            urls = _image_post_urls(item)
+            if urls:
+                return urls
+
+    return []
+
+
+# Поиск URL изображений TikTok фото в HTML страницы. Чистая функция без сетевых
+# запросов: принимает и возвращает только строки, поэтому может выполняться
+# в пуле процессов.
+def find_tiktok_image_urls(html: str, post_id: str = '') -> List[str]:
+    started = time.perf_counter()
+    urls = extract_tiktok_image_urls(html, post_id)
+    logger.info("Быстрый разбор TikTok JSON: %s фото за %.1f мс", len(urls), (time.perf_counter() - started) * 1000)
+    if urls:
+        return urls
+
+    started = time.perf_counter()
+    img_url = find_tiktok_image_url_fallback(html, post_id)
+    logger.info("Эвристический поиск фото TikTok: %.1f мс", (time.perf_counter() - started) * 1000)
+    return [img_url] if img_url else []
+
+
+# Прежняя цепочка эвристик: CSS-селекторы, регулярные выражения по скриптам
+# и обход всего JSON. Используется, если разметка страницы изменилась.
+def find_tiktok_image_url_fallback(html: str, post_id: str = '') -> Optional[str]:
+    soup = BeautifulSoup(html, 'html.parser')
+
+    img_selectors = [
+        'img[data-e2e="photo-item"]',
+        'img[data-e2e="slideshow-item"]', 
+        'img[alt*="photo"]',
+        'img[src*="tiktokcdn"]',
+        'img[src*="muscdn"]',
+        'img[src*="p16-sign"]',
+        'div[data-e2e="photo-item"] img',
+        'div[data-e2e="slideshow-item"] img',
+        '[data-e2e*="photo"] img',
+        'img[src*="720x"]',
+        'img[src*="1080x"]',
+        'img'
+    ]
+
+    img_url = None
+    logger.debug("Начинаем поиск изображений...")
+
+    for i, selector in enumerate(img_selectors):
+        images = soup.select(selector)
+        logger.debug("Селектор %s '%s': найдено %s изображений", i+1, selector, len(images))
+
+        for j, img in enumerate(images):
+            src = img.get('src') or img.get('data-src') or img.get('data-original')
+            if src:
+                logger.debug("Изображение %s: %s...", j+1, src[:100])
+                if any(domain in src for domain in ['tiktokcdn', 'tiktok', 'muscdn', 'p16-sign']):
+                    if any(size in src for size in ['720x', '1080x', 'large', 'medium']) or len(src) > 100:
+                        img_url = src
+                        logger.debug("Выбрано изображение: %s", img_url)
+                        break
+        if img_url:
+            break
+
+    if not img_url:
+        logger.debug("Поиск в script тегах...")
+        scripts = soup.find_all('script')
+        for script in scripts:
+            if script.string and 'photo' in script.string.lower():
+                script_text = script.string
+                logger.debug("Найден script с 'photo', длина: %s", len(script_text))
+
+                try:
+                    if script_text.strip().startswith('{') and script_text.strip().endswith('}'):
+                        logger.debug("Парсим как чистый JSON")
+                        data = json.loads(script_text)
+                    else:
+                        json_patterns = [
+                            r'window\["SIGI_STATE"\]\s*=\s*({.+?});',
+                            r'__UNIVERSAL_DATA_FOR_REHYDRATION__\s*=\s*({.+?});',
+                            r'window\.__INITIAL_STATE__\s*=\s*({.+?});',
+                            r'({.*?"__DEFAULT_SCOPE__".*?})\s*(?:;|$)',
+                            r'({.*?"photo".*?})',
+                        ]
+
+                        data = None
+                        for pattern in json_patterns:
+                            json_match = re.search(pattern, script_text, re.DOTALL)
+                            if json_match:
+                                json_text = json_match.group(1)
+                                logger.debug("Найден JSON паттерн, длина: %s", len(json_text))
+                                try:
+                                    data = json.loads(json_text)
+                                    logger.debug("JSON успешно распарсен")
+                                    break
+                                except:
+                                    logger.debug("Ошибка парсинга этого JSON")
+                                    continue
+
+                    if data:
+                        def find_image_urls(obj, path="", depth=0):
+                            if depth > 10:
+                                return []
+
+                            urls = []
+                            if isinstance(obj, dict):
+                                for key, value in obj.items():
+                                    current_path = f"{path}.{key}" if path else key
+
+                                    if isinstance(value, str) and len(value) > 20:
+                                        if any(domain in value for domain in ['tiktokcdn', 'muscdn', 'p16-sign', 'p16-amd', 'p16-va']):
+                                            has_image_ext = any(ext in value.lower() for ext in ['.jpg', '.jpeg', '.png', '.webp'])
+                                            has_image_keywords = 'image' in value.lower() or 'photo' in value.lower()
+                                            has_image_path = any(path in value.lower() for path in ['img/', '/image/', '/photo/', 'obj/', '/media/'])
+
+                                            if has_image_ext or has_image_keywords or has_image_path or 'obj/' in value:
+                                                logger.debug("Найден кандидат URL в %s: %s...", current_path, value[:120])
+
+                                                priority = 0
+
+                                                if post_id and post_id in value:
+                                                    priority += 100
+                                                    logger.debug("+100 за ID поста")
+
+                                                post_related_keys = ['video', 'aweme', 'item', 'detail', 'content', 'media']
+                                                if any(k in current_path.lower() for k in post_related_keys):
+                                                    priority += 50
+                                                    logger.debug("+50 за пост-ключи")
+
+                                                photo_keys = ['photo', 'image', 'cover', 'thumb']
+                                                if any(k in current_path.lower() for k in photo_keys):
+                                                    priority += 30
+                                                    logger.debug("+30 за фото-ключи")
+
+                                                if has_image_ext:
+                                                    priority += 20
+                                                    logger.debug("+20 за расширение изображения")
+
+                                                if 'interest' in current_path.lower() or 'category' in current_path.lower():
+                                                    priority -= 20
+                                                    logger.debug("-20 за интересы/категории")
+
+                                                logger.debug("Финальный приоритет: %s", priority)
+
+                                                if value.startswith('http://'):
+                                                    value = value.replace('http://', 'https://')
+                                                    logger.debug("Конвертировано в HTTPS")
+
+                                                urls.append((value, priority, current_path))
+                                                logger.debug("URL добавлен в список")
+                                            else:
+                                                logger.debug("URL %s не прошел проверку критериев изображения", value[:80])
+                                                logger.debug("  - has_image_ext: %s", has_image_ext)
+                                                logger.debug("  - has_image_keywords: %s", has_image_keywords)
+                                                logger.debug("  - has_image_path: %s", has_image_path)
+                                                logger.debug("  - has obj/: %s", 'obj/' in value)
+                                                logger.debug("  - URL: %s", value)
+                                        else:
+                                            if any(ext in value.lower() for ext in ['.jpg', '.jpeg', '.png', '.webp']) and 'http' in value:
+                                                logger.debug("URL %s не прошел доменную проверку", value[:80])
+
+                                    if key.lower() in ['photo', 'image', 'cover', 'video', 'aweme', 'item', 'detail', 'content', 'media'] or \
+                                       'photo' in key.lower() or 'image' in key.lower() or (post_id and post_id in str(value)):
+                                        urls.extend(find_image_urls(value, current_path, depth + 1))
+                                    elif depth < 4 and 'interest' not in current_path.lower():
+                                        urls.extend(find_image_urls(value, current_path, depth + 1))
+                            elif isinstance(obj, list):
+                                for i, item in enumerate(obj[:10]):
+                                    urls.extend(find_image_urls(item, f"{path}[{i}]", depth + 1))
+                            return urls
+
+                        image_urls = find_image_urls(data)
+                        logger.debug("Всего найдено URL изображений: %s", len(image_urls))
+
+                        image_urls.sort(key=lambda x: x[1], reverse=True)
+
+                        best_url = None
+                        for url_data in image_urls:
+                            url, priority, path = url_data
+                            logger.debug("Кандидат URL (приоритет %s): %s...", priority, url[:80])
+
+                            if priority > 0 and any(size in url for size in ['1080x', '720x', 'large']) and not best_url:
+                                best_url = url
+                                logger.debug("Выбран высококачественный URL с высоким приоритетом: %s", url)
+                                break
+
+                        if not best_url and image_urls:
+                            best_url = image_urls[0][0]
+                            logger.debug("Выбран URL с самым высоким приоритетом: %s", best_url)
+
+                        if best_url:
+                            img_url = best_url
+                            logger.debug("Финальный URL изображения: %s", img_url)
+
+                except Exception as e:
+                    logger.debug("Ошибка парсинга JSON: %s", e, exc_info=True)
+
+                if img_url:
+                    break
+
+    return img_url
@@ -0,0 +1,105 @@
+import asyncio
+import logging
+import os
+import socket
+
+from telegram import Bot
+
+import metrics
+from bot import MediaTelegramBot, get_bot_api_settings
+from config import Config
+from log_setup import set_request_id, setup_logging
+
+logger = logging.getLogger(__name__)
+
+
+# Воркер забирает задания из общей очереди, скачивает медиа и отправляет их
+# через Bot API. Фронтенд (bot.py с QUEUE_BACKEND) только принимает сообщения.
+class MediaWorker:
+    def __init__(self, bot: Bot):
+        self.bot = bot
+        self.media_bot = MediaTelegramBot()
+        self.queue = self.media_bot.job_queue
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}"
+
+    async def heartbeat(self, job_id: int):
+        # Продлеваем аренду, пока задание выполняется, чтобы его не забрал другой воркер
+        interval = max(1, Config.QUEUE_LEASE_SECONDS / 3)
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await asyncio.to_thread(self.queue.extend_lease, job_id, self.worker_id)
+            except Exception as e:
+                logger.error(f"Не удалось продлить аренду задания {job_id}: {e}")
+
+    async def run_job(self, job):
+        # Цикл воркера берет задания по одному: id задания в контексте до следующего задания
+        set_request_id(str(job.id))
+        logger.info(f"Воркер {self.worker_id} взял задание {job.id} (попытка {job.attempts})")
+
+        heartbeat = asyncio.create_task(self.heartbeat(job.id))
+        try:
+            await self.media_bot.deliver_media(
+                self.bot,
+                job.chat_id,
+                job.user_id,
+                job.url,
+                status_message_id=job.message_id
+            )
+            await asyncio.to_thread(self.queue.complete, job.id)
+        except Exception as e:
+            logger.error(f"Задание {job.id} завершилось ошибкой: {e}")
+            await asyncio.to_thread(self.queue.fail, job.id, str(e))
+        finally:
+            heartbeat.cancel()
+
+    async def worker_loop(self, index: int):
+        while True:
+            try:
+                job = await asyncio.to_thread(self.queue.claim, self.worker_id)
+            except Exception as e:
+                logger.error(f"Ошибка получения задания из очереди: {e}")
+                job = None
+
+            if job is None:
+                await asyncio.sleep(Config.QUEUE_POLL_INTERVAL)
+                continue
+
+            await self.run_job(job)
+
+    async def run(self):
+        if Config.METRICS_PORT:
+            await metrics.start_server(Config.METRICS_HOST, Config.METRICS_PORT)
+
+        loops = [asyncio.create_task(self.worker_loop(i)) for i in range(Config.WORKER_CONCURRENCY)]
+        cleanup = asyncio.create_task(self.media_bot.cleanup_task())
+
+        logger.info(f"🚀 Воркер {self.worker_id} запущен: {Config.WORKER_CONCURRENCY} параллельных заданий")
+        try:
+            await asyncio.gather(*loops)
+        finally:
+            cleanup.cancel()
+            for loop in loops:
+                loop.cancel()
+            await self.media_bot.downloader.close()
+
+
+async def main():
+    Config.validate()
+
+    if not Config.QUEUE_BACKEND:
+        raise ValueError("Для запуска воркера задайте QUEUE_BACKEND (sqlite или redis)")
+
+    async with Bot(Config.BOT_TOKEN, **get_bot_api_settings()) as bot:
+        await MediaWorker(bot).run()
+
+
+if __name__ == '__main__':
+    setup_logging()
+    try:
+        asyncio.run(main())
+    except KeyboardInterrupt:
+        pass
+    except Exception as e:
+        logger.error(f"Критическая ошибка воркера: {e}")
+        print(f"❌ Ошибка запуска воркера: {e}")
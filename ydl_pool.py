@@ -0,0 +1,109 @@
+import json
+import logging
+import threading
+from contextlib import contextmanager
+from typing import Callable, Dict, List, Optional
+
+import yt_dlp
+
+logger = logging.getLogger(__name__)
+
+
+# Переиспользуемые экземпляры YoutubeDL. Создание экземпляра загружает классы
+# экстракторов и cookie jar, а кэши экстракторов (player JS YouTube, функции
+# расшифровки подписи) живут только в нем. Экземпляры хранятся по потокам:
+# экземпляр берет только поток, который его создал, поэтому одновременно им
+# пользуется один поток. Ключ - набор опций (платформа и назначение).
+class _Entry:
+    def __init__(self):
+        self.ydl: Optional[yt_dlp.YoutubeDL] = None
+        self.uses = 0
+        # Хук прогресса текущего вызова; экземпляр создается с одним хуком-диспетчером
+        self.progress_hook: Optional[Callable[[Dict], None]] = None
+
+    def dispatch_progress(self, progress: Dict):
+        if self.progress_hook is not None:
+            self.progress_hook(progress)
+
+
+class YoutubeDLPool:
+    def __init__(self, max_uses: int = 0):
+        # max_uses > 0 - экземпляр пересоздается после стольких вызовов, чтобы кэши не росли бесконечно
+        self.max_uses = max_uses
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._entries: List[_Entry] = []
+
+    @staticmethod
+    def make_key(opts: Dict) -> str:
+        return json.dumps(opts, sort_keys=True, default=repr)
+
+    def _create(self, opts: Dict) -> _Entry:
+        entry = _Entry()
+        entry.ydl = yt_dlp.YoutubeDL({**opts, 'progress_hooks': [entry.dispatch_progress]})
+        with self._lock:
+            self._entries.append(entry)
+        return entry
+
+    def _close(self, entry: _Entry):
+        with self._lock:
+            if entry in self._entries:
+                self._entries.remove(entry)
+        try:
+            entry.ydl.close()
+        except Exception as e:
+            logger.warning(f"Ошибка закрытия YoutubeDL: {e}")
+
+    @contextmanager
+    def lease(self, opts: Dict, key: Optional[str] = None, outtmpl: Optional[str] = None,
+              format_spec: Optional[str] = None, progress_hook: Optional[Callable[[Dict], None]] = None):
+        # outtmpl, format_spec и progress_hook действуют только на время вызова
+        key = key or self.make_key(opts)
+        cache = getattr(self._local, 'entries', None)
+        if cache is None:
+            cache = self._local.entries = {}
+
+        # Экземпляр забирается из кэша на время вызова: вложенный вызов с тем же
+        # ключом в этом же потоке получит отдельный экземпляр
+        entry = cache.pop(key, None)
+        if entry is not None and self.max_uses and entry.uses >= self.max_uses:
+            self._close(entry)
+            entry = None
+        if entry is None:
+            entry = self._create(opts)
+
+        ydl = entry.ydl
+        saved_outtmpl = ydl.params['outtmpl'].get('default')
+        saved_format = ydl.params.get('format')
+        saved_selector = ydl.format_selector
+        try:
+            if outtmpl is not None:
+                ydl.params['outtmpl']['default'] = outtmpl
+            if format_spec is not None and format_spec != saved_format:
+                # Селектор формата YoutubeDL строит при создании, заменяем и его
+                ydl.params['format'] = format_spec
+                ydl.format_selector = ydl.build_format_selector(format_spec)
+            entry.progress_hook = progress_hook
+
+            yield ydl
+        finally:
+            entry.progress_hook = None
+            ydl.params['outtmpl']['default'] = saved_outtmpl
+            ydl.params['format'] = saved_format
+            ydl.format_selector = saved_selector
+            entry.uses += 1
+
+            if key in cache:
+                self._close(entry)
+            else:
+                cache[key] = entry
+
+    def close(self):
+        with self._lock:
+            entries = list(self._entries)
+        for entry in entries:
+            self._close(entry)
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._entries)
@@ -1,24 +1,248 @@
 import asyncio
+import io
 import os
 import yt_dlp
 import tempfile
 import logging
 import time
 import re
+import threading
+import urllib.parse
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+import httpx
+import importlib.util
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from bs4 import BeautifulSoup
-from typing import Optional, Dict
+from yt_dlp.extractor import get_info_extractor
+from yt_dlp.networking import Request
+from yt_dlp.utils import DownloadCancelled
+from typing import Callable, Optional, Dict, List, Tuple, Union
+from cache import MediaDiskCache, MetadataCache
 from config import Config
+from executors import HostConnectionLimiter, StagePool
+from formats import estimate_size, is_progressive, plan_format
+from journal import DownloadJournal
+from log_setup import debug_dumps_enabled, write_debug_dump
+import metrics
+from tiktok_parser import find_tiktok_image_urls
+from ydl_pool import YoutubeDLPool
 
 logger = logging.getLogger(__name__)
 
+# Экземпляры YoutubeDL по потокам; в режиме process у каждого дочернего процесса свой пул
+ydl_pool = YoutubeDLPool(Config.YTDLP_INSTANCE_MAX_USES)
+
+
+# Функция верхнего уровня, чтобы ее можно было выполнять в пуле процессов:
+# возвращает info dict, очищенный sanitize_info до простых picklable-типов
+def extract_info(url: str, opts: Dict, key: Optional[str] = None) -> Tuple[Optional[Dict], Optional[str]]:
+    # Возвращает (info, None) или (None, текст ошибки): исключения yt-dlp
+    # не всегда переживают передачу из дочернего процесса
+    with ydl_pool.lease(opts, key) as ydl:
+        try:
+            info = ydl.extract_info(url, download=False)
+            return ydl.sanitize_info(info), None
+        except Exception as e:
+            logger.error(f"Ошибка получения информации: {e}")
+            return None, str(e)
+
+
+# Ошибки, которые не исчезнут при повторе: их результат кэшируется как отрицательный
+PERMANENT_ERROR_MARKERS = (
+    'private',
+    'video unavailable',
+    'has been removed',
+    'been deleted',
+    'does not exist',
+    'not found',
+    'http error 404',
+    'http error 410',
+)
+
+
+def is_permanent_error(error: str) -> bool:
+    error_lower = error.lower()
+    return any(marker in error_lower for marker in PERMANENT_ERROR_MARKERS)
+
+
+# Поля info dict и форматов, которые читают plan_format и download_media: в кэше
+# метаданных хранится только это, а не весь info dict с субтитрами и превью
+CACHED_INFO_KEYS = ('id', 'extractor', 'extractor_key', 'title', 'uploader', 'duration', 'webpage_url',
+                    'original_url', 'http_headers')
+CACHED_FORMAT_KEYS = ('format_id', 'url', 'ext', 'protocol', 'vcodec', 'acodec', 'width', 'height', 'tbr',
+                      'filesize', 'filesize_approx', 'http_headers', 'cookies', 'downloader_options')
+
+
+def trim_info(info: Dict) -> Optional[Dict]:
+    # None - info не годится для скачивания без повторного extract_info:
+    # нет прогрессивного формата в бюджете (DASH/HLS, карусели)
+    if plan_format(info) is None:
+        return None
+    trimmed = {key: info[key] for key in CACHED_INFO_KEYS if key in info}
+    trimmed['formats'] = [
+        {key: fmt[key] for key in CACHED_FORMAT_KEYS if key in fmt}
+        for fmt in info.get('formats') or []
+        if is_progressive(fmt)
+    ]
+    return trimmed
+
+
+# Состояние одного запроса между этапами: info dict из get_media_info
+# переиспользуется при скачивании, чтобы не вызывать extract_info повторно
+class MediaJob:
+    def __init__(self, url: str):
+        # Уникальный id задает имя выходного файла, без коллизий между заданиями
+        self.id = uuid.uuid4().hex[:16]
+        self.url = url
+        self.info: Optional[Dict] = None
+        # Вызывается в event loop с процентом скачанного
+        self.on_progress: Optional[Callable[[float], None]] = None
+        # Устанавливается при тайм-ауте: поток загрузки останавливается на следующем блоке
+        self.cancelled = threading.Event()
+
+
+# Результат скачивания: файл на диске или, в потоковом режиме, байты в памяти
+class MediaFile:
+    def __init__(self, path: Optional[str] = None, data: Optional[Union[bytes, memoryview]] = None,
+                 filename: str = '', on_remove: Optional[Callable[[], None]] = None, media_type: Optional[str] = None):
+        self.path = path
+        self.data = data
+        self.filename = filename or (os.path.basename(path) if path else 'media')
+        # 'photo' или 'video' для элементов альбома
+        self.media_type = media_type
+        # Для файлов из дискового кэша: вместо удаления отпускаем ссылку на файл
+        self.on_remove = on_remove
+
+    @property
+    def in_memory(self) -> bool:
+        return self.data is not None
+
+    @property
+    def size(self) -> int:
+        if self.data is not None:
+            return len(self.data)
+        return os.path.getsize(self.path)
+
+    def exists(self) -> bool:
+        return self.data is not None or bool(self.path and os.path.exists(self.path))
+
+    def open(self):
+        if self.data is not None:
+            return io.BytesIO(self.data)
+        return open(self.path, 'rb')
+
+    def remove(self):
+        self.data = None
+        if self.on_remove is not None:
+            on_remove, self.on_remove = self.on_remove, None
+            self.path = None
+            on_remove()
+            return
+
+        if self.path and os.path.exists(self.path):
+            os.remove(self.path)
+
+
+# Несколько медиа одного поста: фото-карусель TikTok или карусель Instagram
+class MediaGroup:
+    def __init__(self, items: List[MediaFile]):
+        self.items = items
+        self.path = None
+        self.filename = 'album'
+
+    @property
+    def in_memory(self) -> bool:
+        return all(item.in_memory for item in self.items)
+
+    @property
+    def size(self) -> int:
+        # Лимит Telegram действует на каждый файл альбома отдельно
+        return max((item.size for item in self.items), default=0)
+
+    def exists(self) -> bool:
+        return bool(self.items) and all(item.exists() for item in self.items)
+
+    def remove(self):
+        for item in self.items:
+            item.remove()
+
+
+# Файлы, созданные загрузчиком: очистка проходит по ним, а не по всему каталогу
+class FileRegistry:
+    def __init__(self):
+        self._files: Dict[str, float] = {}
+        self._lock = threading.Lock()
+
+    def add(self, path: str, created_at: Optional[float] = None):
+        with self._lock:
+            self._files[path] = created_at or time.time()
+
+    def discard(self, path: str):
+        with self._lock:
+            self._files.pop(path, None)
+
+    def expired(self, max_age_seconds: float) -> List[str]:
+        deadline = time.time() - max_age_seconds
+        with self._lock:
+            return [path for path, created_at in self._files.items() if created_at < deadline]
+
+    def __len__(self) -> int:
+        return len(self._files)
+
 
 class MediaDownloader:
     def __init__(self):
         self.downloads_dir = Config.DOWNLOADS_DIR
 
+        self.download_pool = StagePool('download', Config.DOWNLOAD_WORKERS)
+        self.scrape_pool = StagePool('scrape', Config.SCRAPE_WORKERS)
+
+        # Извлечение yt-dlp и разбор HTML упираются в GIL, в режиме process
+        # они выполняются в отдельных процессах
+        if Config.EXTRACTION_MODE == 'process':
+            self.info_pool = StagePool('info', Config.PROCESS_WORKERS, use_processes=True)
+            self.parse_pool = StagePool('parse', Config.PROCESS_WORKERS, use_processes=True)
+        else:
+            self.info_pool = StagePool('info', Config.INFO_WORKERS)
+            self.parse_pool = self.scrape_pool
+
+        self.metadata_cache = MetadataCache(
+            Config.METADATA_CACHE_PATH,
+            Config.METADATA_CACHE_TTL_SECONDS,
+            Config.METADATA_NEGATIVE_TTL_SECONDS,
+            Config.METADATA_CACHE_MEMORY_ENTRIES,
+            Config.METADATA_CACHE_MAX_ENTRIES,
+            Config.METADATA_CACHE_MEMORY_BYTES
+        )
+
+        self.files = FileRegistry()
+        self._register_leftover_files()
+
+        self.journal = DownloadJournal(Config.DOWNLOAD_JOURNAL_PATH, Config.DOWNLOAD_JOURNAL_MAX_AGE_HOURS * 3600)
+
+        self.media_cache = None
+        if Config.MEDIA_CACHE_ENABLED:
+            self.media_cache = MediaDiskCache(
+                os.path.join(self.downloads_dir, 'cache'),
+                Config.MEDIA_CACHE_MAX_BYTES
+            )
+
+        self.scrape_headers = {
+            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36',
+            'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,image/avif,image/webp,*/*;q=0.8',
+            'Accept-Language': 'en-US,en;q=0.5',
+            'Accept-Encoding': 'gzip, deflate',
+            'DNT': '1',
+            'Connection': 'keep-alive',
+            'Upgrade-Insecure-Requests': '1',
+        }
+
         self.base_ydl_opts = {
-            'format': 'worst[ext=mp4][filesize<50M]/worst[filesize<50M]/worst[ext=mp4]/worst',
+            # Запасной вариант, если planner не нашел формат: один файл без склейки ffmpeg
+            'format': f'best[ext=mp4][height<={Config.FORMAT_MAX_HEIGHT}]/best[height<={Config.FORMAT_MAX_HEIGHT}]/best',
             'outtmpl': os.path.join(self.downloads_dir, 'video_%(timestamp)s_%(title).50s.%(ext)s'),
             'restrictfilenames': True,
             'noplaylist': True,
@@ -31,15 +255,34 @@ class MediaDownloader:
             'quiet': True,
             'socket_timeout': 30,
             'retries': 3,
+            # Общий для бота и воркеров дисковый кэш yt-dlp: расшифровка подписи YouTube
+            # и player JS вычисляются один раз, а не на каждый запрос
+            'cachedir': Config.YTDLP_CACHE_DIR,
         }
         
+        self.http = self._create_http_session()
+        self.http_timeout = (Config.HTTP_CONNECT_TIMEOUT, Config.HTTP_READ_TIMEOUT)
+
+        # Общий лимит соединений к одному хосту для всех загрузок по частям (_download_ranged).
+        # Фрагменты DASH/HLS yt-dlp качает своими потоками в обход этого лимита
+        self.host_limiter = HostConnectionLimiter(Config.DOWNLOAD_MAX_CONNECTIONS_PER_HOST)
+
+        # concurrent_fragment_downloads - число параллельных фрагментов DASH/HLS
+        # и частей при загрузке прогрессивного файла по Range
         self.platform_opts = {
+            'youtube': {
+                'concurrent_fragment_downloads': Config.YOUTUBE_DOWNLOAD_CONNECTIONS,
+            },
             'instagram': {
+                'concurrent_fragment_downloads': Config.DOWNLOAD_CONNECTIONS,
+                # Фото в карусели не имеют видеоформатов; без этого вся карусель падает с ошибкой
+                'ignore_no_formats_error': True,
                 'http_headers': {
                     'User-Agent': 'Mozilla/5.0 (iPhone; CPU iPhone OS 14_0 like Mac OS X) AppleWebKit/605.1.15'
                 }
             },
             'tiktok': {
+                'concurrent_fragment_downloads': Config.DOWNLOAD_CONNECTIONS,
                 'http_headers': {
                     'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36',
                     'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,image/avif,image/webp,*/*;q=0.8',
@@ -59,6 +302,55 @@ class MediaDownloader:
             }
         }
 
+        # Опции yt-dlp по платформам собираются один раз; они же - ключи пула экземпляров
+        self.info_opts = {
+            platform: {**self.base_ydl_opts, **self.platform_opts.get(platform, {})}
+            for platform in [*Config.SUPPORTED_PLATFORMS, 'unknown']
+        }
+        self.download_opts = {}
+        for platform, info_opts in self.info_opts.items():
+            download_opts = {
+                **info_opts,
+                # Недокачанный .part-файл прошлой попытки продолжается по Range
+                'continuedl': True,
+                # yt-dlp прерывает загрузку, как только размер превысит лимит
+                'max_filesize': Config.TELEGRAM_MAX_FILE_SIZE,
+            }
+            # Ограничение на один файл: одновременные загрузки DASH/HLS с одного хоста
+            # вместе могут открыть больше соединений
+            download_opts['concurrent_fragment_downloads'] = min(
+                download_opts.get('concurrent_fragment_downloads') or 1,
+                Config.DOWNLOAD_MAX_CONNECTIONS_PER_HOST
+            )
+            self.download_opts[platform] = download_opts
+
+        # Запасной путь TikTok фото: thumbnails из info dict yt-dlp
+        self.tiktok_fallback_opts = {
+            'quiet': True,
+            'no_warnings': True,
+            'extractaudio': False,
+            'outtmpl': f'{self.downloads_dir}/%(id)s.%(ext)s',
+            'user_agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36',
+            'headers': {
+                'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8',
+                'Accept-Language': 'en-us,en;q=0.5',
+            },
+            'cachedir': Config.YTDLP_CACHE_DIR,
+        }
+
+        # Экстракторы yt-dlp, по _VALID_URL которых id медиа берется прямо из ссылки
+        self.platform_extractors = {
+            'youtube': ['Youtube'],
+            'instagram': ['Instagram'],
+            'tiktok': ['TikTok', 'TikTokVM'],
+        }
+
+        self.short_url_domains = ['vt.tiktok.com', 'vm.tiktok.com']
+        # Кэш развернутых коротких ссылок: короткая -> (полная, время истечения)
+        self._resolved_urls: Dict[str, Tuple[str, float]] = {}
+        self._resolving: Dict[str, asyncio.Future] = {}
+        self._http_client: Optional[httpx.AsyncClient] = None
+
     def detect_platform(self, url: str) -> str:
         url_lower = url.lower()
         
@@ -69,405 +361,293 @@ class MediaDownloader:
         
         return 'unknown'
 
-    def resolve_tiktok_url(self, url: str) -> str:
-        try:
-            if any(domain in url.lower() for domain in ['vt.tiktok.com', 'vm.tiktok.com']):
-                print(f"DEBUG: Разворачиваем сокращенную ссылку: {url}")
-                response = requests.head(url, allow_redirects=True, timeout=10)
-                resolved_url = response.url
-                print(f"DEBUG: Развернутая ссылка: {resolved_url}")
-                return resolved_url
+    def get_media_key(self, url: str, info: Optional[Dict] = None) -> Optional[str]:
+        platform = self.detect_platform(url)
+
+        if info and info.get('id') and info.get('extractor_key'):
+            return f"{platform}:{info['extractor_key']}:{info['id']}"
+
+        photo_match = re.search(r'tiktok\.com/@[^/]*/photo/(\d+)', url, re.IGNORECASE)
+        if photo_match:
+            return f"tiktok:photo:{photo_match.group(1)}"
+
+        for ie_key in self.platform_extractors.get(platform, []):
+            ie = get_info_extractor(ie_key)
+            if ie.suitable(url):
+                media_id = ie.get_temp_id(url)
+                if media_id:
+                    return f"{platform}:{ie_key}:{media_id}"
+
+        return None
+
+    def is_short_url(self, url: str) -> bool:
+        return any(domain in url.lower() for domain in self.short_url_domains)
+
+    def _get_cached_resolution(self, url: str) -> Optional[str]:
+        cached = self._resolved_urls.get(url)
+        if cached is None:
+            return None
+
+        resolved_url, expires_at = cached
+        if time.time() > expires_at:
+            self._resolved_urls.pop(url, None)
+            return None
+        return resolved_url
+
+    def _cache_resolution(self, url: str, resolved_url: str):
+        if len(self._resolved_urls) >= Config.RESOLVED_URL_CACHE_SIZE:
+            # Удаляем самую старую запись (dict хранит порядок вставки)
+            self._resolved_urls.pop(next(iter(self._resolved_urls)), None)
+        self._resolved_urls[url] = (resolved_url, time.time() + Config.RESOLVED_URL_TTL_SECONDS)
+
+    def _create_http_session(self) -> requests.Session:
+        # Одна сессия на все потоки скрапинга: соединения с TikTok и CDN
+        # переиспользуются вместо нового TCP+TLS на каждый запрос
+        retry = Retry(
+            total=Config.HTTP_RETRIES,
+            backoff_factor=Config.HTTP_BACKOFF_FACTOR,
+            status_forcelist=(429, 500, 502, 503, 504),
+            allowed_methods=('GET', 'HEAD'),
+            raise_on_status=False
+        )
+        # Через сессию идут и части загрузок по Range: пул к хосту не меньше лимита
+        # HostConnectionLimiter, иначе потоки ждали бы соединения внутри urllib3, заняв слот лимита
+        adapter = HTTPAdapter(
+            pool_connections=32,
+            pool_maxsize=max(Config.HTTP_MAX_CONNECTIONS_PER_HOST, Config.DOWNLOAD_MAX_CONNECTIONS_PER_HOST),
+            pool_block=True,
+            max_retries=retry
+        )
+
+        session = requests.Session()
+        session.headers.update(self.scrape_headers)
+        session.mount('https://', adapter)
+        session.mount('http://', adapter)
+        return session
+
+    def _get_http_client(self) -> httpx.AsyncClient:
+        if self._http_client is None:
+            # HTTP/2 включается, если установлен пакет h2 (httpx[http2])
+            self._http_client = httpx.AsyncClient(
+                follow_redirects=True,
+                timeout=httpx.Timeout(Config.RESOLVE_TIMEOUT, connect=Config.HTTP_CONNECT_TIMEOUT),
+                transport=httpx.AsyncHTTPTransport(
+                    retries=Config.HTTP_RETRIES,
+                    http2=importlib.util.find_spec('h2') is not None,
+                    limits=httpx.Limits(
+                        max_connections=Config.HTTP_MAX_CONNECTIONS_PER_HOST * 4,
+                        max_keepalive_connections=Config.HTTP_MAX_CONNECTIONS_PER_HOST
+                    )
+                )
+            )
+        return self._http_client
+
+    async def resolve_url(self, url: str) -> str:
+        if not self.is_short_url(url):
             return url
+
+        cached = self._get_cached_resolution(url)
+        metrics.CACHE_REQUESTS.inc(cache='resolve', result='hit' if cached else 'miss')
+        if cached:
+            return cached
+
+        # Одновременные запросы одной и той же короткой ссылки ждут один редирект
+        pending = self._resolving.get(url)
+        if pending is not None:
+            return await asyncio.shield(pending)
+
+        future = asyncio.get_running_loop().create_future()
+        self._resolving[url] = future
+        resolved_url = url
+        try:
+            response = await self._get_http_client().head(url)
+            resolved_url = str(response.url)
+            self._cache_resolution(url, resolved_url)
+            logger.info(f"Короткая ссылка {url} развернута в {resolved_url}")
         except Exception as e:
-            print(f"DEBUG: Ошибка разворачивания ссылки: {e}")
-            return url
+            logger.warning(f"Ошибка разворачивания ссылки {url}: {e}")
+        finally:
+            self._resolving.pop(url, None)
+            future.set_result(resolved_url)
+
+        return resolved_url
+
+    def get_pools(self) -> list:
+        pools = [self.info_pool, self.download_pool, self.scrape_pool]
+        if self.parse_pool is not self.scrape_pool:
+            pools.append(self.parse_pool)
+        return pools
+
+    def get_pool_stats(self) -> Dict[str, Dict]:
+        return {pool.name: pool.stats() for pool in self.get_pools()}
+
+    async def close(self):
+        if self._http_client is not None:
+            await self._http_client.aclose()
+            self._http_client = None
+        self.http.close()
+
+        for pool in self.get_pools():
+            pool.shutdown()
+        ydl_pool.close()
 
     def is_tiktok_photo(self, url: str) -> bool:
-        resolved_url = self.resolve_tiktok_url(url)
-        url_lower = resolved_url.lower()
-        
-        print(f"DEBUG: Проверяем URL: {url_lower}")
-        
-        has_tiktok = 'tiktok.com' in url_lower
-        has_photo = '/photo/' in url_lower
-        is_photo = has_tiktok and has_photo
-        
-        print(f"DEBUG: has_tiktok: {has_tiktok}")
-        print(f"DEBUG: has_photo: {has_photo}")  
-        print(f"DEBUG: result: {is_photo}")
-        
-        return is_photo
-    
+        # Только проверка строки: короткие ссылки заранее разворачивает асинхронный resolve_url,
+        # синхронный запрос здесь заблокировал бы event loop
+        url_lower = url.lower()
+        return 'tiktok.com' in url_lower and '/photo/' in url_lower
+
     def get_platform_info(self, url: str) -> Dict:
         platform = self.detect_platform(url)
         if platform in Config.SUPPORTED_PLATFORMS:
             return Config.SUPPORTED_PLATFORMS[platform]
         return {'name': '❓ Unknown', 'emoji': '🔗'}
     
-    async def download_tiktok_photo(self, url: str) -> Optional[str]:
-        logger.info(f"download_tiktok_photo начинает работу с URL: {url}")
+    def _fetch_tiktok_page(self, resolved_url: str) -> str:
+        logger.debug("Загружаем страницу: %s", resolved_url)
+
+        response = self.http.get(resolved_url, timeout=self.http_timeout)
+        response.raise_for_status()
+
+        logger.debug("Статус ответа: %s", response.status_code)
+        logger.debug("Размер контента: %s символов", len(response.text))
+        return response.text
+
+    def _download_tiktok_image(self, resolved_url: str, html: str, img_url: Optional[str]):
+        headers = self.scrape_headers
         try:
-            loop = asyncio.get_event_loop()
-            
-            def _download_photo(url_param, self_param):
-                logger.info("Начинаем скачивание TikTok фото через веб-скрапинг")
+            if not img_url:
+                logger.error("Не удалось найти URL изображения через веб-скрапинг")
+                logger.debug("Пробуем использовать yt-dlp как fallback...")
+
                 try:
-                    headers = {
-                        'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36',
-                        'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,image/avif,image/webp,*/*;q=0.8',
-                        'Accept-Language': 'en-US,en;q=0.5',
-                        'Accept-Encoding': 'gzip, deflate',
-                        'DNT': '1',
-                        'Connection': 'keep-alive',
-                        'Upgrade-Insecure-Requests': '1',
-                    }
-                    
-                    resolved_url = self_param.resolve_tiktok_url(url_param)
-                    print(f"DEBUG: Загружаем страницу: {resolved_url}")
-                    
-                    response = requests.get(resolved_url, headers=headers, timeout=30)
-                    response.raise_for_status()
-                    
-                    print(f"DEBUG: Статус ответа: {response.status_code}")
-                    print(f"DEBUG: Размер контента: {len(response.text)} символов")
-                    
-                    soup = BeautifulSoup(response.text, 'html.parser')
-                    
-                    img_selectors = [
-                        'img[data-e2e="photo-item"]',
-                        'img[data-e2e="slideshow-item"]', 
-                        'img[alt*="photo"]',
-                        'img[src*="tiktokcdn"]',
-                        'img[src*="muscdn"]',
-                        'img[src*="p16-sign"]',
-                        'div[data-e2e="photo-item"] img',
-                        'div[data-e2e="slideshow-item"] img',
-                        '[data-e2e*="photo"] img',
-                        'img[src*="720x"]',
-                        'img[src*="1080x"]',
-                        'img'
-                    ]
-                    
-                    img_url = None
-                    print(f"DEBUG: Начинаем поиск изображений...")
-                    
-                    for i, selector in enumerate(img_selectors):
-                        images = soup.select(selector)
-                        print(f"DEBUG: Селектор {i+1} '{selector}': найдено {len(images)} изображений")
-                        
-                        for j, img in enumerate(images):
-                            src = img.get('src') or img.get('data-src') or img.get('data-original')
-                            if src:
-                                print(f"DEBUG: Изображение {j+1}: {src[:100]}...")
-                                if any(domain in src for domain in ['tiktokcdn', 'tiktok', 'muscdn', 'p16-sign']):
-                                    if any(size in src for size in ['720x', '1080x', 'large', 'medium']) or len(src) > 100:
-                                        img_url = src
-                                        print(f"DEBUG: Выбрано изображение: {img_url}")
-                                        break
-                        if img_url:
-                            break
-                    
-                    if not img_url:
-                        print("DEBUG: Поиск в script тегах...")
-                        scripts = soup.find_all('script')
-                        for script in scripts:
-                            if script.string and 'photo' in script.string.lower():
-                                script_text = script.string
-                                print(f"DEBUG: Найден script с 'photo', длина: {len(script_text)}")
-                                
-                                try:
-                                    import json
-                                    import re
-                                    
-                                    if script_text.strip().startswith('{') and script_text.strip().endswith('}'):
-                                        print("DEBUG: Парсим как чистый JSON")
-                                        data = json.loads(script_text)
-                                    else:
-                                        json_patterns = [
-                                            r'window\["SIGI_STATE"\]\s*=\s*({.+?});',
-                                            r'__UNIVERSAL_DATA_FOR_REHYDRATION__\s*=\s*({.+?});',
-                                            r'window\.__INITIAL_STATE__\s*=\s*({.+?});',
-                                            r'({.*?"__DEFAULT_SCOPE__".*?})\s*(?:;|$)',
-                                            r'({.*?"photo".*?})',
-                                        ]
-                                        
-                                        data = None
-                                        for pattern in json_patterns:
-                                            json_match = re.search(pattern, script_text, re.DOTALL)
-                                            if json_match:
-                                                json_text = json_match.group(1)
-                                                print(f"DEBUG: Найден JSON паттерн, длина: {len(json_text)}")
-                                                try:
-                                                    data = json.loads(json_text)
-                                                    print("DEBUG: JSON успешно распарсен")
-                                                    break
-                                                except:
-                                                    print("DEBUG: Ошибка парсинга этого JSON")
-                                                    continue
-                                    
-                                    if data:
-                                        def find_image_urls(obj, path="", depth=0):
-                                            if depth > 10:
-                                                return []
-                                            
-                                            urls = []
-                                            if isinstance(obj, dict):
-                                                for key, value in obj.items():
-                                                    current_path = f"{path}.{key}" if path else key
-                                                    
-                                                    if isinstance(value, str) and len(value) > 20:
-                                                        if any(domain in value for domain in ['tiktokcdn', 'muscdn', 'p16-sign', 'p16-amd', 'p16-va']):
-                                                            has_image_ext = any(ext in value.lower() for ext in ['.jpg', '.jpeg', '.png', '.webp'])
-                                                            has_image_keywords = 'image' in value.lower() or 'photo' in value.lower()
-                                                            has_image_path = any(path in value.lower() for path in ['img/', '/image/', '/photo/', 'obj/', '/media/'])
-                                                            
-                                                            if has_image_ext or has_image_keywords or has_image_path or 'obj/' in value:
-                                                                print(f"DEBUG: Найден кандидат URL в {current_path}: {value[:120]}...")
-                                                                
-                                                                priority = 0
-                                                                
-                                                                if '7552419203936947478' in value:
-                                                                    priority += 100
-                                                                    print(f"DEBUG: +100 за ID поста")
-                                                                
-                                                                post_related_keys = ['video', 'aweme', 'item', 'detail', 'content', 'media']
-                                                                if any(k in current_path.lower() for k in post_related_keys):
-                                                                    priority += 50
-                                                                    print(f"DEBUG: +50 за пост-ключи")
-                                                                
-                                                                photo_keys = ['photo', 'image', 'cover', 'thumb']
-                                                                if any(k in current_path.lower() for k in photo_keys):
-                                                                    priority += 30
-                                                                    print(f"DEBUG: +30 за фото-ключи")
-                                                                
-                                                                if has_image_ext:
-                                                                    priority += 20
-                                                                    print(f"DEBUG: +20 за расширение изображения")
-                                                                
-                                                                if 'interest' in current_path.lower() or 'category' in current_path.lower():
-                                                                    priority -= 20
-                                                                    print(f"DEBUG: -20 за интересы/категории")
-                                                                
-                                                                print(f"DEBUG: Финальный приоритет: {priority}")
-                                                                
-                                                                if value.startswith('http://'):
-                                                                    value = value.replace('http://', 'https://')
-                                                                    print(f"DEBUG: Конвертировано в HTTPS")
-                                                                
-                                                                urls.append((value, priority, current_path))
-                                                                print(f"DEBUG: URL добавлен в список")
-                                                            else:
-                                                                print(f"DEBUG: URL {value[:80]} не прошел проверку критериев изображения")
-                                                                print(f"  - has_image_ext: {has_image_ext}")
-                                                                print(f"  - has_image_keywords: {has_image_keywords}")
-                                                                print(f"  - has_image_path: {has_image_path}")
-                                                                print(f"  - has obj/: {'obj/' in value}")
-                                                                print(f"  - URL: {value}")
-                                                        else:
-                                                            if any(ext in value.lower() for ext in ['.jpg', '.jpeg', '.png', '.webp']) and 'http' in value:
-                                                                print(f"DEBUG: URL {value[:80]} не прошел доменную проверку")
-                                                    
-                                                    if key.lower() in ['photo', 'image', 'cover', 'video', 'aweme', 'item', 'detail', 'content', 'media'] or \
-                                                       'photo' in key.lower() or 'image' in key.lower() or '7552419203936947478' in str(value):
-                                                        urls.extend(find_image_urls(value, current_path, depth + 1))
-                                                    elif depth < 4 and 'interest' not in current_path.lower():
-                                                        urls.extend(find_image_urls(value, current_path, depth + 1))
-                                            elif isinstance(obj, list):
-                                                for i, item in enumerate(obj[:10]):
-                                                    urls.extend(find_image_urls(item, f"{path}[{i}]", depth + 1))
-                                            return urls
-                                        
-                                        image_urls = find_image_urls(data)
-                                        print(f"DEBUG: Всего найдено URL изображений: {len(image_urls)}")
-                                        
-                                        image_urls.sort(key=lambda x: x[1], reverse=True)
-                                        
-                                        best_url = None
-                                        for url_data in image_urls:
-                                            url, priority, path = url_data
-                                            print(f"DEBUG: Кандидат URL (приоритет {priority}): {url[:80]}...")
-                                            
-                                            if priority > 0 and any(size in url for size in ['1080x', '720x', 'large']) and not best_url:
-                                                best_url = url
-                                                print(f"DEBUG: Выбран высококачественный URL с высоким приоритетом: {url}")
-                                                break
-                                        
-                                        if not best_url and image_urls:
-                                            best_url = image_urls[0][0]
-                                            print(f"DEBUG: Выбран URL с самым высоким приоритетом: {best_url}")
-                                        
-                                        if best_url:
-                                            img_url = best_url
-                                            print(f"DEBUG: Финальный URL изображения: {img_url}")
-                                            
-                                except Exception as e:
-                                    print(f"DEBUG: Ошибка парсинга JSON: {e}")
-                                    import traceback
-                                    traceback.print_exc()
-                                
-                                if img_url:
+                    with ydl_pool.lease(self.tiktok_fallback_opts, 'tiktok_fallback') as ydl:
+                        info = ydl.extract_info(resolved_url, download=False)
+                        logger.debug("yt-dlp info: %s", info.get('title', 'No title'))
+
+                        if 'thumbnails' in info and info['thumbnails']:
+                            for thumb in info['thumbnails']:
+                                if thumb.get('url') and any(size in str(thumb.get('width', 0)) for size in ['720', '1080', '640']):
+                                    img_url = thumb['url']
+                                    logger.debug("Найден thumbnail высокого качества: %s", img_url)
                                     break
-                    
-                    if not img_url:
-                        logger.error("Не удалось найти URL изображения через веб-скрапинг")
-                        print("DEBUG: Пробуем использовать yt-dlp как fallback...")
-                        
-                        try:
-                            ydl_opts = {
-                                'quiet': True,
-                                'no_warnings': True,
-                                'extractaudio': False,
-                                'outtmpl': f'{self_param.downloads_dir}/%(id)s.%(ext)s',
-                                'user_agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36',
-                                'headers': {
-                                    'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8',
-                                    'Accept-Language': 'en-us,en;q=0.5',
-                                },
-                            }
-                            
-                            import yt_dlp
-                            with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-                                info = ydl.extract_info(resolved_url, download=False)
-                                print(f"DEBUG: yt-dlp info: {info.get('title', 'No title')}")
-                                
-                                if 'thumbnails' in info and info['thumbnails']:
-                                    for thumb in info['thumbnails']:
-                                        if thumb.get('url') and any(size in str(thumb.get('width', 0)) for size in ['720', '1080', '640']):
-                                            img_url = thumb['url']
-                                            print(f"DEBUG: Найден thumbnail высокого качества: {img_url}")
-                                            break
-                                    
-                                    if not img_url and info['thumbnails']:
-                                        img_url = info['thumbnails'][-1]['url']
-                                        print(f"DEBUG: Используем последний thumbnail: {img_url}")
-                                        
-                        except Exception as e:
-                            print(f"DEBUG: yt-dlp fallback ошибка: {e}")
-                        
-                        if not img_url:
-                            print("DEBUG: Сохраняем HTML для анализа...")
-                            try:
-                                with open('/tmp/tiktok_debug.html', 'w', encoding='utf-8') as f:
-                                    f.write(response.text)
-                                print("DEBUG: HTML сохранен в /tmp/tiktok_debug.html")
-                                
-                                with open('/tmp/tiktok_scripts.txt', 'w', encoding='utf-8') as f:
-                                    scripts = soup.find_all('script')
-                                    for i, script in enumerate(scripts):
-                                        if script.string:
-                                            f.write(f"=== SCRIPT {i+1} ===\n")
-                                            f.write(script.string[:5000])
-                                            f.write(f"\n... (длина: {len(script.string)})\n\n")
-                                print("DEBUG: Scripts сохранены в /tmp/tiktok_scripts.txt")
-                            except Exception as e:
-                                print(f"DEBUG: Ошибка сохранения файлов: {e}")
-                            return None
-                    
-                    try:
-                        img_response = requests.get(img_url, headers=headers, timeout=30)
-                        img_response.raise_for_status()
-                    except (requests.exceptions.HTTPError, requests.exceptions.RequestException) as e:
-                        print(f"DEBUG: Ошибка скачивания {img_url}: {e}")
-                        print("DEBUG: Пробуем yt-dlp fallback...")
-                        
-                        img_url = None
-                        try:
-                            ydl_opts = {
-                                'quiet': True,
-                                'no_warnings': True,
-                                'extractaudio': False,
-                                'outtmpl': f'{self_param.downloads_dir}/%(id)s.%(ext)s',
-                                'user_agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36',
-                                'headers': {
-                                    'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8',
-                                    'Accept-Language': 'en-us,en;q=0.5',
-                                },
-                            }
-                            
-                            import yt_dlp
-                            with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-                                info = ydl.extract_info(resolved_url, download=False)
-                                print(f"DEBUG: yt-dlp info: {info.get('title', 'No title')}")
-                                
-                                if 'thumbnails' in info and info['thumbnails']:
-                                    for thumb in info['thumbnails']:
-                                        if thumb.get('url') and any(size in str(thumb.get('width', 0)) for size in ['720', '1080', '640']):
-                                            img_url = thumb['url']
-                                            print(f"DEBUG: Найден thumbnail высокого качества: {img_url}")
-                                            break
-                                    
-                                    if not img_url and info['thumbnails']:
-                                        img_url = info['thumbnails'][-1]['url']
-                                        print(f"DEBUG: Используем последний thumbnail: {img_url}")
-                                
-                                if img_url:
-                                    img_response = requests.get(img_url, headers=headers, timeout=30)
-                                    img_response.raise_for_status()
-                                    print(f"DEBUG: Успешно скачали через yt-dlp fallback!")
-                                        
-                        except Exception as fallback_e:
-                            print(f"DEBUG: yt-dlp fallback тоже не сработал: {fallback_e}")
-                            
-                        if not img_url:
-                            print("DEBUG: TikTok фото не поддерживается yt-dlp")
-                            return "TIKTOK_PHOTO_NOT_SUPPORTED"
-                    
-                    content_type = img_response.headers.get('content-type', '')
-                    if 'jpeg' in content_type or 'jpg' in content_type:
-                        ext = '.jpg'
-                    elif 'png' in content_type:
-                        ext = '.png'
-                    elif 'webp' in content_type:
-                        ext = '.webp'
-                    else:
-                        ext = '.jpg'
-                    
-                    timestamp = str(int(time.time()))
-                    filename = f'tiktok_photo_{timestamp}{ext}'
-                    file_path = os.path.join(self.downloads_dir, filename)
-                    
-                    with open(file_path, 'wb') as f:
-                        f.write(img_response.content)
-                    
-                    logger.info(f"TikTok фото успешно скачано: {file_path}")
-                    return file_path
-                    
+
+                            if not img_url and info['thumbnails']:
+                                img_url = info['thumbnails'][-1]['url']
+                                logger.debug("Используем последний thumbnail: %s", img_url)
+
                 except Exception as e:
-                    logger.error(f"Ошибка при скачивании TikTok фото: {e}")
+                    logger.debug("yt-dlp fallback ошибка: %s", e)
+
+                if not img_url:
+                    # Страница сохраняется для разбора, только если включены отладочные дампы
+                    if debug_dumps_enabled():
+                        write_debug_dump('tiktok_page.html', html)
+                        write_debug_dump('tiktok_scripts.txt', '\n\n'.join(
+                            f"=== SCRIPT {i + 1} (длина: {len(script.string)}) ===\n{script.string[:5000]}"
+                            for i, script in enumerate(BeautifulSoup(html, 'html.parser').find_all('script'))
+                            if script.string
+                        ))
                     return None
-            
-            return await loop.run_in_executor(None, _download_photo, url, self)
-            
+
+            try:
+                img_response = self.http.get(img_url, headers=headers, timeout=self.http_timeout)
+                img_response.raise_for_status()
+            except (requests.exceptions.HTTPError, requests.exceptions.RequestException) as e:
+                logger.debug("Ошибка скачивания %s: %s", img_url, e)
+                logger.debug("Пробуем yt-dlp fallback...")
+
+                img_url = None
+                try:
+                    with ydl_pool.lease(self.tiktok_fallback_opts, 'tiktok_fallback') as ydl:
+                        info = ydl.extract_info(resolved_url, download=False)
+                        logger.debug("yt-dlp info: %s", info.get('title', 'No title'))
+
+                        if 'thumbnails' in info and info['thumbnails']:
+                            for thumb in info['thumbnails']:
+                                if thumb.get('url') and any(size in str(thumb.get('width', 0)) for size in ['720', '1080', '640']):
+                                    img_url = thumb['url']
+                                    logger.debug("Найден thumbnail высокого качества: %s", img_url)
+                                    break
+
+                            if not img_url and info['thumbnails']:
+                                img_url = info['thumbnails'][-1]['url']
+                                logger.debug("Используем последний thumbnail: %s", img_url)
+
+                        if img_url:
+                            img_response = self.http.get(img_url, headers=headers, timeout=self.http_timeout)
+                            img_response.raise_for_status()
+                            logger.debug("Успешно скачали через yt-dlp fallback!")
+
+                except Exception as fallback_e:
+                    logger.debug("yt-dlp fallback тоже не сработал: %s", fallback_e)
+
+                if not img_url:
+                    logger.debug("TikTok фото не поддерживается yt-dlp")
+                    return "TIKTOK_PHOTO_NOT_SUPPORTED"
+
+            content_type = img_response.headers.get('content-type', '')
+            if 'jpeg' in content_type or 'jpg' in content_type:
+                ext = '.jpg'
+            elif 'png' in content_type:
+                ext = '.png'
+            elif 'webp' in content_type:
+                ext = '.webp'
+            else:
+                ext = '.jpg'
+
+            timestamp = str(int(time.time()))
+            filename = f'tiktok_photo_{timestamp}{ext}'
+
+            # Изображение уже целиком в памяти - отдаем его в Telegram без записи на диск
+            logger.info(f"TikTok фото успешно скачано: {filename}, {len(img_response.content)} байт")
+            return MediaFile(data=img_response.content, filename=filename)
+
+        except Exception as e:
+            logger.error(f"Ошибка при скачивании TikTok фото: {e}")
+            return None
+
+    async def download_tiktok_photo(self, url: str):
+        logger.info(f"download_tiktok_photo начинает работу с URL: {url}")
+        try:
+            resolved_url = await self.resolve_url(url)
+            logger.info("Начинаем скачивание TikTok фото через веб-скрапинг")
+
+            started = time.perf_counter()
+            html = await self.scrape_pool.run(self._fetch_tiktok_page, resolved_url)
+            logger.info(f"Страница TikTok загружена за {(time.perf_counter() - started) * 1000:.0f} мс")
+
+            # Разбор HTML - CPU-нагрузка, в режиме EXTRACTION_MODE=process идет в пул процессов
+            post_id_match = re.search(r'/photo/(\d+)', resolved_url)
+            post_id = post_id_match.group(1) if post_id_match else ''
+            started = time.perf_counter()
+            img_urls = await self.parse_pool.run(find_tiktok_image_urls, html, post_id)
+            logger.info(f"Разбор страницы TikTok занял {(time.perf_counter() - started) * 1000:.0f} мс")
+
+            if len(img_urls) > 1:
+                return await self.fetch_media_group([(img_url, 'photo', None) for img_url in img_urls])
+
+            img_url = img_urls[0] if img_urls else None
+            started = time.perf_counter()
+            media = await self.scrape_pool.run(self._download_tiktok_image, resolved_url, html, img_url)
+            logger.info(f"Изображение TikTok скачано за {(time.perf_counter() - started) * 1000:.0f} мс")
+            return media
+
         except Exception as e:
             logger.error(f"Ошибка при загрузке TikTok фото: {e}")
             return None
 
-    async def get_media_info(self, url: str) -> Optional[Dict]:
-        print(f"=== DEBUG START ===")
-        print(f"get_media_info вызван для URL: {url}")
-        print(f"URL type: {type(url)}")
-        print(f"URL repr: {repr(url)}")
-        
-        url_lower = url.lower()
-        has_tiktok = 'tiktok.com' in url_lower
-        has_photo = '/photo/' in url_lower
-        is_photo_direct = has_tiktok and has_photo
-        
-        print(f"Прямая проверка:")
-        print(f"  URL lower: {url_lower}")
-        print(f"  has_tiktok: {has_tiktok}")
-        print(f"  has_photo: {has_photo}")
-        print(f"  is_photo_direct: {is_photo_direct}")
-        
+    def get_info_opts(self, platform: str) -> Dict:
+        return self.info_opts.get(platform, self.info_opts['unknown'])
+
+    async def get_media_info(self, url: str, job: Optional[MediaJob] = None) -> Optional[Dict]:
+        url = await self.resolve_url(url)
+
         is_photo_method = self.is_tiktok_photo(url)
-        print(f"  is_photo_method: {is_photo_method}")
-        print(f"=== DEBUG END ===")
-        
-        logger.info(f"get_media_info вызван для URL: {url}")
-        
+        logger.info("get_media_info вызван для URL: %s", url)
+
         if is_photo_method:
             try:
-                print("DEBUG: Используем специальную обработку для TikTok фото")
                 logger.info("Используем специальную обработку для TikTok фото")
                 return {
                     'title': 'TikTok Photo',
@@ -484,106 +664,600 @@ class MediaDownloader:
                 logger.error(f"Ошибка получения информации TikTok фото: {e}")
                 return None
         
-        print("DEBUG: Используем yt-dlp для получения информации")
-        logger.info("Используем yt-dlp для получения информации")
+        logger.debug("Используем yt-dlp для получения информации")
         try:
-            loop = asyncio.get_event_loop()
             platform = self.detect_platform(url)
 
-            info_opts = {
-                **self.base_ydl_opts,
-                'quiet': True,
-                'no_warnings': True,
-            }
-            
-            if platform in self.platform_opts:
-                info_opts.update(self.platform_opts[platform])
+            cache_key = self.get_media_key(url) or url
+            # SQLite и разбор JSON - в потоке, не в event loop
+            cached = await asyncio.to_thread(self.metadata_cache.get, cache_key)
+            metrics.CACHE_REQUESTS.inc(cache='metadata', result='miss' if cached is None else 'hit')
+            if cached is not None:
+                if cached['error']:
+                    logger.info(f"Отрицательный результат из кэша для {cache_key}: {cached['error']}")
+                    return None
+                # Кэш каждый раз возвращает новый dict: загрузка может дополнять его
+                media_info = cached['info']
+                extracted = media_info.pop('extracted', None)
+                extracted_at = media_info.pop('extracted_at', 0)
+                # Скачивание переиспользует сохраненный info dict, пока ссылки форматов не устарели
+                if (job is not None and extracted is not None
+                        and time.time() - extracted_at < Config.METADATA_INFO_REUSE_SECONDS):
+                    job.info = extracted
+                logger.info(f"Метаданные {cache_key} взяты из кэша")
+                return media_info
 
-            def _get_info():
-                with yt_dlp.YoutubeDL(info_opts) as ydl:
-                    try:
-                        info = ydl.extract_info(url, download=False)
-                        return {
-                            'title': info.get('title', 'Unknown'),
-                            'duration': info.get('duration', 0),
-                            'uploader': info.get('uploader', 'Unknown'),
-                            'view_count': info.get('view_count', 0),
-                            'platform': platform,
-                            'upload_date': info.get('upload_date', ''),
-                            'thumbnail': info.get('thumbnail', ''),
-                            'filesize': info.get('filesize', 0),
-                            'formats': len(info.get('formats', [])),
-                        }
-                    except Exception as e:
-                        logger.error(f"Ошибка получения информации: {e}")
-                        return None
+            info, error = await self.info_pool.run(extract_info, url, self.get_info_opts(platform), f'info:{platform}')
+            if info is None:
+                if error and is_permanent_error(error):
+                    await asyncio.to_thread(self.metadata_cache.put_negative, cache_key, error)
+                return None
+
+            if job is not None:
+                job.info = info
+            media_info = {
+                'title': info.get('title', 'Unknown'),
+                'duration': info.get('duration', 0),
+                'uploader': info.get('uploader', 'Unknown'),
+                'view_count': info.get('view_count', 0),
+                'platform': platform,
+                'upload_date': info.get('upload_date', ''),
+                'thumbnail': info.get('thumbnail', ''),
+                'filesize': info.get('filesize', 0),
+                'formats': len(info.get('formats', [])),
+            }
 
-            return await loop.run_in_executor(None, _get_info)
+            await asyncio.to_thread(self._cache_media_info, {cache_key, self.get_media_key(url, info)},
+                                    media_info, info)
+            return media_info
 
         except Exception as e:
             logger.error(f"Ошибка при получении информации о медиа: {e}")
             return None
 
+    def _cache_media_info(self, keys: set, media_info: Dict, info: Dict):
+        entry = {**media_info, 'extracted': trim_info(info), 'extracted_at': time.time()}
+        for key in keys:
+            if key:
+                self.metadata_cache.put(key, entry)
+
     async def get_video_info(self, url: str) -> Optional[Dict]:
         return await self.get_media_info(url)
 
-    async def download_media(self, url: str) -> Optional[str]:
-        logger.info(f"download_media вызван для URL: {url}")
+    def can_stream(self, info: Dict) -> bool:
+        # Поток возможен только для одного прогрессивного формата по HTTP:
+        # DASH/HLS и раздельные видео+аудио требуют склейки через ffmpeg
+        return (
+            Config.STREAMING_ENABLED
+            and bool(info.get('url'))
+            and not info.get('requested_formats')
+            and info.get('protocol') in ('http', 'https')
+            # downloader_options (http_chunk_size у YouTube) - загрузка кусками против
+            # троттлинга, которую делает только загрузчик yt-dlp
+            and not info.get('downloader_options')
+        )
+
+    def _make_progress_reporter(self, job: Optional[MediaJob]) -> Callable[[int, int], None]:
+        # Прогресс приходит из потока загрузки; в event loop передаем только
+        # изменения целого процента, чтобы не засыпать его вызовами
+        if job is None or job.on_progress is None:
+            return lambda downloaded, total: None
+
+        loop = asyncio.get_running_loop()
+        last_percent = [-1]
+
+        def report(downloaded: int, total: int):
+            if not total:
+                return
+            percent = min(100, downloaded * 100 // total)
+            if percent != last_percent[0]:
+                last_percent[0] = percent
+                loop.call_soon_threadsafe(job.on_progress, percent)
+
+        return report
+
+    def _download_ranged(self, ydl: yt_dlp.YoutubeDL, info: Dict, job_id: str, connections: int,
+                         report_progress: Callable[..., None], cancelled: threading.Event,
+                         resume_key: Optional[str] = None, owner: Optional[str] = None) -> Optional[MediaFile]:
+        # Прогрессивный файл качается частями по Range в несколько соединений.
+        # None - сервер не поддерживает Range или файл мал: тогда обычный поток.
+        # Части качаются из нескольких потоков, поэтому запросы идут через общую
+        # сессию requests, а не через ydl.urlopen: экземпляр YoutubeDL не потокобезопасен.
+        # Заголовки и cookies yt-dlp считаются один раз в вызывающем потоке
+        headers = {**ydl._calc_headers(info, load_cookies=True), 'Accept-Encoding': 'identity'}
+        url = info['url']
+        host = urllib.parse.urlparse(url).hostname or ''
+
+        with self.host_limiter.connection(host):
+            with self.http.get(url, headers={**headers, 'Range': 'bytes=0-0'}, timeout=self.http_timeout,
+                               stream=True) as response:
+                content_range = response.headers.get('Content-Range') or ''
+                if response.status_code != 206 or '/' not in content_range:
+                    return None
+                try:
+                    total = int(content_range.rsplit('/', 1)[1])
+                except ValueError:
+                    return None
+
+        if total < Config.RANGED_MIN_SIZE or total > Config.TELEGRAM_MAX_FILE_SIZE:
+            return None
+
+        path = os.path.join(self.downloads_dir, f"media_{job_id}.{info.get('ext') or 'mp4'}")
+        temp_path = f'{path}.ranged'
+
+        parts = [
+            (start, min(start + Config.RANGED_PART_SIZE, total) - 1)
+            for start in range(0, total, Config.RANGED_PART_SIZE)
+        ]
+
+        # Части, скачанные в прошлой попытке, берутся из журнала, если файл на месте
+        done_parts = set()
+        if resume_key and os.path.exists(temp_path) and os.path.getsize(temp_path) == total:
+            done_parts = self._journal('get_parts', resume_key) or set()
+        else:
+            with open(temp_path, 'wb') as f:
+                f.truncate(total)
+        self.files.add(temp_path)
+
+        pending = [part for part in parts if part[0] not in done_parts]
+        lock = threading.Lock()
+        downloaded = [sum(end - start + 1 for start, end in parts if start in done_parts)]
+        if done_parts:
+            logger.info(f"Продолжаем загрузку по частям: готово {len(done_parts)} из {len(parts)}")
+
+        def fetch_part(part):
+            start, end = part
+            position = start
+            for attempt in range(Config.HTTP_RETRIES + 1):
+                try:
+                    with self.host_limiter.connection(host):
+                        response = self.http.get(url, headers={**headers, 'Range': f'bytes={position}-{end}'},
+                                                 timeout=self.http_timeout, stream=True)
+                        with response, open(temp_path, 'r+b') as f:
+                            if response.status_code != 206:
+                                raise IOError(f"Сервер вернул {response.status_code} вместо 206")
+
+                            f.seek(position)
+                            for chunk in response.iter_content(Config.STREAM_CHUNK_SIZE):
+                                if cancelled.is_set():
+                                    raise DownloadCancelled('Загрузка отменена')
+
+                                chunk = chunk[:end - position + 1]
+                                if not chunk:
+                                    break
+                                f.write(chunk)
+                                position += len(chunk)
+                                with lock:
+                                    downloaded[0] += len(chunk)
+                                    done = downloaded[0]
+                                report_progress(done, total)
+
+                    if position > end:
+                        if resume_key:
+                            with lock:
+                                done_parts.add(start)
+                                self._journal('set_parts', resume_key, owner, done_parts, temp_path)
+                        return
+                    raise IOError("Соединение закрыто до конца части")
+                except DownloadCancelled:
+                    raise
+                except Exception as e:
+                    if attempt == Config.HTTP_RETRIES:
+                        raise
+                    # Повтор продолжает часть с уже записанной позиции
+                    logger.warning(f"Повтор части {start}-{end} с позиции {position}: {e}")
+                    time.sleep(Config.HTTP_BACKOFF_FACTOR * 2 ** attempt)
+
+        started = time.perf_counter()
+        completed = False
+        try:
+            if pending:
+                with ThreadPoolExecutor(max_workers=min(connections, len(pending)),
+                                        thread_name_prefix=f'ranged-{job_id}') as executor:
+                    list(executor.map(fetch_part, pending))
+            os.replace(temp_path, path)
+            completed = True
+        finally:
+            # Без ключа журнала продолжить нельзя, и частичный файл не нужен
+            if not completed and not resume_key and os.path.exists(temp_path):
+                os.remove(temp_path)
+                self.files.discard(temp_path)
+
+        self.files.discard(temp_path)
+        self.files.add(path)
+        logger.info(
+            f"Медиа скачано по частям: {path}, {total} байт, {len(pending)} из {len(parts)} частей "
+            f"в {connections} соединений за {time.perf_counter() - started:.1f} с"
+        )
+        return MediaFile(path=path)
+
+    def _stream_media(self, ydl: yt_dlp.YoutubeDL, info: Dict, job_id: str,
+                      report_progress: Callable[..., None], cancelled: threading.Event,
+                      resume_key: Optional[str] = None) -> Optional[MediaFile]:
+        # Заголовки и cookies формата, как при --load-info-json
+        headers = ydl._calc_headers(info, load_cookies=True)
+        filename = f"media_{job_id}.{info.get('ext') or 'mp4'}"
+        path = os.path.join(self.downloads_dir, filename)
+        spill_path = f'{path}.part'
+
+        # Файл, перенесенный на диск в прошлой попытке, дописывается с места обрыва
+        offset = 0
+        if resume_key and os.path.exists(spill_path):
+            offset = os.path.getsize(spill_path)
+            headers = {**headers, 'Range': f'bytes={offset}-', 'Accept-Encoding': 'identity'}
+
+        buffer = io.BytesIO()
+        spill_file = None
+        total = 0
+        completed = False
+        keep_partial = bool(resume_key)
+        try:
+            with ydl.urlopen(Request(info['url'], headers=headers)) as response:
+                content_length = int(response.headers.get('Content-Length') or 0)
+
+                if offset:
+                    if response.status == 206:
+                        logger.info(f"Продолжаем потоковую загрузку с {offset} байт")
+                        spill_file = open(spill_path, 'ab')
+                        self.files.add(spill_path)
+                        buffer = None
+                        total = offset
+                        content_length = content_length and content_length + offset
+                    else:
+                        # Сервер отдал файл целиком: начинаем заново
+                        os.remove(spill_path)
+                        offset = 0
+
+                if content_length > Config.TELEGRAM_MAX_FILE_SIZE:
+                    logger.warning(f"Файл слишком большой: {content_length} байт")
+                    keep_partial = False
+                    return None
+
+                # Размер известен и больше буфера - пишем на диск сразу, без копии в памяти
+                if spill_file is None and content_length > Config.STREAM_BUFFER_BYTES:
+                    spill_file = open(spill_path, 'wb')
+                    self.files.add(spill_path)
+                    buffer = None
+
+                while True:
+                    if cancelled.is_set():
+                        raise DownloadCancelled('Загрузка отменена')
+
+                    chunk = response.read(Config.STREAM_CHUNK_SIZE)
+                    if not chunk:
+                        break
+
+                    total += len(chunk)
+                    if total > Config.TELEGRAM_MAX_FILE_SIZE:
+                        logger.warning(f"Скачиваемый поток превысил лимит: {total} байт")
+                        keep_partial = False
+                        return None
+
+                    # Буфер в памяти ограничен, дальше поток пишется на диск
+                    if spill_file is None and total > Config.STREAM_BUFFER_BYTES:
+                        spill_file = open(spill_path, 'wb')
+                        self.files.add(spill_path)
+                        spill_file.write(buffer.getbuffer())
+                        buffer = None
+
+                    if spill_file is not None:
+                        spill_file.write(chunk)
+                    else:
+                        buffer.write(chunk)
+
+                    report_progress(total, content_length)
+
+            completed = True
+        finally:
+            if spill_file is not None:
+                spill_file.close()
+                if not completed and not keep_partial and os.path.exists(spill_path):
+                    os.remove(spill_path)
+                    self.files.discard(spill_path)
+
+        if spill_file is not None:
+            os.replace(spill_path, path)
+            self.files.discard(spill_path)
+            self.files.add(path)
+            logger.info(f"Медиа скачано потоком с переносом на диск: {path}, {total} байт")
+            return MediaFile(path=path)
+
+        logger.info(f"Медиа скачано потоком в память: {total} байт")
+        # getbuffer() отдает содержимое буфера без копирования
+        return MediaFile(data=buffer.getbuffer(), filename=filename)
+
+    @staticmethod
+    def get_output_path(info: Optional[Dict]) -> Optional[str]:
+        # Итоговый путь после слияния форматов и постобработки yt-dlp кладет в requested_downloads
+        if not info:
+            return None
+        requested = info.get('requested_downloads') or []
+        if requested and requested[-1].get('filepath'):
+            return requested[-1]['filepath']
+        return info.get('filepath') or info.get('_filename')
+
+    def _register_leftover_files(self):
+        # Файлы прошлого запуска попадают в реестр один раз при старте
+        if not os.path.isdir(self.downloads_dir):
+            return
+        with os.scandir(self.downloads_dir) as entries:
+            for entry in entries:
+                if entry.is_file():
+                    self.files.add(entry.path, entry.stat().st_ctime)
+
+    def get_format_spec(self, is_photo: bool) -> str:
+        return 'best' if is_photo else self.base_ydl_opts['format']
+
+    def get_cached_media(self, cache_key: str) -> Optional[MediaFile]:
+        path = self.media_cache.acquire(cache_key)
+        if path is None:
+            return None
+        return MediaFile(path=path, on_remove=lambda: self.media_cache.release(cache_key))
+
+    def _cache_media(self, cache_key: str, media: MediaFile) -> MediaFile:
+        # Выполняется в потоке загрузки: файл переносится в кэш, байты из памяти записываются
+        try:
+            if media.in_memory:
+                path = self.media_cache.store(cache_key, data=media.data, ext=os.path.splitext(media.filename)[1])
+            else:
+                path = self.media_cache.store(cache_key, source_path=media.path, ext=os.path.splitext(media.path)[1])
+        except OSError as e:
+            logger.error(f"Не удалось сохранить {cache_key} в дисковый кэш: {e}")
+            return media
+
+        return MediaFile(path=path, on_remove=lambda: self.media_cache.release(cache_key))
+
+    @staticmethod
+    def is_carousel(info: Dict) -> bool:
+        # Только посты Instagram: плейлисты и каналы других платформ - не карусели
+        if info.get('extractor_key') != 'Instagram':
+            return False
+        if info.get('_type') == 'playlist':
+            return True
+        # Одиночное фото Instagram: форматов нет, только превью
+        return not info.get('formats') and not info.get('url') and bool(info.get('thumbnails'))
+
+    @staticmethod
+    def get_carousel_items(info: Dict) -> List[Tuple[str, str, Optional[Dict]]]:
+        # (url, тип, заголовки) для каждого элемента карусели
+        entries = info.get('entries') if info.get('_type') == 'playlist' else [info]
+
+        items = []
+        for entry in entries or []:
+            if not entry:
+                continue
+            if entry.get('url'):
+                items.append((entry['url'], 'video', entry.get('http_headers')))
+            elif entry.get('requested_formats'):
+                # Раздельные видео и аудио требуют склейки ffmpeg - такой элемент пропускаем
+                logger.warning(f"Элемент карусели {entry.get('id')} требует склейки форматов, пропущен")
+            elif entry.get('thumbnails'):
+                items.append((entry['thumbnails'][-1]['url'], 'photo', entry.get('http_headers')))
+        return items
+
+    def _fetch_group_item(self, url: str, media_type: str, headers: Optional[Dict], index: int,
+                          group_id: str) -> MediaFile:
+        # Элемент читается потоком с лимитом Telegram на файл; видео пишется сразу на диск
+        with self.http.get(url, headers=headers, timeout=self.http_timeout, stream=True) as response:
+            response.raise_for_status()
+
+            content_type = response.headers.get('content-type', '')
+            if media_type == 'video':
+                ext = '.mp4'
+            elif 'png' in content_type:
+                ext = '.png'
+            elif 'webp' in content_type:
+                ext = '.webp'
+            else:
+                ext = '.jpg'
+            filename = f'{index + 1:02d}{ext}'
+
+            content_length = int(response.headers.get('content-length') or 0)
+            if content_length > Config.TELEGRAM_MAX_FILE_SIZE:
+                raise ValueError(f"Элемент {filename} слишком большой: {content_length} байт")
+
+            path = None
+            output = io.BytesIO()
+            if media_type == 'video':
+                path = os.path.join(Config.DOWNLOADS_DIR, f"{group_id}_{filename}")
+                output = open(path, 'wb')
+                self.files.add(path)
+
+            completed = False
+            total = 0
+            try:
+                for chunk in response.iter_content(Config.STREAM_CHUNK_SIZE):
+                    total += len(chunk)
+                    if total > Config.TELEGRAM_MAX_FILE_SIZE:
+                        raise ValueError(f"Элемент {filename} превысил лимит: {total} байт")
+                    output.write(chunk)
+                completed = True
+            finally:
+                if path is not None:
+                    output.close()
+                    if not completed and os.path.exists(path):
+                        os.remove(path)
+                        self.files.discard(path)
+
+        if path is not None:
+            return MediaFile(path=path, filename=filename, media_type=media_type)
+        return MediaFile(data=output.getvalue(), filename=filename, media_type=media_type)
+
+    async def fetch_media_group(self, items: List[Tuple[str, str, Optional[Dict]]]) -> Optional[MediaGroup]:
+        # Элементы качаются параллельно, но не больше MEDIA_GROUP_FETCH_CONCURRENCY
+        # одновременно, чтобы одна карусель не заняла весь пул скрапинга
+        items = items[:Config.MAX_MEDIA_GROUP_ITEMS]
+        semaphore = asyncio.Semaphore(Config.MEDIA_GROUP_FETCH_CONCURRENCY)
+        group_id = uuid.uuid4().hex[:16]
+
+        async def fetch(index: int, item: Tuple[str, str, Optional[Dict]]) -> MediaFile:
+            url, media_type, headers = item
+            async with semaphore:
+                return await self.scrape_pool.run(self._fetch_group_item, url, media_type, headers, index, group_id)
+
+        started = time.perf_counter()
+        results = await asyncio.gather(*[fetch(i, item) for i, item in enumerate(items)], return_exceptions=True)
+
+        files = []
+        for result in results:
+            if isinstance(result, MediaFile):
+                files.append(result)
+            else:
+                logger.warning(f"Не удалось скачать элемент карусели: {result}")
+
+        logger.info(f"Карусель: скачано {len(files)} из {len(items)} за {(time.perf_counter() - started) * 1000:.0f} мс")
+        return MediaGroup(files) if files else None
+
+    async def download_media(self, url: str, job: Optional[MediaJob] = None):
+        logger.info("download_media вызван для URL: %s", url)
+        url = await self.resolve_url(url)
         
         if self.is_tiktok_photo(url):
             logger.info("Переход к download_tiktok_photo")
-            return await self.download_tiktok_photo(url)
+            media = await self.download_tiktok_photo(url)
+            if isinstance(media, MediaGroup):
+                metrics.DOWNLOADED_BYTES.inc(sum(item.size for item in media.items), platform='tiktok')
+            elif isinstance(media, MediaFile):
+                metrics.DOWNLOADED_BYTES.inc(media.size, platform='tiktok')
+            return media
         
         try:
-            loop = asyncio.get_event_loop()
             platform = self.detect_platform(url)
             is_photo = '/photo/' in url.lower()
+            report_progress = self._make_progress_reporter(job)
 
-            def _download():
-                output_path = None
-                timestamp = str(int(time.time()))
+            job_id = job.id if job is not None else uuid.uuid4().hex[:16]
 
-                download_opts = {
-                    **self.base_ydl_opts,
-                    'outtmpl': os.path.join(self.downloads_dir, f'media_{timestamp}_%(title).50s.%(ext)s'),
-                }
-                
-                if is_photo:
-                    download_opts['format'] = 'best'
-                
-                if platform in self.platform_opts:
-                    download_opts.update(self.platform_opts[platform])
-
-                with yt_dlp.YoutubeDL(download_opts) as ydl:
-                    try:
-                        info = ydl.extract_info(url, download=False)
+            # Info dict нужен до загрузки: карусели скачиваются в обход yt-dlp
+            info = job.info if job is not None else None
+            if info is None:
+                info, error = await self.info_pool.run(extract_info, url, self.get_info_opts(platform), f'info:{platform}')
+                if info is None:
+                    logger.error(f"Не удалось получить информацию для загрузки: {error}")
+                    return None
+                if job is not None:
+                    job.info = info
+
+            if self.is_carousel(info):
+                group = await self.fetch_media_group(self.get_carousel_items(info))
+                if group is not None:
+                    metrics.DOWNLOADED_BYTES.inc(sum(item.size for item in group.items), platform=platform)
+                return group
 
+            # Формат выбирается по списку formats до загрузки: лучший прогрессивный файл в бюджете
+            planned = None if is_photo else plan_format(info)
+            if planned is not None:
+                logger.info(
+                    f"Выбран формат {planned.get('format_id')}: {planned.get('height') or '?'}p, "
+                    f"~{estimate_size(planned, info.get('duration')) or '?'} байт"
+                )
+                info = {**info, **planned}
+                info.pop('requested_formats', None)
+
+            # Ключ медиа и выбранного формата: строится после planning, чтобы при смене
+            # лимитов тот же ключ не указывал на файл в другом качестве
+            media_key = self.get_media_key(url, info)
+            format_key = None
+            if media_key:
+                format_key = f"{media_key}|{planned['format_id'] if planned else self.get_format_spec(is_photo)}"
+
+            cache_key = None
+            if self.media_cache is not None and format_key:
+                cache_key = format_key
+                cached = self.get_cached_media(cache_key)
+                metrics.CACHE_REQUESTS.inc(cache='media', result='miss' if cached is None else 'hit')
+                if cached is not None:
+                    logger.info(f"Медиа {cache_key} взято из дискового кэша")
+                    return cached
+
+            # Ключ журнала: то же медиа в том же формате продолжается под прежним id задания.
+            # Пока запись арендована другой загрузкой, эта качает под своим id без журнала
+            journal_key = format_key
+            owner = job_id
+
+            cancelled = job.cancelled if job is not None else threading.Event()
+            partial_paths = set()
+
+            def _download(job_id: str, resume_key: Optional[str]):
+                def track_progress(downloaded: int, total: int, path: Optional[str] = None):
+                    report_progress(downloaded, total)
+                    # .part-файл yt-dlp попадает в реестр, чтобы очистка удалила его после неудачи
+                    if path and path not in partial_paths:
+                        partial_paths.add(path)
+                        self.files.add(path)
+                    if resume_key:
+                        self._journal('progress', resume_key, owner, downloaded, total, path)
+
+                def _progress_hook(progress: Dict):
+                    # Исключение из хука прерывает загрузку yt-dlp, .part-файл остается для продолжения
+                    if cancelled.is_set():
+                        raise DownloadCancelled('Загрузка отменена')
+
+                    if progress.get('status') == 'downloading':
+                        track_progress(
+                            progress.get('downloaded_bytes') or 0,
+                            progress.get('total_bytes') or progress.get('total_bytes_estimate') or 0,
+                            progress.get('tmpfilename')
+                        )
+
+                download_opts = self.download_opts.get(platform, self.download_opts['unknown'])
+                connections = download_opts['concurrent_fragment_downloads']
+
+                # Имя файла, формат и хук прогресса - свои у каждого задания, остальное берется из пула
+                with ydl_pool.lease(
+                    download_opts,
+                    f'download:{platform}',
+                    outtmpl=os.path.join(self.downloads_dir, f'media_{job_id}_%(title).50s.%(ext)s'),
+                    format_spec=planned['format_id'] if planned else self.get_format_spec(is_photo),
+                    progress_hook=_progress_hook
+                ) as ydl:
+                    try:
                         filesize = info.get('filesize') or info.get('filesize_approx', 0)
                         if filesize and filesize > Config.TELEGRAM_MAX_FILE_SIZE:
                             logger.warning(f"Файл слишком большой: {filesize} байт")
                             return None
 
-                        ydl.download([url])
+                        if not is_photo and self.can_stream(info):
+                            if connections > 1:
+                                try:
+                                    media = self._download_ranged(ydl, info, job_id, connections,
+                                                                  track_progress, cancelled, resume_key, owner)
+                                    if media is not None:
+                                        return media
+                                except DownloadCancelled:
+                                    raise
+                                except Exception as e:
+                                    logger.warning(f"Загрузка по частям не удалась, качаем одним потоком: {e}")
+
+                            try:
+                                return self._stream_media(ydl, info, job_id, track_progress, cancelled, resume_key)
+                            except DownloadCancelled:
+                                raise
+                            except Exception as e:
+                                logger.warning(f"Потоковая загрузка не удалась, скачиваем на диск: {e}")
 
-                        extensions = ['.mp4', '.webm', '.mkv', '.avi', '.mov', '.jpg', '.jpeg', '.png', '.webp']
-                        for file in os.listdir(self.downloads_dir):
-                            if file.startswith(f'media_{timestamp}_') and any(file.endswith(ext) for ext in extensions):
-                                output_path = os.path.join(self.downloads_dir, file)
-                                break
+                        result = ydl.process_ie_result(info, download=True)
+                        output_path = self.get_output_path(result)
+                        if output_path:
+                            self.files.add(output_path)
 
                         if output_path and os.path.exists(output_path):
                             actual_size = os.path.getsize(output_path)
                             if actual_size > Config.TELEGRAM_MAX_FILE_SIZE:
                                 os.remove(output_path)
+                                self.files.discard(output_path)
                                 logger.warning(f"Скачанный файл слишком большой: {actual_size} байт")
                                 return None
 
                             logger.info(f"Медиа успешно скачано: {output_path}")
-                            return output_path
+                            return MediaFile(path=output_path)
                         else:
                             logger.error("Не удалось найти скачанный файл")
                             return None
 
+                    except DownloadCancelled:
+                        logger.warning(f"Загрузка {job_id} остановлена, частичный файл сохранен для продолжения")
+                        return None
                     except yt_dlp.DownloadError as e:
                         logger.error(f"Ошибка загрузки yt-dlp: {e}")
                         return None
@@ -591,10 +1265,43 @@ class MediaDownloader:
                         logger.error(f"Неожиданная ошибка при загрузке: {e}")
                         return None
 
-            return await asyncio.wait_for(
-                loop.run_in_executor(None, _download),
-                timeout=Config.DOWNLOAD_TIMEOUT
-            )
+            def _download_and_cache():
+                # Журнал - общая база бота и воркеров: аренда берется в потоке пула,
+                # ожидание блокировки SQLite не останавливает event loop
+                resume_key = None
+                download_id = job_id
+                if journal_key:
+                    journal_job_id = self._journal('start', journal_key, owner, url)
+                    if journal_job_id is not None:
+                        resume_key = journal_key
+                        download_id = journal_job_id
+
+                try:
+                    media = _download(download_id, resume_key)
+                except BaseException:
+                    if resume_key:
+                        self._journal('release', resume_key, owner)
+                    raise
+                if isinstance(media, MediaFile):
+                    metrics.DOWNLOADED_BYTES.inc(media.size, platform=platform)
+                if resume_key:
+                    if media is not None:
+                        self._journal('finish', resume_key, owner)
+                    else:
+                        self._journal('release', resume_key, owner)
+                if isinstance(media, MediaFile) and cache_key:
+                    return self._cache_media(cache_key, media)
+                return media
+
+            try:
+                return await asyncio.wait_for(
+                    self.download_pool.run(_download_and_cache),
+                    timeout=Config.DOWNLOAD_TIMEOUT
+                )
+            except (asyncio.TimeoutError, asyncio.CancelledError):
+                # Поток пула не прерывается отменой future - останавливаем его сами
+                cancelled.set()
+                raise
 
         except asyncio.TimeoutError:
             logger.error("Тайм-аут загрузки медиа")
@@ -603,28 +1310,43 @@ class MediaDownloader:
             logger.error(f"Ошибка при загрузке медиа: {e}")
             return None
 
-    async def download_video(self, url: str) -> Optional[str]:
+    async def download_video(self, url: str):
         return await self.download_media(url)
 
-    def cleanup_old_files(self, max_age_hours: int = 1):
+    def _journal(self, action: str, *args):
+        # Учет в журнале не должен прерывать загрузку: ошибка SQLite (database is locked)
+        # только записывается в лог, загрузка идет дальше без продолжения
         try:
-            import time
-
-            current_time = time.time()
-            max_age_seconds = max_age_hours * 3600
-
-            for filename in os.listdir(self.downloads_dir):
-                file_path = os.path.join(self.downloads_dir, filename)
+            return getattr(self.journal, action)(*args)
+        except Exception as e:
+            logger.debug("Ошибка журнала загрузок (%s): %s", action, e)
+            return None
 
-                if os.path.isfile(file_path):
-                    file_age = current_time - os.path.getctime(file_path)
+    def cleanup_old_files(self, max_age_hours: int = 1):
+        # Частичные файлы загрузок, которые уже не продолжат
+        for file_path in self.journal.prune():
+            try:
+                os.remove(file_path)
+                logger.info(f"Удален частичный файл: {os.path.basename(file_path)}")
+            except FileNotFoundError:
+                pass
+            except Exception as e:
+                logger.error(f"Ошибка удаления файла {file_path}: {e}")
+                continue
+            self.files.discard(file_path)
 
-                    if file_age > max_age_seconds:
-                        try:
-                            os.remove(file_path)
-                            logger.info(f"Удален старый файл: {filename}")
-                        except Exception as e:
-                            logger.error(f"Ошибка удаления файла {filename}: {e}")
+        try:
+            for file_path in self.files.expired(max_age_hours * 3600):
+                try:
+                    os.remove(file_path)
+                    logger.info(f"Удален старый файл: {os.path.basename(file_path)}")
+                except FileNotFoundError:
+                    # Файл уже удален после отправки или перенесен в дисковый кэш
+                    pass
+                except Exception as e:
+                    logger.error(f"Ошибка удаления файла {file_path}: {e}")
+                    continue
+                self.files.discard(file_path)
 
         except Exception as e:
             logger.error(f"Ошибка очистки файлов: {e}")
@@ -636,7 +1358,7 @@ class MediaDownloader:
     @staticmethod
     def is_supported_url(url: str) -> bool:
         try:
-            with yt_dlp.YoutubeDL({'quiet': True}) as ydl:
+            with ydl_pool.lease({'quiet': True}, 'check') as ydl:
                 ydl.extract_info(url, download=False)
                 return True
         except: